@@ -1,6 +1,6 @@
 from stable_baselines3 import PPO
 from stable_baselines3.common.monitor import Monitor
-from stable_baselines3.common.vec_env import DummyVecEnv, VecNormalize
+from stable_baselines3.common.vec_env import DummyVecEnv, VecMonitor, VecNormalize
 import logging
 import traceback
 from callbacks import LogMetricsCallback, EarlyStoppingCallback
@@ -8,14 +8,24 @@ import math
 import time
 import os
 from reporting import plot_training_metrics
+from vec_env import BatchedTradingEnv, make_subproc_env
 
 import cProfile
 import pstats
 
 class TradingAgent:
     def __init__(self, train_env, eval_env, test_env, training_params=None, financial_params=None, output_dir='.'):
-        # Wrap the environment with Monitor and DummyVecEnv
-        self.train_env = DummyVecEnv([lambda: Monitor(train_env)])
+        # Wrap the environment with Monitor and DummyVecEnv, simulate several episodes at once,
+        # or run workers in subprocesses sharing a memory-mapped copy of the data matrix. Runs
+        # that do not train only evaluate, so they never start the parallel environments
+        self.shared_data = None
+        vec_env = training_params.get('vec_env', 'dummy') if training_params.get('train_model', True) else 'dummy'
+        if vec_env == 'batched':
+            self.train_env = VecMonitor(BatchedTradingEnv.from_env(train_env, training_params.get('num_envs', 1)))
+        elif vec_env == 'subproc':
+            self.train_env, self.shared_data = make_subproc_env(train_env, training_params.get('num_workers', os.cpu_count()), training_params.get('seed'))
+        else:
+            self.train_env = DummyVecEnv([lambda: Monitor(train_env)])
         self.train_env = VecNormalize(self.train_env, norm_obs=True, norm_reward=True, clip_obs=10.)
         
         # Extract initial values for clip_range and learning_rate
@@ -55,6 +65,13 @@ class TradingAgent:
         self.test_env = DummyVecEnv([lambda: Monitor(test_env)])
         self.test_env = VecNormalize(self.test_env, norm_obs=True, norm_reward=True, clip_obs=10.)
         
+    def close(self):
+        """Stop the training workers and release the shared data matrix."""
+        self.train_env.close()
+        if self.shared_data is not None:
+            self.shared_data.close()
+            self.shared_data = None
+
     @staticmethod
     def linear_schedule(initial_value=3e-4):
         """
@@ -1,53 +1,48 @@
+import os
+import shutil
+import tempfile
 import unittest
 import logging
-import traceback
 from parameters import selected_params, training_params
 from utilities import initialize_environments
+from monte_carlo import make_scenarios, run_monte_carlo, summarize
 
 class TestTradingAgent(unittest.TestCase):
-    
+
     def setUp(self):
-        
-        self.train_env, self.eval_env, self.test_env, self.agent, self.market_conditions = initialize_environments(selected_params, training_params) 
 
-    def generate_random_market_conditions(self):
-        # Implement logic to generate random market conditions
-        # This could involve randomizing price movements, volatility, etc.
-        pass
+        self.train_env, self.eval_env, self.test_env, self.agent, self.market_conditions = initialize_environments(selected_params, training_params)
+
+        # The workers load the policy from disk once each
+        self.directory = tempfile.mkdtemp()
+        self.model_path = os.path.join(self.directory, 'model')
+        self.agent.model.save(self.model_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
 
     def test_monte_carlo_analysis(self):
         num_simulations = 100  # Number of Monte Carlo simulations
         initial_balance = 100  # Low initial balance for testing
 
-        results = []
+        # Seeded synthetic regime mixes and bootstrap resamples of the test data
+        scenarios = make_scenarios(num_simulations, seed=selected_params.get('seed'))
+        params = dict(self.test_env.params, initial_balance=initial_balance)
 
-        for _ in range(num_simulations):
-            # Generate random market conditions
-            random_conditions = self.generate_random_market_conditions()
-            
-            # Initialize environments with random conditions
-            self.train_env, self.eval_env, self.test_env, self.agent, _ = initialize_environments(selected_params, training_params, random_conditions)
-            
-            # Set a low initial balance
-            self.test_env.initial_balance = initial_balance
-            
-            try:
-                # Evaluate the agent
-                _, _, _, _, net_worths = self.agent.evaluate(episodes=training_params['num_episodes'])
-                
-                # Calculate net profit
-                net_profit = sum(net_worths) / training_params['num_episodes'] - initial_balance
-                results.append(net_profit)
-                
-            except Exception as e:
-                logging.error(f"Simulation failed with exception: {e}")
-                logging.error(traceback.format_exc())
-                results.append(None)
+        results = []
+        for summary in run_monte_carlo(self.model_path, self.test_env.data_matrix, self.test_env.timestamps, self.test_env.mapping, params, scenarios):
+            if summary['error'] is not None:
+                logging.error(f"Simulation {summary['run']} failed with exception: {summary['error']}")
+            results.append(summary)
 
         # Analyze results
-        successful_runs = [result for result in results if result is not None]
-        average_profit = sum(successful_runs) / len(successful_runs) if successful_runs else 0
+        study = summarize(results)
+        average_profit = study['mean_net_profit'] if study['failed'] < num_simulations else 0
         print(f"Average Net Profit over {num_simulations} simulations: {average_profit:.2f}")
+        print(f"Probability of profit: {study['probability_of_profit']:.2%}, mean max drawdown: {study['mean_max_drawdown']:.2%}, mean reliability: {study['mean_reliability']:.2%}")
 
         # Assert that the strategy is profitable on average
         self.assertTrue(average_profit > 0, "Strategy should be profitable on average")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -34,8 +34,8 @@ class TestTradingAgent(unittest.TestCase):
         # Test if the evaluate method runs without errors
         try:
             # Calculate and print the period from the timestamps
-            start_time = self.test_env.timestamps[0]
-            end_time = self.test_env.timestamps[-1]
+            start_time = pd.Timestamp(self.test_env.timestamps[0])
+            end_time = pd.Timestamp(self.test_env.timestamps[-1])
             period = end_time - start_time
             days_covered = period.days
             
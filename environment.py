@@ -4,7 +4,11 @@ import numpy as np
 import logging
 from rewards import calculate_reward
 import matplotlib.pyplot as plt
-from utilities import get_liquidation_threshold, handle_risk_management_optimized, ACTIONS_AVAILABLE
+from utilities import get_liquidation_threshold, get_risk_management_1s, first_hits_ragged, RISK_LEVELS, ACTIONS_AVAILABLE
+from positions import PositionBook, TradeStats, epoch_ns
+from market_index import FractalIndex, IntrabarIndex, RollingStats, ShardedIntrabarIndex
+from trade_log import TradeLog
+from market_store import shared_market_data_provider
 import pandas as pd
 import glob
 
@@ -38,18 +42,23 @@ class TradingEnvironment(gym.Env):
             'trailing_stop_percent': 0.02,  # Default to 2% trailing stop
         }
         
-        self.previous_returns = [0] * len(self.params['symbols'])  # Initialize previous returns to zero for each symbol
-        self.holding_duration = [0] * len(self.params['symbols'])  # Initialize holding duration to zero for each symbol
+        self.previous_returns = np.zeros(len(self.params['symbols']))  # Initialize previous returns to zero for each symbol
+        self.holding_duration = np.zeros(len(self.params['symbols']))  # Initialize holding duration to zero for each symbol
         self.actions_available = ACTIONS_AVAILABLE
         
         # Ensure the environment supports rendering
         self.render_mode = render_mode  # or 'rgb_array' if preferred
-        self.history = []
+        self.history = TradeLog(self.params['symbols'], spill_threshold=self.params.get('history_spill_threshold'))  # Columnar store of the closed trades
+        self.trade_stats = TradeStats(self.params.get('kelly_window', 100))  # Recent trades used for Kelly sizing
         self.reward_function = reward_function
         
         self.data_matrix = data_matrix
-        self.timestamps = timestamps
+        self.timestamps = epoch_ns(timestamps)  # Candle open times in epoch nanoseconds
         self.mapping = mapping
+        self.fractal_index = FractalIndex(mapping)  # Latest fractal levels per step and symbol
+        self.fractal_index.update(data_matrix)
+        self.rolling_stats = RollingStats(mapping)  # Window means and volatility used to size leverage
+        self.rolling_stats.update(data_matrix)
         # self.symbols = self.params.symbols if self.params else ['BTC', 'ETH']
 
         # Define action and observation space
@@ -62,11 +71,11 @@ class TradingEnvironment(gym.Env):
         # Initialize state
         self.current_step = 0
         self.balance = self.params['initial_balance']
-        self.positions = [{} for _ in range(self.num_symbols)]  # Initialize as a list of dictionaries
+        self.book = PositionBook(self.num_symbols)  # Struct-of-arrays store of the open positions
         self.net_worth = self.params['initial_balance']
 
         self.cooldown_period = self.params['cooldown_period']  # Define the cooldown period in steps
-        self.cooldowns = [0] * self.num_symbols  # Initialize cooldowns for each symbol
+        self.cooldowns = np.zeros(self.num_symbols, dtype=int)  # Initialize cooldowns for each symbol
         
         # Initialize counters for fractal and percentage calculations
         self.fractal_counter = 0
@@ -74,14 +83,32 @@ class TradingEnvironment(gym.Env):
         self.fallback_counter = 0
 
         # Check if market_data is None or empty
+        self.intrabar_index = None
         if not self.params['basic_risk_mgmt']:
-            if market_data is None or len(market_data) == 0:
-                self.market_data = self.fetch_market_data()
+            # The store of generated data takes over the one of the environment variable
+            market_store_path = self.params.get('market_store_path') or os.getenv('MARKET_STORE_PATH')
+            if (market_data is None or len(market_data) == 0) and market_store_path:
+                # Day shards of the binary store are loaded on first access, in a cache shared by the process
+                self.market_data = None
+                provider = shared_market_data_provider(market_store_path, self.params.get('market_data_memory_mb', 1024) * 2**20)
+                self.intrabar_index = ShardedIntrabarIndex(provider, self.params['symbols'])
             else:
-                self.market_data = market_data
+                if market_data is None or len(market_data) == 0:
+                    self.market_data = self.fetch_market_data()
+                else:
+                    self.market_data = market_data
+                # Sorted 1s arrays and the rows of every candle, looked up instead of masked at every step
+                self.intrabar_index = IntrabarIndex(self.market_data)
+            self.intrabar_index.update(self.timestamps)
+            self.risk_management_1s = get_risk_management_1s(self.params.get('risk_kernel', 'auto'))
 
         self.trailing_stop_percent = self.params.get('trailing_stop_percent', 0.02)  # Default to 2% trailing stop
 
+        # 'scalar' walks the symbols one by one, 'vectorized' processes them as arrays
+        self.step_mode = self.params.get('step_mode', 'scalar')
+        if self.step_mode not in ('scalar', 'vectorized'):
+            raise ValueError(f"Unknown step mode: {self.step_mode}")
+
         # Initialize episode counter
         self.episode_counter = 1
         self.num_episodes = self.params.get('num_episodes', 1)
@@ -90,9 +117,36 @@ class TradingEnvironment(gym.Env):
         
         self.episodes_below_min_balance = 0  # Initialize counter for episodes with balance below min
         
+    @property
+    def positions(self):
+        """Dictionary view of the position book, used for infos and the live order path."""
+        return self.book.view()
+
     def update_data(self, data_matrix, timestamps):
         self.data_matrix = data_matrix
-        self.timestamps = timestamps
+        self.timestamps = epoch_ns(timestamps)
+        if self.intrabar_index is not None:
+            self.intrabar_index.update(self.timestamps)
+        self.fractal_index.update(data_matrix)
+        self.rolling_stats.update(data_matrix)
+
+    def append_data(self, data_matrix, timestamps, replaced=False):
+        """
+        Use the data matrix of the live feature window after a candle was appended to it.
+
+        The fractal levels and rolling statistics are extended by the latest candle instead
+        of rebuilt, so the cost of a live candle does not depend on the window length.
+
+        :param data_matrix: The data matrix slid by one candle, or with its latest candle replaced.
+        :param timestamps: The matching timestamps.
+        :param replaced: Whether the latest candle was replaced instead of a new one added.
+        """
+        self.data_matrix = data_matrix
+        self.timestamps = epoch_ns(timestamps)
+        if self.intrabar_index is not None:
+            self.intrabar_index.update(self.timestamps)
+        self.fractal_index.append(data_matrix, replaced)
+        self.rolling_stats.append(data_matrix, replaced)
 
     def reset(self, seed=None):
         super().reset(seed=seed)
@@ -108,18 +162,25 @@ class TradingEnvironment(gym.Env):
             if len(self.timestamps) < self.data_matrix.shape[0]:
                 logging.info("Trimming data_matrix to match timestamps length")
                 self.data_matrix = self.data_matrix[:len(self.timestamps), :, :]
+                self.fractal_index.update(self.data_matrix)
+                self.rolling_stats.update(self.data_matrix)
             else:
                 logging.info("Trimming timestamps to match data_matrix length") 
                 self.timestamps = self.timestamps[:self.data_matrix.shape[0]]
+                if self.intrabar_index is not None:
+                    self.intrabar_index.update(self.timestamps)
 
         # Set current_step based on live_mode
         if self.live_mode:
             self.current_step = len(self.data_matrix) - 1  # Start at the last valid step for live mode
+        elif self.params.get('random_start', 0):
+            # Start anywhere in the first fraction of the data, so seeded workers replay different episodes
+            self.current_step = int(self.np_random.integers(0, max(1, int(len(self.timestamps) * self.params['random_start']))))
         else:
             self.current_step = 0  # Start at the beginning for backtesting
 
         self.balance = self.params['initial_balance']
-        self.positions = [{} for _ in range(self.num_symbols)]  # Initialize as a list of dictionaries
+        self.book.reset()
         self.net_worth = self.params['initial_balance']
         return self.next_observation(), {}
     
@@ -144,7 +205,7 @@ class TradingEnvironment(gym.Env):
         # Add balance, net worth, and positions to the observation
         balance_array = np.array([self.balance])
         net_worth_array = np.array([self.net_worth])
-        positions_array = np.array([pos.get('position_size', 0) for pos in self.positions])
+        positions_array = self.book.position_size
         
         # Concatenate the additional information to the observation
         extended_observation = np.concatenate((observation.flatten(), balance_array, net_worth_array, positions_array))
@@ -241,8 +302,8 @@ class TradingEnvironment(gym.Env):
     
     def compute_fractal_prices(self, symbol_index, type, current_price, leverage):
         # Calculate fractal levels
-        fractal_high = self.calculate_fractal_high(self.current_step, symbol_index)
-        fractal_low = self.calculate_fractal_low(self.current_step, symbol_index)
+        # Fractal levels come from the precomputed index rather than a backward scan
+        fractal_high, fractal_low = self.fractal_index.lookup(self.current_step, symbol_index)
         
         # Determine SL and TP based on fractals
         if fractal_low is not None and fractal_high is not None:
@@ -290,31 +351,11 @@ class TradingEnvironment(gym.Env):
 
     def calculate_trade_statistics(self):
         """
-        Calculate win probability and win/loss ratio from the trade history.
+        Calculate win probability and win/loss ratio from the last kelly_window trades.
         
         :return: Tuple containing win probability and win/loss ratio.
         """
-        # Limit the history to the last N trades for performance
-        recent_history = self.history[-100:]  # Adjust the number as needed
-
-        if not recent_history:
-            return 0, 0  # No trades have been made
-
-        wins = [trade for trade in recent_history if trade['pnl'] > 0]
-        losses = [trade for trade in recent_history if trade['pnl'] < 0]
-
-        num_wins = len(wins)
-        num_losses = len(losses)
-        total_trades = num_wins + num_losses
-
-        win_probability = num_wins / total_trades if total_trades > 0 else 0
-
-        average_win = np.mean([trade['pnl'] for trade in wins]) if num_wins > 0 else 0
-        average_loss = np.mean([trade['pnl'] for trade in losses]) if num_losses > 0 else 0
-
-        win_loss_ratio = average_win / abs(average_loss) if average_loss != 0 else 0
-
-        return win_probability, win_loss_ratio
+        return self.trade_stats.statistics()
 
     def open_position(self, symbol_index, type, current_price):
         # Add bounds check at the start - subtract 1 from length since arrays are 0-based
@@ -368,113 +409,151 @@ class TradingEnvironment(gym.Env):
         borrowing_fee = collateral * self.params['borrowing_fee_per_hour']
         self.balance -= borrowing_fee
         
-        self.positions[symbol_index] = {
-            'open_time': self.timestamps[self.current_step],
-            'type': type,
-            'entry_price': adjusted_price,
-            'leverage': round(leverage),
-            'collateral': round(collateral),
-            'position_size': round(position_size, 3),
-            'sl_price': sl_price,
-            'tp_price': tp_price,
-            'liq_price': liq_price,
-            'max_price': max_price,
-            'borrowing_fee': borrowing_fee,  # Added borrowing_fee to position data
-            'trailing_stop': None,  # Initialize trailing stop
-            'balance': self.balance,
-            'risk_per_trade': risk_per_trade,
-        }
+        self.book.open(
+            symbol_index,
+            type,
+            open_step=self.current_step,
+            open_time=self.timestamps[self.current_step],
+            entry_price=adjusted_price,
+            leverage=round(leverage),
+            collateral=round(collateral),
+            position_size=round(position_size, 3),
+            sl_price=sl_price,
+            tp_price=tp_price,
+            liq_price=liq_price,
+            max_price=max_price,
+            borrowing_fee=borrowing_fee,
+            balance=self.balance,
+            risk_per_trade=risk_per_trade,
+        )
         self.balance -= collateral
         self.cooldowns[symbol_index] = self.cooldown_period  # Set cooldown after opening a position
         
         return collateral, leverage, tp_price, sl_price  # Ensure a tuple is returned
         
     def close_position(self, symbol_index, exit_price, exit_reason="std", exit_time=None):
-        position = self.positions[symbol_index]
-        if not position:
+        if not self.book.side[symbol_index]:
             return
-        
-        entry_price = position['entry_price']
-        position_size = position['position_size']
-        leverage = position['leverage']
-        collateral = position['collateral']
-        
+
+        closes = self.prepare_closes([symbol_index], [exit_price], [exit_reason], [exit_time])
+        if closes is not None:
+            self.commit_closes(closes)
+
+    def prepare_closes(self, symbol_indices, exit_prices, exit_reasons, exit_times=None):
+        """
+        Compute the fees, slippage, PnL and borrowing costs of closing several positions at once.
+
+        Nothing is written to the environment; the result is applied with commit_closes, which
+        lets the caller interleave the closes with other balance updates in symbol order.
+
+        :param symbol_indices: Indices of the symbols to close, all holding a position.
+        :param exit_prices: Exit price for each symbol.
+        :param exit_reasons: Exit reason for each symbol.
+        :param exit_times: Optional exit time for each symbol, None to use the current candle.
+        :return: Dictionary of arrays aligned with symbol_indices, or None if current_step is out of bounds.
+        """
+        # Ensure current_step is within bounds
+        if self.current_step >= len(self.timestamps):
+            logging.error(f"current_step {self.current_step} is out of bounds for timestamps with length {len(self.timestamps)}")
+            return None
+
+        book = self.book
+        symbol_indices = np.asarray(symbol_indices, dtype=int)
+        exit_prices = np.asarray(exit_prices, dtype=float)
+        side = book.side[symbol_indices]
+        entry_price = book.entry_price[symbol_indices]
+        position_size = book.position_size[symbol_indices]
+        leverage = book.leverage[symbol_indices]
+        collateral = book.collateral[symbol_indices]
+
         # Adjust exit price for slippage and bid-ask spread
-        if position['type'] == 'long':
-            adjusted_exit_price = exit_price * (1 - self.params['slippage'] - self.params['bid_ask_spread'])
-        elif position['type'] == 'short':
-            adjusted_exit_price = exit_price * (1 + self.params['slippage'] + self.params['bid_ask_spread'])
+        adjusted_exit_price = np.where(
+            side == 1,
+            exit_prices * (1 - self.params['slippage'] - self.params['bid_ask_spread']),
+            exit_prices * (1 + self.params['slippage'] + self.params['bid_ask_spread'])
+        )
 
-        # Calculate PnL
+        # Calculate PnL, reversed for short positions
         pnl = (adjusted_exit_price - entry_price) * position_size * leverage
-        if position['type'] == 'short':
-            pnl = -pnl  # Reverse PnL for short positions
+        pnl = np.where(side == -1, -pnl, pnl)
 
-        # Calculate fees
+        # Calculate fees and the amount returned to the balance
         fee = adjusted_exit_price * self.params['trading_fee'] * position_size
-
-        # Update balance with PnL and deduct fees
-        self.balance += position_size * adjusted_exit_price + pnl - fee
+        proceeds = position_size * adjusted_exit_price + pnl - fee
 
         # Calculate return
-        return_on_investment = pnl / collateral if collateral != 0 else 0
-        
-        # Ensure current_step is within bounds
-        if self.current_step < len(self.timestamps):
-            close_time = exit_time if exit_time is not None else self.timestamps[self.current_step]
-        else:
-            logging.error(f"current_step {self.current_step} is out of bounds for timestamps with length {len(self.timestamps)}")
-            return
+        return_on_investment = np.divide(pnl, collateral, out=np.zeros(len(pnl)), where=collateral != 0)
 
-        # Ensure close_time is later than open_time
-        close_time = pd.to_datetime(close_time).floor('us')
-        open_time = pd.to_datetime(position['open_time']).floor('us')
-    
-        if close_time <= open_time:
-            # close_time = position['open_time'] + pd.Timedelta(seconds=1)  # Adjust to be slightly later
-            logging.debug(f"Close time {close_time} is not later than open time {open_time}. Exit reason: {exit_reason}")
+        # Close times default to the current candle, both times are epoch nanoseconds truncated to the second
+        current_time = self.timestamps[self.current_step]
+        if exit_times is None:
+            close_time = np.full(len(symbol_indices), current_time)
+        else:
+            close_time = np.array([current_time if t is None else t for t in exit_times], dtype=np.int64)
+        close_time -= close_time % 10**9
+        open_time = book.open_time[symbol_indices]
+        open_time = open_time - open_time % 10**9
 
-        # Format times to exclude microseconds
-        close_time = close_time.strftime('%Y-%m-%d %H:%M:%S')
-        open_time = open_time.strftime('%Y-%m-%d %H:%M:%S')
-        
-        close_time = pd.to_datetime(close_time)
-        open_time = pd.to_datetime(open_time)
+        if np.any(close_time <= open_time):
+            logging.debug(f"Close time is not later than open time for symbols {symbol_indices[close_time <= open_time]}. Exit reasons: {exit_reasons}")
 
         # Calculate total borrowing fees
-        hours_open = (close_time - open_time).total_seconds() / 3600
-        total_borrowing_fee = position['borrowing_fee'] * hours_open
-
-        # Deduct total borrowing fees from balance
-        self.balance -= total_borrowing_fee
+        hours_open = (close_time - open_time) // 10**9 / 3600
+        total_borrowing_fee = book.borrowing_fee[symbol_indices] * hours_open
 
         # Add borrowing fees and episode number to history
-        self.history.append({
-            'episode': self.episode_counter,  # Add the current episode number
+        trades = {
+            'symbol': symbol_indices,
+            'side': side,
+            'exit_reason': np.asarray(exit_reasons, dtype=object),
+            'episode': np.full(len(symbol_indices), self.episode_counter),  # Add the current episode number
             'open_time': open_time,
             'close_time': close_time,
-            'symbol': self.params['symbols'][symbol_index],
-            'type': position['type'],
             'entry_price': entry_price,
             'exit_price': adjusted_exit_price,
             'position_size': position_size,
             'leverage': leverage,
-            'collateral': round(collateral),
-            'sl_price': position['sl_price'],
-            'tp_price': position['tp_price'],
-            'liq_price': position['liq_price'],
-            'max_price': position['max_price'],
-            'exit_reason': exit_reason,
-            'pnl': round(pnl, 2),  # Add PnL to history
-            'return': round(return_on_investment, 2),  # Add return to history
-            'borrowing_fee': round(total_borrowing_fee, 2),
-            'balance': position['balance'],
-            'risk_per_trade': position['risk_per_trade'],
-        })
-        
-        # Reset position to an empty dictionary
-        self.positions[symbol_index] = {}
-        self.cooldowns[symbol_index] = self.cooldown_period  # Set cooldown after closing a position
+            'collateral': np.round(collateral),
+            'sl_price': book.sl_price[symbol_indices],
+            'tp_price': book.tp_price[symbol_indices],
+            'liq_price': book.liq_price[symbol_indices],
+            'max_price': book.max_price[symbol_indices],
+            'pnl': np.round(pnl, 2),  # Add PnL to history
+            'return': np.round(return_on_investment, 2),  # Add return to history
+            'borrowing_fee': np.round(total_borrowing_fee, 2),
+            'balance': book.balance[symbol_indices],
+            'risk_per_trade': book.risk_per_trade[symbol_indices],
+        }
+
+        return {
+            'symbol_index': symbol_indices,
+            'proceeds': proceeds,
+            'borrowing_fee': total_borrowing_fee,
+            'trades': trades,
+        }
+
+    def commit_closes(self, closes, rows=None):
+        """
+        Apply closes computed by prepare_closes to the balance, the history and the position book.
+
+        :param closes: The result of prepare_closes.
+        :param rows: Optional subset of rows to apply, in order; all rows by default.
+        """
+        rows = np.arange(len(closes['symbol_index'])) if rows is None else np.asarray(rows)
+        for k in rows:
+            # Update balance with PnL and fees, then deduct total borrowing fees
+            self.balance += closes['proceeds'][k]
+            self.balance -= closes['borrowing_fee'][k]
+
+        trades = {name: values[rows] for name, values in closes['trades'].items()}
+        self.history.append(**trades)
+        for pnl in trades['pnl']:
+            self.trade_stats.add(pnl)
+
+        # Flatten the positions in the book and set cooldown after closing
+        symbol_indices = closes['symbol_index'][rows]
+        self.book.clear(symbol_indices)
+        self.cooldowns[symbol_indices] = self.cooldown_period
         
     # def adjust_leverage(self, base_leverage, boost_factor=3):
     #     # Define volatility-based adjustment factors for each interval
@@ -544,32 +623,39 @@ class TradingEnvironment(gym.Env):
     #     return np.round(normalized_leverages).astype(int) 
     
     def calculate_leverage(self, symbol_index, collateral, volume_factor_base=10000):
-        # Extract necessary indicators from the data matrix
-        closes = self.data_matrix[:, symbol_index, self.mapping['close']]
-        vwap = self.data_matrix[:, symbol_index, self.mapping['vwap']]
-        rsi = self.data_matrix[:, symbol_index, self.mapping['rsi']]
-        macd_hist = self.data_matrix[:, symbol_index, self.mapping['macd_hist']]
-        boll_lband = self.data_matrix[:, symbol_index, self.mapping['boll_lband']]
-        atr = self.data_matrix[:, symbol_index, self.mapping['atr']]
-        volume = self.data_matrix[:, symbol_index, self.mapping['volume']]
+        # Indicators of the current candle, never of candles that come after it
+        step = min(self.current_step, len(self.data_matrix) - 1)
+        candle = self.data_matrix[step, symbol_index]
+        close = candle[self.mapping['close']]
+
+        # Averages and volatility over the last leverage_window candles, or all candles so far
+        window = self.params.get('leverage_window')
+        close_std = self.rolling_stats.std('close', step, symbol_index, window)
+        atr_mean = self.rolling_stats.mean('atr', step, symbol_index, window)
+        volume_mean = self.rolling_stats.mean('volume', step, symbol_index, window)
 
         # Compute confidence score based on indicators and volume
         confidence_score = (
-            (vwap[-1] > closes[-1]) * 0.15 +
-            (rsi[-1] < 30) * 0.15 +
-            (macd_hist[-1] > 0) * 0.15 +
-            (closes[-1] < boll_lband[-1]) * 0.15 +
-            (atr[-1] < np.mean(atr)) * 0.15 +
-            (volume[-1] > np.mean(volume)) * 0.25  # Higher weight for volume
+            (candle[self.mapping['vwap']] > close) * 0.15 +
+            (candle[self.mapping['rsi']] < 30) * 0.15 +
+            (candle[self.mapping['macd_hist']] > 0) * 0.15 +
+            (close < candle[self.mapping['boll_lband']]) * 0.15 +
+            (candle[self.mapping['atr']] < atr_mean) * 0.15 +
+            (candle[self.mapping['volume']] > volume_mean) * 0.25  # Higher weight for volume
         )
 
+        min_leverage = self.params.get('leverage_min', 1)
+        max_leverage = self.params.get('leverage_max', 150)
+
+        # Without enough history to measure volatility, stay at the minimum leverage
+        if not close_std > 0:
+            return np.round(min_leverage).astype(int)
+
         # Adjust leverage based on confidence score
-        base_leverage = collateral / np.std(closes)
+        base_leverage = collateral / close_std
         adjusted_leverage = base_leverage * (1 + confidence_score)
 
         # Clamp adjusted leverage between minimum and maximum limits
-        min_leverage = self.params.get('leverage_min', 1)
-        max_leverage = self.params.get('leverage_max', 150)
         adjusted_leverage = max(min_leverage, min(adjusted_leverage, max_leverage))
 
         # Return a scalar value instead of an array
@@ -599,8 +685,8 @@ class TradingEnvironment(gym.Env):
 
     def fetch_market_data(self):
         """Fetch and concatenate market data from CSV files within the specified date range."""
-        start_time = pd.to_datetime(self.timestamps[0])
-        end_time = pd.to_datetime(self.timestamps[-1])
+        start_time = pd.Timestamp(self.timestamps[0])
+        end_time = pd.Timestamp(self.timestamps[-1])
         
         market_data = [None] * len(self.params['symbols'])  # Initialize market data storage as a list
         
@@ -680,116 +766,133 @@ class TradingEnvironment(gym.Env):
         return market_data
     
     def handle_risk_management_basic(self, symbol_index, low_price, high_price):
-        position = self.positions[symbol_index]
-        if not position:
+        """
+        Close the positions whose max, TP, liquidation or SL level was touched by a candle.
+
+        :param symbol_index: A symbol index, or an array of symbol indices.
+        :param low_price: The candle low price, or an array aligned with symbol_index.
+        :param high_price: The candle high price, or an array aligned with symbol_index.
+        """
+        symbol_indices = np.atleast_1d(symbol_index)
+        hit, exit_prices, exit_reasons = self.book.level_hits(symbol_indices, np.atleast_1d(low_price), np.atleast_1d(high_price))
+
+        if not np.any(hit):
             return
 
-        sl_price = position['sl_price']
-        tp_price = position['tp_price']
-        liq_price = position['liq_price']
-        max_price = position['max_price']
-
-        logging.debug(f"SL Price: {sl_price}, TP Price: {tp_price}, Liquidation Price: {liq_price}")
-
-        # Check if SL, TP, or liquidation is hit using low and high prices
-        if max_price is not None and (
-            (position['type'] == 'long' and high_price >= max_price) or
-            (position['type'] == 'short' and low_price <= max_price)
-        ):
-            logging.debug(f"Max price hit for symbol {symbol_index}. Closing position.")
-            self.close_position(symbol_index, max_price, exit_reason="max")
-        
-        if tp_price is not None and (
-            (position['type'] == 'long' and high_price >= tp_price) or
-            (position['type'] == 'short' and low_price <= tp_price)
-        ):
-            logging.debug(f"Take-profit hit for symbol {symbol_index}. Closing position.")
-            self.close_position(symbol_index, tp_price, exit_reason="tp")
-            
-        if liq_price is not None and (
-            (position['type'] == 'long' and low_price <= liq_price) or
-            (position['type'] == 'short' and high_price >= liq_price)
-        ):
-            logging.debug(f"Liquidation hit for symbol {symbol_index}. Closing position.")
-            self.close_position(symbol_index, liq_price, exit_reason="liq")
-        
-        if sl_price is not None and (
-            (position['type'] == 'long' and low_price <= sl_price) or
-            (position['type'] == 'short' and high_price >= sl_price)
-        ):
-            logging.debug(f"Stop-loss hit for symbol {symbol_index}. Closing position.")
-            self.close_position(symbol_index, sl_price, exit_reason="sl")
+        logging.debug(f"Levels hit for symbols {symbol_indices[hit]}: {exit_reasons[hit]}. Closing positions.")
+        closes = self.prepare_closes(symbol_indices[hit], exit_prices[hit], exit_reasons[hit])
+        if closes is not None:
+            self.commit_closes(closes)
 
        
+    def candle_reaches_levels(self, symbol_indices):
+        """
+        Whether the range of the 1s candles of the current candle reaches a level of the position.
+
+        A candle whose lowest low and highest high cross no level cannot have a second hitting one,
+        so the 1s scan is only needed where this is True.
+
+        :param symbol_indices: The index of a symbol with an open position, or an array of them.
+        :return: Boolean, or boolean array aligned with symbol_indices.
+        """
+        book = self.book
+        min_low, max_high = self.intrabar_index.extremes(self.current_step, symbol_indices)
+        is_long = book.side[symbol_indices] == 1
+        # Max and TP are above the entry of a long and below the entry of a short, liq and SL the reverse
+        favorable = np.where(is_long, max_high >= book.max_price[symbol_indices], min_low <= book.max_price[symbol_indices]) | \
+            np.where(is_long, max_high >= book.tp_price[symbol_indices], min_low <= book.tp_price[symbol_indices])
+        adverse = np.where(is_long, min_low <= book.liq_price[symbol_indices], max_high >= book.liq_price[symbol_indices]) | \
+            np.where(is_long, min_low <= book.sl_price[symbol_indices], max_high >= book.sl_price[symbol_indices])
+        return favorable | adverse
+
     def handle_risk_management_1s(self, symbol_index):
-        position = self.positions[symbol_index]
-        if not position:
+        if not self.book.side[symbol_index]:
             return
         
-        # Ensure timestamps are in datetime format
-        self.timestamps = pd.to_datetime(self.timestamps)
-        
         # print("Environment Timestamps:", self.timestamps[:5])
         # print("Market Data Timestamps for Symbol 5:", self.market_data[5].index[:5])
 
         # Check if market data is still None after fetching
-        if self.market_data[symbol_index] is None:
+        if not self.intrabar_index.has_data(symbol_index):
             logging.warning(f"Market data for symbol {symbol_index} is not available.")
             return
 
-        # Prepare data for Numba function
-        sl_prices = np.array([pos.get('sl_price', 0) for pos in self.positions])
-        tp_prices = np.array([pos.get('tp_price', 0) for pos in self.positions])
-        liq_prices = np.array([pos.get('liq_price', 0) for pos in self.positions])
-        max_prices = np.array([pos.get('max_price', 0) for pos in self.positions])
+        # Most candles reach no level, their seconds are not scanned
+        if not self.candle_reaches_levels(symbol_index):
+            return
 
-        # Check if the position has a 'type' key
-        if 'type' in position:
-            end_time = self.timestamps[self.current_step]
-            
-            # Convert market data index to datetime if necessary
-            market_data_index = pd.to_datetime(self.market_data[symbol_index].index)
-
-            # Adjust the slicing logic to ensure it captures the correct range
-            start_time = self.timestamps[self.current_step - 1] if self.current_step > 0 else self.timestamps[0]
-            mkt_data = self.market_data[symbol_index].loc[
-                (market_data_index > start_time) & 
-                (market_data_index < end_time)
-            ]
-            
-            logging.debug(f"Market data length for symbol {symbol_index}: {len(mkt_data)}")
-            
-            low_prices = mkt_data['low'].values
-            high_prices = mkt_data['high'].values
+        # Levels of every symbol are read straight from the position book
+        sl_prices = self.book.sl_price
+        tp_prices = self.book.tp_price
+        liq_prices = self.book.liq_price
+        max_prices = self.book.max_price
 
-            # Determine the position type as an integer
-            position_type = 1 if position['type'] == 'long' else 0 if position['type'] == 'short' else None
+        # Seconds strictly between the previous candle and the current one, as contiguous slices
+        low_prices, high_prices, market_times = self.intrabar_index.window(self.current_step, symbol_index)
+        
+        logging.debug(f"Market data length for symbol {symbol_index}: {len(market_times)}")
 
-            # # Assuming timestamps is a numpy array of datetime64
-            # timestamps_int = mkt_data.index.values.astype('int64') // 10**9  # Convert to Unix timestamp in seconds
-            
-            # Call the optimized function
-            symbol_index, price, reason, exit_time = handle_risk_management_optimized(
-                symbol_index, position_type, low_prices, high_prices, sl_prices, tp_prices, liq_prices, max_prices, mkt_data.index.values
-            )
+        # Determine the position type as an integer
+        position_type = 1 if self.book.side[symbol_index] == 1 else 0
 
-            if symbol_index is not None:
-                self.close_position(symbol_index, price, exit_reason=reason, exit_time=exit_time)
+        # Call the kernel selected by params['risk_kernel']
+        symbol_index, price, reason, exit_time = self.risk_management_1s(
+            symbol_index, position_type, low_prices, high_prices, sl_prices, tp_prices, liq_prices, max_prices, market_times
+        )
 
-    def update_trailing_stop(self, symbol_index, current_price):
-        position = self.positions[symbol_index]
-        if not position:
+        if symbol_index is not None:
+            self.close_position(symbol_index, price, exit_reason=reason, exit_time=exit_time)
+
+    def handle_risk_management_1s_batched(self, symbol_indices):
+        """
+        Check the 1s candles of several open positions at once and close the ones hitting a level.
+
+        The closes are the same as calling handle_risk_management_1s for each symbol in order.
+
+        :param symbol_indices: Array of indices of symbols with an open position.
+        """
+        available = np.array([self.intrabar_index.has_data(i) for i in symbol_indices], dtype=bool)
+        for i in symbol_indices[~available]:
+            logging.warning(f"Market data for symbol {i} is not available.")
+        symbol_indices = symbol_indices[available]
+        # Only the candles whose range reaches a level have their seconds scanned
+        symbol_indices = symbol_indices[self.candle_reaches_levels(symbol_indices)]
+        if len(symbol_indices) == 0:
+            return
+
+        book = self.book
+        low_prices, high_prices, market_times, offsets = self.intrabar_index.windows(self.current_step, symbol_indices)
+        levels = np.stack((book.max_price[symbol_indices], book.liq_price[symbol_indices], book.tp_price[symbol_indices], book.sl_price[symbol_indices]))
+        position_types = (book.side[symbol_indices] == 1).astype(int)
+        hits = first_hits_ragged(low_prices, high_prices, offsets, position_types, *levels)
+
+        hit = np.any(hits >= 0, axis=1)
+        if not np.any(hit):
             return
 
-        if position['type'] == 'long':
+        # Among the levels of the first candle hitting any, keep the first in order of precedence
+        positions = np.flatnonzero(hit)
+        level = np.argmax(hits[positions] >= 0, axis=1)
+        rows = offsets[positions] + hits[positions, level]
+        exit_reasons = np.asarray(RISK_LEVELS)[level]
+        logging.debug(f"1s levels hit for symbols {symbol_indices[positions]}: {exit_reasons}. Closing positions.")
+        closes = self.prepare_closes(symbol_indices[positions], levels[level, positions], exit_reasons, market_times[rows])
+        if closes is not None:
+            self.commit_closes(closes)
+
+    def update_trailing_stop(self, symbol_index, current_price):
+        side = self.book.side[symbol_index]
+        sl_price = self.book.sl_price[symbol_index]
+
+        if side == 1:
             new_sl_price = current_price * (1 - self.trailing_stop_percent)
-            if position['sl_price'] is None or new_sl_price > position['sl_price']:
-                position['sl_price'] = new_sl_price
+            if np.isnan(sl_price) or new_sl_price > sl_price:
+                self.book.sl_price[symbol_index] = new_sl_price
                 logging.debug(f"Updated trailing stop for long position: {new_sl_price}")
-        elif position['type'] == 'short':
+        elif side == -1:
             new_sl_price = current_price * (1 + self.trailing_stop_percent)
-            if position['sl_price'] is None or new_sl_price < position['sl_price']:
-                position['sl_price'] = new_sl_price
+            if np.isnan(sl_price) or new_sl_price < sl_price:
+                self.book.sl_price[symbol_index] = new_sl_price
                 logging.debug(f"Updated trailing stop for short position: {new_sl_price}")
                 
     def adjust_cooldown_for_volatility(self, symbol_index):
@@ -868,8 +971,9 @@ class TradingEnvironment(gym.Env):
         
         # Handle SL and TP for each position before processing actions
         if self.params['basic_risk_mgmt']:
-            for i in range(self.num_symbols):
-                self.handle_risk_management_basic(i, low_prices[i], high_prices[i])
+            self.handle_risk_management_basic(np.arange(self.num_symbols), low_prices, high_prices)
+        elif self.step_mode == 'vectorized':
+            self.handle_risk_management_1s_batched(np.flatnonzero(self.book.is_open))
         else:
             for i in range(self.num_symbols):
                 self.handle_risk_management_1s(i)
@@ -888,47 +992,48 @@ class TradingEnvironment(gym.Env):
 
 
         # Execute action for each symbol
-        for i in range(self.num_symbols):
-            # self.adjust_cooldown_for_volatility(i)
-            # self.adjust_cooldown_based_on_performance()
+        if self.step_mode == 'vectorized':
+            self.execute_actions_vectorized(action, current_prices, infos)
+        else:
+            for i in range(self.num_symbols):
+                # self.adjust_cooldown_for_volatility(i)
+                # self.adjust_cooldown_based_on_performance()
 
-            if self.cooldowns[i] > 0:
-                self.cooldowns[i] -= 1
-                action[i] = self.actions_available['hold']
-                continue
+                if self.cooldowns[i] > 0:
+                    self.cooldowns[i] -= 1
+                    action[i] = self.actions_available['hold']
+                    continue
             
-            if action[i] == self.actions_available['hold']:  # Hold
-                pass
-            elif self.balance >= self.params['collateral_min'] and action[i] == self.actions_available['long']:  # Long
-                if self.positions[i]:
-                    self.close_position(i, current_prices[i], 'long')
-                collateral, leverage, tp_price, sl_price = self.open_position(i, 'long', current_prices[i])
-                if collateral is not None:
-                    infos['orders'][self.params['symbols'][i]] = { 'type': 'open_long', 'collateral': collateral, 'leverage': leverage, 'tp_price': tp_price, 'sl_price': sl_price }
-            elif self.balance >= self.params['collateral_min'] and action[i] == self.actions_available['short']:  # Short
-                if self.positions[i]:
-                    self.close_position(i, current_prices[i], 'short')
-                collateral, leverage, tp_price, sl_price = self.open_position(i, 'short', current_prices[i])
-                if collateral is not None:
-                    infos['orders'][self.params['symbols'][i]] = { 'type': 'open_short', 'collateral': collateral, 'leverage': leverage, 'tp_price': tp_price, 'sl_price': sl_price }
-            elif action[i] == self.actions_available['close']:  # Close
-                if self.positions[i]:
-                    self.close_position(i, current_prices[i], 'close')
-                    infos['orders'][self.params['symbols'][i]] = { 'type': 'close', 'exit_price': current_prices[i] }
-            elif self.balance >= self.params['collateral_min'] and action[i] == self.actions_available['hedge']:  # Hedge
-                if self.positions[i]:
-                    current_type = 'long' if self.positions[i]['type'] == 'short' else 'short'
-                    self.close_position(i, current_prices[i], current_type)
-                    collateral, leverage, tp_price, sl_price = self.open_position(i, current_type, current_prices[i])
+                if action[i] == self.actions_available['hold']:  # Hold
+                    pass
+                elif self.balance >= self.params['collateral_min'] and action[i] == self.actions_available['long']:  # Long
+                    if self.book.side[i]:
+                        self.close_position(i, current_prices[i], 'long')
+                    collateral, leverage, tp_price, sl_price = self.open_position(i, 'long', current_prices[i])
+                    if collateral is not None:
+                        infos['orders'][self.params['symbols'][i]] = { 'type': 'open_long', 'collateral': collateral, 'leverage': leverage, 'tp_price': tp_price, 'sl_price': sl_price }
+                elif self.balance >= self.params['collateral_min'] and action[i] == self.actions_available['short']:  # Short
+                    if self.book.side[i]:
+                        self.close_position(i, current_prices[i], 'short')
+                    collateral, leverage, tp_price, sl_price = self.open_position(i, 'short', current_prices[i])
                     if collateral is not None:
-                        infos['orders'][self.params['symbols'][i]] = { 'type': f'open_{current_type}', 'collateral': collateral, 'leverage': leverage, 'tp_price': tp_price, 'sl_price': sl_price }
-            # elif action[i] == self.actions_available['trail']:  # Trailing Stop
-            #     self.update_trailing_stop(i, current_prices[i])
+                        infos['orders'][self.params['symbols'][i]] = { 'type': 'open_short', 'collateral': collateral, 'leverage': leverage, 'tp_price': tp_price, 'sl_price': sl_price }
+                elif action[i] == self.actions_available['close']:  # Close
+                    if self.book.side[i]:
+                        self.close_position(i, current_prices[i], 'close')
+                        infos['orders'][self.params['symbols'][i]] = { 'type': 'close', 'exit_price': current_prices[i] }
+                elif self.balance >= self.params['collateral_min'] and action[i] == self.actions_available['hedge']:  # Hedge
+                    if self.book.side[i]:
+                        current_type = 'long' if self.book.side[i] == -1 else 'short'
+                        self.close_position(i, current_prices[i], current_type)
+                        collateral, leverage, tp_price, sl_price = self.open_position(i, current_type, current_prices[i])
+                        if collateral is not None:
+                            infos['orders'][self.params['symbols'][i]] = { 'type': f'open_{current_type}', 'collateral': collateral, 'leverage': leverage, 'tp_price': tp_price, 'sl_price': sl_price }
+                # elif action[i] == self.actions_available['trail']:  # Trailing Stop
+                #     self.update_trailing_stop(i, current_prices[i])
 
         # Update net worth
-        self.net_worth = self.balance + sum(
-            pos.get('position_size', 0) * price for pos, price in zip(self.positions, current_prices)
-        )
+        self.net_worth = self.balance + np.sum(self.book.position_size * current_prices)
 
         # Move to the next step
         if not self.live_mode:
@@ -966,6 +1071,61 @@ class TradingEnvironment(gym.Env):
         # Return next observation, reward, done, and info
         return self.next_observation(), reward, done, net_worth_below_min, infos
 
+    def execute_actions_vectorized(self, action, current_prices, infos):
+        """
+        Apply the actions of all symbols using array operations.
+
+        Cooldowns, action masks and the close legs of every exiting position are computed for
+        all symbols at once. Only the symbols that trade are then walked in order, because each
+        open sizes its collateral from the balance left by the previous symbols; this keeps the
+        balances and the trade history identical to the scalar path.
+
+        :param action: Array of actions, one per symbol. Symbols in cooldown are set to hold.
+        :param current_prices: Close price of the current candle for each symbol.
+        :param infos: The step infos, whose orders section is filled in.
+        """
+        available = self.actions_available
+
+        # Symbols in cooldown hold for this step
+        cooling = self.cooldowns > 0
+        self.cooldowns[cooling] -= 1
+        action[cooling] = available['hold']
+
+        is_open = self.book.is_open
+        closing = (action == available['close']) & is_open
+        opening = (action == available['long']) | (action == available['short']) | ((action == available['hedge']) & is_open)
+
+        # Long and short open their own side, hedge flips the side of the open position
+        types = np.where(action == available['long'], 'long', 'short').astype(object)
+        hedging = action == available['hedge']
+        types[hedging] = np.where(self.book.side[hedging] == -1, 'long', 'short')
+        types[closing] = 'close'
+
+        # Close legs of every position that may exit this step, priced in one batch
+        exiting = np.flatnonzero((closing | opening) & is_open)
+        closes = self.prepare_closes(exiting, current_prices[exiting], types[exiting]) if len(exiting) else None
+        close_rows = {i: k for k, i in enumerate(exiting)}
+
+        for i in np.flatnonzero(closing | opening):
+            if closing[i]:
+                self.commit_closes(closes, [close_rows[i]])
+                infos['orders'][self.params['symbols'][i]] = { 'type': 'close', 'exit_price': current_prices[i] }
+                continue
+
+            # Opening depends on the balance left by the symbols before this one
+            if self.balance < self.params['collateral_min']:
+                continue
+            if i in close_rows:
+                self.commit_closes(closes, [close_rows[i]])
+            collateral, leverage, tp_price, sl_price = self.open_position(i, types[i], current_prices[i])
+            if collateral is not None:
+                infos['orders'][self.params['symbols'][i]] = { 'type': f'open_{types[i]}', 'collateral': collateral, 'leverage': leverage, 'tp_price': tp_price, 'sl_price': sl_price }
+
+    def close(self):
+        # Remove the trades the history spilled to disk
+        self.history.close()
+        super().close()
+
     def render(self):
         # Implement rendering logic based on self.render_mode
         if self.render_mode == 'human':
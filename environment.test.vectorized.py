@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+import pandas as pd
+import utilities  # Imported before environment, which imports it back
+from parameters import selected_params
+from environment import TradingEnvironment
+from rewards import calculate_reward
+from market_fixtures import make_market, make_market_1s
+
+class TestVectorizedStep(unittest.TestCase):
+    def setUp(self):
+        self.data_matrix, self.timestamps, self.mapping = make_market()
+
+    def run_episode(self, step_mode, risk_mgmt):
+        params = dict(selected_params)
+        params.update({'symbols': [f'SYM{i}' for i in range(self.data_matrix.shape[1])], 'basic_risk_mgmt': True,
+                       'risk_mgmt': risk_mgmt, 'boost_factor': 1, 'step_mode': step_mode})
+        env = TradingEnvironment(self.data_matrix, self.timestamps, self.mapping, params=params, reward_function=calculate_reward)
+        env.reset()
+        rng = np.random.default_rng(1)
+        balances = []
+        done = False
+        while not done:
+            _, _, done, _, _ = env.step(rng.integers(0, len(env.actions_available), env.num_symbols))
+            balances.append(env.balance)
+        return balances, env.history
+
+    def test_same_trades_as_scalar(self):
+        for risk_mgmt in ['fractals', 'percentage']:
+            scalar_balances, scalar_history = self.run_episode('scalar', risk_mgmt)
+            vectorized_balances, vectorized_history = self.run_episode('vectorized', risk_mgmt)
+            self.assertGreater(len(scalar_history), 0)
+            self.assertEqual(scalar_balances, vectorized_balances)
+            pd.testing.assert_frame_equal(scalar_history.to_dataframe(), vectorized_history.to_dataframe())
+
+    def test_1s_risk_management(self):
+        data_matrix, timestamps, mapping, market_data = make_market_1s()
+        results = []
+        for step_mode, two_tier in [('scalar', False), ('scalar', True), ('vectorized', True)]:
+            params = dict(selected_params)
+            params.update({'symbols': [f'SYM{i}' for i in range(data_matrix.shape[1])], 'basic_risk_mgmt': False, 'risk_mgmt': 'percentage',
+                           'sl_mult_perc': 0.2, 'tp_mult_perc': 0.3, 'boost_factor': 1, 'step_mode': step_mode})
+            env = TradingEnvironment(data_matrix, timestamps, mapping, params=params, reward_function=calculate_reward, market_data=market_data)
+            if not two_tier:
+                # Scan the seconds of every candle, even when its range reaches no level
+                env.candle_reaches_levels = lambda symbol_indices: np.ones(np.shape(symbol_indices), dtype=bool)
+            env.reset()
+            rng = np.random.default_rng(1)
+            done = False
+            while not done:
+                _, _, done, _, _ = env.step(rng.integers(0, len(env.actions_available), env.num_symbols))
+            results.append(env.history.to_dataframe())
+        self.assertGreater((results[0]['exit_reason'] != 'std').sum(), 0)
+        pd.testing.assert_frame_equal(results[0], results[1])
+        pd.testing.assert_frame_equal(results[0], results[2])
+
+    def test_unknown_step_mode(self):
+        with self.assertRaises(ValueError):
+            self.run_episode('parallel', 'percentage')
+
+if __name__ == '__main__':
+    unittest.main()
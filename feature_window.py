@@ -0,0 +1,56 @@
+import numpy as np
+from positions import epoch_ns
+
+class FeatureWindow:
+    """
+    Preallocated circular (window x symbols x features) buffer of the latest candles.
+
+    Every row is written twice, at k and k + window of a buffer of 2 * window rows, so the
+    latest window rows are always the contiguous slice starting after the oldest one. Adding a
+    candle writes one row per symbol in place and data_matrix is a zero-copy view, so the cost
+    of a candle does not depend on the length of the window.
+    """
+    def __init__(self, data_matrix, timestamps):
+        data_matrix = np.asarray(data_matrix, dtype=np.float64)
+        timestamps = epoch_ns(timestamps)
+        # The data matrix and timestamps of preprocess_data both start at the common start time
+        self.window = min(len(data_matrix), len(timestamps))
+        if self.window == 0:
+            raise ValueError("The feature window needs at least one candle")
+        self.buffer = np.empty((2 * self.window,) + data_matrix.shape[1:])
+        self.times = np.empty(2 * self.window, dtype=np.int64)
+        self.buffer[:self.window] = self.buffer[self.window:] = data_matrix[:self.window]
+        self.times[:self.window] = self.times[self.window:] = timestamps[:self.window]
+        # Row of the oldest candle, the next one to be replaced
+        self.start = 0
+
+    @property
+    def data_matrix(self):
+        """View of shape (window, symbols, features) of the candles, the oldest first."""
+        return self.buffer[self.start:self.start + self.window]
+
+    @property
+    def timestamps(self):
+        """View of the open times of the candles in epoch nanoseconds."""
+        return self.times[self.start:self.start + self.window]
+
+    def append(self, rows, timestamp):
+        """
+        Add the next candle of every symbol, dropping the oldest one.
+
+        A candle with the open time of the latest one replaces it instead, as when the closed
+        version of a candle fetched while still open arrives.
+
+        :param rows: Array of shape (symbols, features) of the feature rows of the candle.
+        :param timestamp: The open time of the candle.
+        :return: Whether the latest candle was replaced, for TradingEnvironment.append_data.
+        """
+        timestamp = epoch_ns(timestamp)
+        replaced = timestamp == self.times[self.start + self.window - 1]
+        if not replaced:
+            self.start = (self.start + 1) % self.window
+        # The latest row and its mirror, one window apart
+        latest = (self.start - 1) % self.window
+        self.buffer[latest] = self.buffer[latest + self.window] = rows
+        self.times[latest] = self.times[latest + self.window] = timestamp
+        return bool(replaced)
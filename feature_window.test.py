@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+import pandas as pd
+import utilities  # Imported before environment, which imports it back
+from parameters import selected_params
+from environment import TradingEnvironment
+from rewards import calculate_reward
+from feature_window import FeatureWindow
+
+class TestFeatureWindow(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.data_matrix = rng.normal(size=(30, 3, 4))
+        self.timestamps = pd.date_range('2024-01-01', periods=30, freq='1h')
+
+    def test_rows_are_appended_in_place(self):
+        window = FeatureWindow(self.data_matrix[:10], self.timestamps[:10])
+        buffer = window.buffer
+        for step in range(10, 30):
+            window.append(self.data_matrix[step], self.timestamps[step])
+            np.testing.assert_array_equal(window.data_matrix, self.data_matrix[step - 9:step + 1])
+            np.testing.assert_array_equal(window.timestamps, self.timestamps[step - 9:step + 1].asi8)
+            # The window is a contiguous view of the preallocated buffer
+            self.assertTrue(window.data_matrix.flags['C_CONTIGUOUS'])
+            self.assertTrue(np.shares_memory(window.data_matrix, buffer))
+        self.assertIs(window.buffer, buffer)
+
+    def test_same_open_time_replaces_latest_row(self):
+        window = FeatureWindow(self.data_matrix[:10], self.timestamps[:10])
+        closed = self.data_matrix[9] + 1
+        window.append(closed, self.timestamps[9])
+        np.testing.assert_array_equal(window.data_matrix[:-1], self.data_matrix[:9])
+        np.testing.assert_array_equal(window.data_matrix[-1], closed)
+        self.assertEqual(window.timestamps[-1], self.timestamps[9].value)
+
+    def test_environment_observes_the_view(self):
+        window = FeatureWindow(self.data_matrix[:10], self.timestamps[:10])
+        mapping = {name: i for i, name in enumerate(['open', 'high', 'low', 'close'])}
+        params = dict(selected_params)
+        params['symbols'] = ['AAA', 'BBB', 'CCC']
+        env = TradingEnvironment(window.data_matrix, window.timestamps, mapping, params=params, reward_function=calculate_reward, live_mode=True)
+        env.reset()
+        replaced = window.append(self.data_matrix[10], self.timestamps[10])
+        self.assertFalse(replaced)
+        env.append_data(window.data_matrix, window.timestamps, replaced)
+        observation = env.next_observation()
+        np.testing.assert_array_equal(observation[:12], self.data_matrix[10].ravel())
+        self.assertTrue(np.shares_memory(env.timestamps, window.times))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,507 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import lfilter
+
+# Columns added by add_technical_indicators, in the order the ta based version added them
+INDICATOR_COLUMNS = (
+    'ema_short', 'ema_long', 'rsi', 'macd', 'macd_signal', 'macd_hist',
+    'boll_hband', 'boll_mband', 'boll_lband', 'atr', 'adx', 'adx_neg', 'adx_pos',
+    'obv', 'vwap', 'parabolic_sar', 'stoch_k', 'stoch_d', 'roc',
+)
+
+OHLCV_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+def recursive_filter(values, decay, gain, previous):
+    """
+    The recursion y[i] = decay * y[i - 1] + gain * values[i] along the first axis, in one pass.
+
+    :param values: Array of shape (rows, symbols).
+    :param previous: The value of y before the first row, one per symbol.
+    :return: Array of y with the shape of values.
+    """
+    if len(values) == 0:
+        return np.empty_like(values)
+    return lfilter([gain], [1.0, -decay], values, axis=0, zi=decay * np.asarray(previous)[None])[0]
+
+def ewm_mean(values, alpha, min_periods):
+    """
+    Same as pandas ewm(alpha=alpha, min_periods=min_periods, adjust=False).mean() on every column.
+
+    Leading rows holding a NaN are skipped, the values after them are expected to be complete.
+    """
+    result = np.full(values.shape, np.nan)
+    complete = ~np.isnan(values).any(axis=1)
+    if not complete.any():
+        return result
+    first = np.argmax(complete)
+    smoothed = recursive_filter(values[first:], 1 - alpha, alpha, values[first])
+    result[first + min_periods - 1:] = smoothed[min_periods - 1:]
+    return result
+
+def rolling(values, window, function):
+    """Same as pandas rolling(window) with a reduction, NaN for the first window - 1 rows."""
+    result = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        result[window - 1:] = function(sliding_window_view(values, window, axis=0), axis=-1)
+    return result
+
+def shift(values, periods=1):
+    """Same as pandas shift on the first axis, NaN for the rows shifted in."""
+    result = np.full(values.shape, np.nan)
+    result[periods:] = values[:-periods]
+    return result
+
+def divide(numerator, denominator):
+    """Division with a 0 where the denominator is 0, like the loops of ta's ADXIndicator."""
+    result = np.zeros(np.broadcast(numerator, denominator).shape)
+    np.divide(numerator, denominator, out=result, where=denominator != 0)
+    return result
+
+def rsi(close, window=14):
+    diff = close - shift(close)
+    with np.errstate(invalid='ignore'):
+        up = ewm_mean(np.where(diff > 0, diff, 0.0), 1 / window, window)
+        down = ewm_mean(np.where(diff < 0, -diff, 0.0), 1 / window, window)
+        return np.where(down == 0, 100, 100 - (100 / (1 + up / down)))
+
+def true_range(high, low, close):
+    previous_close = shift(close)
+    # The first candle has no previous close, its range is high - low
+    ranges = np.stack((high - low, np.abs(high - previous_close), np.abs(low - previous_close)))
+    return np.fmax.reduce(ranges, axis=0)
+
+def average_true_range(high, low, close, window=14):
+    ranges = true_range(high, low, close)
+    atr = np.zeros(close.shape)
+    if len(close) >= window:
+        atr[window - 1] = ranges[:window].mean(axis=0)
+        atr[window:] = recursive_filter(ranges[window:], (window - 1) / window, 1 / window, atr[window - 1])
+    return atr
+
+def directional_sums(high, low, close, window=14):
+    """
+    Smoothed true range, +DM and -DM sums of ta's ADXIndicator.
+
+    :return: Tuple of (trs, dip, din) arrays of len(close) - window + 1 rows, the sums up to candle
+        window + i on row i. As in ta the last row is left at 0.
+    """
+    num_sums = len(close) - (window - 1)
+    previous_close = shift(close)
+    ranges = np.maximum(high, previous_close) - np.minimum(low, previous_close)
+    diff_up = high - shift(high)
+    diff_down = shift(low) - low
+    with np.errstate(invalid='ignore'):
+        pos = np.where((diff_up > diff_down) & (diff_up > 0), diff_up, 0.0)
+        neg = np.where((diff_down > diff_up) & (diff_down > 0), diff_down, 0.0)
+
+    sums = []
+    for movement in (ranges, pos, neg):
+        smoothed = np.zeros((num_sums,) + close.shape[1:])
+        smoothed[0] = movement[1:window + 1].sum(axis=0)
+        smoothed[1:-1] = recursive_filter(movement[window + 1:], 1 - 1 / window, 1.0, smoothed[0])
+        sums.append(smoothed)
+    return tuple(sums)
+
+def directional_indicators(trs, dip, din):
+    """-DI, +DI and DX of the smoothed sums, 0 where they are undefined like in ta."""
+    positive = divide(100 * dip, trs)
+    negative = divide(100 * din, trs)
+    return negative, positive, divide(100 * np.abs(positive - negative), positive + negative)
+
+def directional_movement(high, low, close, window=14):
+    """
+    ADX, -DI and +DI as computed by ta's ADXIndicator, including its offsets.
+
+    :return: Tuple of (adx, adx_neg, adx_pos) arrays shaped like close.
+    """
+    num_rows = len(close)
+    adx, adx_neg, adx_pos = np.zeros(close.shape), np.zeros(close.shape), np.zeros(close.shape)
+    num_sums = num_rows - (window - 1)
+    if num_sums <= window:
+        return adx, adx_neg, adx_pos
+
+    negative, positive, directional_index = directional_indicators(*directional_sums(high, low, close, window))
+    smoothed = np.zeros((num_sums,) + close.shape[1:])
+    smoothed[window] = directional_index[:window].mean(axis=0)
+    smoothed[window + 1:] = recursive_filter(directional_index[window:-1], (window - 1) / window, 1 / window, smoothed[window])
+    adx[window - 1:] = smoothed
+
+    adx_pos[window + 1:] = positive[1:-1]
+    adx_neg[window + 1:] = negative[1:-1]
+    return adx, adx_neg, adx_pos
+
+def parabolic_sar(high, low, close, step=0.02, max_step=0.2):
+    """Parabolic SAR as computed by ta's PSARIndicator, one iteration per candle for all symbols."""
+    indicator = StreamingParabolicSAR(high[:0], low[:0], close[:0], step, max_step)
+    psar = np.empty(close.shape)
+    for i in range(len(close)):
+        psar[i] = indicator.update(high[i], low[i], close[i])
+    return psar
+
+def compute_indicators(high, low, close, volume):
+    """
+    Compute the technical indicators of many symbols at once.
+
+    Every indicator is computed on whole (candles x symbols) blocks with the window and defaults
+    of the ta indicators add_technical_indicators used, so the values match ta up to rounding,
+    NaN included.
+
+    :param high: Array of shape (candles, symbols), same for low, close and volume.
+    :return: Dictionary of INDICATOR_COLUMNS to arrays of shape (candles, symbols).
+    """
+    high, low, close, volume = (np.asarray(values, dtype=np.float64) for values in (high, low, close, volume))
+    indicators = {}
+    indicators['ema_short'] = ewm_mean(close, 2 / (12 + 1), 12)
+    indicators['ema_long'] = ewm_mean(close, 2 / (26 + 1), 26)
+    indicators['rsi'] = rsi(close)
+    indicators['macd'] = indicators['ema_short'] - indicators['ema_long']
+    indicators['macd_signal'] = ewm_mean(indicators['macd'], 2 / (9 + 1), 9)
+    indicators['macd_hist'] = indicators['macd'] - indicators['macd_signal']
+
+    mean = rolling(close, 20, np.mean)
+    deviation = rolling(close, 20, np.std)
+    indicators['boll_hband'] = mean + 2 * deviation
+    indicators['boll_mband'] = mean
+    indicators['boll_lband'] = mean - 2 * deviation
+    indicators['atr'] = average_true_range(high, low, close)
+    indicators['adx'], indicators['adx_neg'], indicators['adx_pos'] = directional_movement(high, low, close)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        indicators['obv'] = np.cumsum(np.where(close < shift(close), -volume, volume), axis=0)
+        typical_price = (high + low + close) / 3.0
+        indicators['vwap'] = rolling(typical_price * volume, 14, np.sum) / rolling(volume, 14, np.sum)
+        indicators['parabolic_sar'] = parabolic_sar(high, low, close)
+
+        lowest, highest = rolling(low, 14, np.min), rolling(high, 14, np.max)
+        indicators['stoch_k'] = 100 * (close - lowest) / (highest - lowest)
+        indicators['stoch_d'] = rolling(indicators['stoch_k'], 3, np.mean)
+        indicators['roc'] = (close - shift(close, 12)) / shift(close, 12) * 100
+    return indicators
+
+def fill_gaps(values):
+    """
+    Fill the NaN of every column along the first axis, like pandas interpolate(method='linear')
+    followed by bfill: gaps are interpolated by position, leading NaN take the first value and
+    trailing NaN the last one. Columns with no value are left as they are.
+    """
+    missing = np.isnan(values)
+    if not missing.any():
+        return values
+    num_rows = len(values)
+    rows = np.arange(num_rows).reshape((-1,) + (1,) * (values.ndim - 1))
+    previous = np.maximum.accumulate(np.where(missing, -1, rows), axis=0)
+    following = np.flip(np.minimum.accumulate(np.flip(np.where(missing, num_rows, rows), axis=0), axis=0), axis=0)
+
+    before = np.take_along_axis(values, np.maximum(previous, 0), axis=0)
+    after = np.take_along_axis(values, np.minimum(following, num_rows - 1), axis=0)
+    # Same arithmetic as np.interp, which pandas uses
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (after - before) / (following - previous)
+        interpolated = slope * (rows - previous) + before
+    filled = np.where(previous < 0, after, np.where(following >= num_rows, before, interpolated))
+    return np.where(missing, filled, values)
+
+def add_indicators(frames):
+    """
+    Add the technical indicators to DataFrames of candles, computing frames of the same length
+    together in one pass over a (candles x symbols) block.
+
+    The indicators only depend on the position of the candles, so frames are grouped by length
+    whatever their index. As with the ta based version, the NaN of the result are interpolated
+    and backward filled.
+
+    :param frames: List of DataFrames with OHLCV columns.
+    :return: List of copies of the frames with the INDICATOR_COLUMNS set.
+    """
+    results = [None] * len(frames)
+    groups = {}
+    for position, df in enumerate(frames):
+        groups.setdefault(len(df), []).append(position)
+
+    for positions in groups.values():
+        blocks = {column: np.stack([frames[position][column].to_numpy(dtype=np.float64) for position in positions], axis=1) for column in OHLCV_COLUMNS}
+        indicators = compute_indicators(blocks['high'], blocks['low'], blocks['close'], blocks['volume'])
+        values = fill_gaps(np.stack([indicators[column] for column in INDICATOR_COLUMNS], axis=-1))
+
+        for symbol, position in enumerate(positions):
+            df = frames[position].copy()
+            # Indicators already in the frame are overwritten in place
+            df[list(INDICATOR_COLUMNS)] = values[:, symbol]
+            numeric = df.select_dtypes(include=np.number).columns.difference(INDICATOR_COLUMNS, sort=False)
+            if df[numeric].isnull().values.any():
+                df[numeric] = fill_gaps(df[numeric].to_numpy(dtype=np.float64))
+            results[position] = df
+    return results
+
+def last_row(values):
+    """The last row of a history, NaN when it is empty."""
+    return values[-1].copy() if len(values) else np.full(values.shape[1:], np.nan)
+
+class RollingWindow:
+    """The last window rows of a series of (symbols,) rows, in a ring so adding a row is O(1)."""
+    def __init__(self, values, window):
+        self.values = np.full((window,) + values.shape[1:], np.nan)
+        recent = values[-window:]
+        self.values[window - len(recent):] = recent
+        # Row of the oldest value, the next one to be replaced
+        self.position = 0
+
+    def push(self, row):
+        """Add a row in place of the oldest one, which is returned."""
+        oldest = self.values[self.position].copy()
+        self.values[self.position] = row
+        self.position = (self.position + 1) % len(self.values)
+        return oldest
+
+class StreamingEMA:
+    """
+    Exponential moving average updated one candle at a time, like pandas
+    ewm(alpha=alpha, min_periods=min_periods, adjust=False).mean(), NaN before the first value.
+    """
+    def __init__(self, values, alpha, min_periods):
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.count = (~np.isnan(values)).sum(axis=0)
+        self.value = last_row(ewm_mean(values, alpha, 1))
+
+    def update(self, value):
+        self.value = np.where(np.isnan(self.value), value, (1 - self.alpha) * self.value + self.alpha * value)
+        self.count = self.count + ~np.isnan(value)
+        return np.where(self.count >= self.min_periods, self.value, np.nan)
+
+class StreamingRSI:
+    def __init__(self, close, window=14):
+        diff = close - shift(close)
+        with np.errstate(invalid='ignore'):
+            self.up = StreamingEMA(np.where(diff > 0, diff, 0.0), 1 / window, window)
+            self.down = StreamingEMA(np.where(diff < 0, -diff, 0.0), 1 / window, window)
+        self.previous_close = last_row(close)
+
+    def update(self, close):
+        diff = close - self.previous_close
+        self.previous_close = close
+        with np.errstate(invalid='ignore', divide='ignore'):
+            up = self.up.update(np.where(diff > 0, diff, 0.0))
+            down = self.down.update(np.where(diff < 0, -diff, 0.0))
+            return np.where(down == 0, 100, 100 - (100 / (1 + up / down)))
+
+class StreamingATR:
+    """Average true range with Wilder's smoothing, seeded from at least window candles."""
+    def __init__(self, high, low, close, window=14):
+        self.window = window
+        self.atr = last_row(average_true_range(high, low, close, window))
+        self.previous_close = last_row(close)
+
+    def update(self, high, low, close):
+        ranges = np.fmax.reduce((high - low, np.abs(high - self.previous_close), np.abs(low - self.previous_close)))
+        self.previous_close = close
+        self.atr = (self.atr * (self.window - 1) + ranges) / float(self.window)
+        return self.atr
+
+class StreamingADX:
+    """ADX, -DI and +DI of ta's ADXIndicator, seeded from at least 2 * window candles."""
+    def __init__(self, high, low, close, window=14):
+        self.window = window
+        # The sums up to the last candle are on the row before the last
+        self.trs, self.dip, self.din = (sums[-2] for sums in directional_sums(high, low, close, window))
+        self.adx = last_row(directional_movement(high, low, close, window)[0])
+        self.previous_high, self.previous_low, self.previous_close = last_row(high), last_row(low), last_row(close)
+
+    def update(self, high, low, close):
+        ranges = np.maximum(high, self.previous_close) - np.minimum(low, self.previous_close)
+        diff_up = high - self.previous_high
+        diff_down = self.previous_low - low
+        pos = np.where((diff_up > diff_down) & (diff_up > 0), diff_up, 0.0)
+        neg = np.where((diff_down > diff_up) & (diff_down > 0), diff_down, 0.0)
+        self.previous_high, self.previous_low, self.previous_close = high, low, close
+
+        self.trs = self.trs - (self.trs / float(self.window)) + ranges
+        self.dip = self.dip - (self.dip / float(self.window)) + pos
+        self.din = self.din - (self.din / float(self.window)) + neg
+        negative, positive, directional_index = directional_indicators(self.trs, self.dip, self.din)
+        self.adx = ((self.adx * (self.window - 1)) + directional_index) / float(self.window)
+        return self.adx, negative, positive
+
+class StreamingOBV:
+    def __init__(self, close, volume):
+        self.obv = np.cumsum(np.where(close < shift(close), -volume, volume), axis=0)[-1] if len(close) else np.zeros(close.shape[1:])
+        self.previous_close = last_row(close)
+
+    def update(self, close, volume):
+        self.obv = self.obv + np.where(close < self.previous_close, -volume, volume)
+        self.previous_close = close
+        return self.obv
+
+class StreamingVWAP:
+    """Volume weighted average price over window candles, from rolling sums."""
+    def __init__(self, high, low, close, volume, window=14):
+        self.price_volume = RollingWindow((high + low + close) / 3.0 * volume, window)
+        self.volume = RollingWindow(volume, window)
+        self.resync()
+
+    def resync(self):
+        self.total_price_volume = self.price_volume.values.sum(axis=0)
+        self.total_volume = self.volume.values.sum(axis=0)
+
+    def update(self, high, low, close, volume):
+        price_volume = (high + low + close) / 3.0 * volume
+        self.total_price_volume = self.total_price_volume + price_volume - self.price_volume.push(price_volume)
+        self.total_volume = self.total_volume + volume - self.volume.push(volume)
+        # Sum the window again on every turn so rounding errors do not build up
+        if self.volume.position == 0:
+            self.resync()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.total_price_volume / self.total_volume
+
+class StreamingBollingerBands:
+    """Bollinger bands over window candles, from a rolling mean and sum of squared deviations."""
+    def __init__(self, close, window=20, window_dev=2):
+        self.window_dev = window_dev
+        self.closes = RollingWindow(close, window)
+        self.resync()
+
+    def resync(self):
+        self.mean = self.closes.values.mean(axis=0)
+        self.squares = ((self.closes.values - self.mean) ** 2).sum(axis=0)
+
+    def update(self, close):
+        oldest = self.closes.push(close)
+        mean = self.mean + (close - oldest) / len(self.closes.values)
+        self.squares = self.squares + (close - oldest) * (close - mean + oldest - self.mean)
+        self.mean = mean
+        if self.closes.position == 0:
+            self.resync()
+        deviation = np.sqrt(np.maximum(self.squares, 0) / len(self.closes.values))
+        return self.mean + self.window_dev * deviation, self.mean, self.mean - self.window_dev * deviation
+
+class StreamingStochastic:
+    def __init__(self, high, low, close, window=14, smooth_window=3):
+        self.highs = RollingWindow(high, window)
+        self.lows = RollingWindow(low, window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stoch_k = 100 * (close - rolling(low, window, np.min)) / (rolling(high, window, np.max) - rolling(low, window, np.min))
+        self.stoch_k = RollingWindow(stoch_k, smooth_window)
+
+    def update(self, high, low, close):
+        self.highs.push(high)
+        self.lows.push(low)
+        lowest = self.lows.values.min(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stoch_k = 100 * (close - lowest) / (self.highs.values.max(axis=0) - lowest)
+        self.stoch_k.push(stoch_k)
+        return stoch_k, self.stoch_k.values.mean(axis=0)
+
+class StreamingROC:
+    def __init__(self, close, window=12):
+        self.closes = RollingWindow(close, window)
+
+    def update(self, close):
+        previous = self.closes.push(close)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (close - previous) / previous * 100
+
+class StreamingParabolicSAR:
+    """Parabolic SAR of ta's PSARIndicator, replaying the history to reach its state."""
+    def __init__(self, high, low, close, step=0.02, max_step=0.2):
+        self.step = step
+        self.max_step = max_step
+        self.count = 0
+        shape = close.shape[1:]
+        self.psar = np.full(shape, np.nan)
+        # Highs and lows of the two previous candles, the oldest first
+        self.highs = np.full((2,) + shape, np.nan)
+        self.lows = np.full((2,) + shape, np.nan)
+        self.up_trend = np.ones(shape, dtype=bool)
+        self.acceleration = np.full(shape, step)
+        self.up_trend_high = np.full(shape, np.nan)
+        self.down_trend_low = np.full(shape, np.nan)
+        for i in range(len(close)):
+            self.update(high[i], low[i], close[i])
+
+    def update(self, high, low, close):
+        high, low = np.asarray(high, dtype=np.float64), np.asarray(low, dtype=np.float64)
+        if self.count == 0:
+            self.up_trend_high, self.down_trend_low = high.copy(), low.copy()
+        if self.count < 2:
+            value = np.array(close, dtype=np.float64)
+        else:
+            up_trend, previous = self.up_trend, self.psar
+            value = np.where(up_trend, previous + self.acceleration * (self.up_trend_high - previous), previous - self.acceleration * (previous - self.down_trend_low))
+            reversal = np.where(up_trend, low < value, high > value)
+            up = ~reversal & up_trend
+            down = ~reversal & ~up_trend
+
+            # A reversal restarts from the extreme point of the trend it ends
+            value = np.where(reversal, np.where(up_trend, self.up_trend_high, self.down_trend_low), value)
+            extend_up = up & (high > self.up_trend_high)
+            extend_down = down & (low < self.down_trend_low)
+            self.up_trend_high = np.where(extend_up | (reversal & ~up_trend), high, self.up_trend_high)
+            self.down_trend_low = np.where(extend_down | (reversal & up_trend), low, self.down_trend_low)
+            self.acceleration = np.where(reversal, self.step, np.where(extend_up | extend_down, np.minimum(self.acceleration + self.step, self.max_step), self.acceleration))
+
+            # The SAR never goes past the extremes of the two previous candles
+            value = np.where(up & (self.lows[0] < value), self.lows[0], np.where(up & (self.lows[1] < value), self.lows[1], value))
+            value = np.where(down & (self.highs[0] > value), self.highs[0], np.where(down & (self.highs[1] > value), self.highs[1], value))
+            self.up_trend = up_trend != reversal
+
+        self.highs = np.stack((self.highs[1], high))
+        self.lows = np.stack((self.lows[1], low))
+        self.psar = value
+        self.count += 1
+        return value
+
+class StreamingIndicators:
+    """
+    The INDICATOR_COLUMNS of many symbols, updated in O(1) per new candle.
+
+    Seeded from the historical (candles x symbols) blocks, update takes the next candle of every
+    symbol and returns its feature row, the same as the last row of compute_indicators over the
+    whole history, NaN carried forward from the previous row like the trailing fill of fill_gaps.
+    """
+    def __init__(self, high, low, close, volume):
+        high, low, close, volume = (np.asarray(values, dtype=np.float64) for values in (high, low, close, volume))
+        if len(close) < 28:
+            raise ValueError(f"At least 28 candles are needed to seed the indicators, got {len(close)}")
+        self.ema_short = StreamingEMA(close, 2 / (12 + 1), 12)
+        self.ema_long = StreamingEMA(close, 2 / (26 + 1), 26)
+        self.macd_signal = StreamingEMA(ewm_mean(close, 2 / (12 + 1), 12) - ewm_mean(close, 2 / (26 + 1), 26), 2 / (9 + 1), 9)
+        self.rsi = StreamingRSI(close)
+        self.bollinger = StreamingBollingerBands(close)
+        self.atr = StreamingATR(high, low, close)
+        self.adx = StreamingADX(high, low, close)
+        self.obv = StreamingOBV(close, volume)
+        self.vwap = StreamingVWAP(high, low, close, volume)
+        self.parabolic_sar = StreamingParabolicSAR(high, low, close)
+        self.stochastic = StreamingStochastic(high, low, close)
+        self.roc = StreamingROC(close)
+        indicators = compute_indicators(high, low, close, volume)
+        self.last = fill_gaps(np.stack([indicators[column] for column in INDICATOR_COLUMNS], axis=-1))[-1]
+
+    def update(self, high, low, close, volume):
+        """
+        Add the next candle of every symbol.
+
+        :param high: Array of shape (symbols,), same for low, close and volume.
+        :return: Array of shape (symbols, len(INDICATOR_COLUMNS)) of the new feature rows.
+        """
+        high, low, close, volume = (np.asarray(values, dtype=np.float64) for values in (high, low, close, volume))
+        indicators = {}
+        indicators['ema_short'] = self.ema_short.update(close)
+        indicators['ema_long'] = self.ema_long.update(close)
+        indicators['rsi'] = self.rsi.update(close)
+        indicators['macd'] = indicators['ema_short'] - indicators['ema_long']
+        indicators['macd_signal'] = self.macd_signal.update(indicators['macd'])
+        indicators['macd_hist'] = indicators['macd'] - indicators['macd_signal']
+        indicators['boll_hband'], indicators['boll_mband'], indicators['boll_lband'] = self.bollinger.update(close)
+        indicators['atr'] = self.atr.update(high, low, close)
+        indicators['adx'], indicators['adx_neg'], indicators['adx_pos'] = self.adx.update(high, low, close)
+        indicators['obv'] = self.obv.update(close, volume)
+        indicators['vwap'] = self.vwap.update(high, low, close, volume)
+        indicators['parabolic_sar'] = self.parabolic_sar.update(high, low, close)
+        indicators['stoch_k'], indicators['stoch_d'] = self.stochastic.update(high, low, close)
+        indicators['roc'] = self.roc.update(close)
+
+        row = np.stack([indicators[column] for column in INDICATOR_COLUMNS], axis=-1)
+        self.last = np.where(np.isnan(row), self.last, row)
+        return self.last.copy()
@@ -0,0 +1,111 @@
+import time
+import logging
+import unittest
+import numpy as np
+import pandas as pd
+import ta
+from utilities import add_technical_indicators
+from indicators import INDICATOR_COLUMNS, StreamingIndicators, add_indicators, compute_indicators, fill_gaps
+
+def ta_indicators(df_original):
+    # The per symbol ta calls add_technical_indicators used to make
+    df = df_original.copy()
+    df['ema_short'] = ta.trend.EMAIndicator(close=df['close'], window=12).ema_indicator()
+    df['ema_long'] = ta.trend.EMAIndicator(close=df['close'], window=26).ema_indicator()
+    df['rsi'] = ta.momentum.RSIIndicator(close=df['close'], window=14).rsi()
+    macd = ta.trend.MACD(close=df['close'])
+    df['macd'] = macd.macd()
+    df['macd_signal'] = macd.macd_signal()
+    df['macd_hist'] = macd.macd_diff()
+    df['boll_hband'] = ta.volatility.BollingerBands(close=df['close']).bollinger_hband()
+    df['boll_mband'] = ta.volatility.BollingerBands(close=df['close']).bollinger_mavg()
+    df['boll_lband'] = ta.volatility.BollingerBands(close=df['close']).bollinger_lband()
+    df['atr'] = ta.volatility.AverageTrueRange(high=df['high'], low=df['low'], close=df['close'], window=14).average_true_range()
+    dmi = ta.trend.ADXIndicator(high=df['high'], low=df['low'], close=df['close'], window=14)
+    df['adx'] = dmi.adx()
+    df['adx_neg'] = dmi.adx_neg()
+    df['adx_pos'] = dmi.adx_pos()
+    df['obv'] = ta.volume.OnBalanceVolumeIndicator(close=df['close'], volume=df['volume']).on_balance_volume()
+    df['vwap'] = ta.volume.VolumeWeightedAveragePrice(high=df['high'], low=df['low'], close=df['close'], volume=df['volume']).volume_weighted_average_price()
+    df['parabolic_sar'] = ta.trend.PSARIndicator(high=df['high'], low=df['low'], close=df['close']).psar()
+    stochastic = ta.momentum.StochasticOscillator(high=df['high'], low=df['low'], close=df['close'])
+    df['stoch_k'] = stochastic.stoch()
+    df['stoch_d'] = stochastic.stoch_signal()
+    df['roc'] = ta.momentum.ROCIndicator(close=df['close']).roc()
+    df.interpolate(method='linear', inplace=True)
+    df.bfill(inplace=True)
+    return df
+
+def make_candles(num_candles, seed):
+    rng = np.random.default_rng(seed)
+    close = rng.uniform(0.01, 50000) * np.exp(np.cumsum(rng.normal(0, 0.02, num_candles)))
+    open = np.concatenate(([close[0]], close[:-1]))
+    high = np.maximum(open, close) * (1 + rng.exponential(0.01, num_candles))
+    low = np.minimum(open, close) * (1 - rng.exponential(0.01, num_candles))
+    df = pd.DataFrame({'timestamp': pd.date_range('2024-01-01', periods=num_candles, freq='1h'), 'open': open, 'high': high, 'low': low, 'close': close, 'volume': rng.lognormal(8, 1, num_candles)})
+    # A halted market, flat candles make the stochastic oscillator undefined
+    df.loc[100:120, ['open', 'high', 'low', 'close']] = close[100]
+    return df
+
+class TestIndicators(unittest.TestCase):
+    def assert_matches_ta(self, df, expected):
+        self.assertEqual(list(df.columns), list(expected.columns))
+        pd.testing.assert_series_equal(df['timestamp'], expected['timestamp'])
+        for column in expected.columns[1:]:
+            scale = np.abs(expected[column]).max()
+            np.testing.assert_allclose(df[column], expected[column], rtol=1e-9, atol=1e-9 * scale, err_msg=column)
+
+    def test_matches_ta(self):
+        frames = [make_candles(500, seed) for seed in range(5)] + [make_candles(300, 5)]
+        started = time.perf_counter()
+        expected = [ta_indicators(df) for df in frames]
+        ta_duration = time.perf_counter() - started
+        started = time.perf_counter()
+        results = add_indicators(frames)
+        duration = time.perf_counter() - started
+        logging.info(f"ta: {ta_duration:.3f}s, vectorized: {duration:.3f}s")
+
+        for df, reference in zip(results, expected):
+            self.assertFalse(df.isnull().values.any())
+            self.assert_matches_ta(df, reference)
+        self.assert_matches_ta(add_technical_indicators(frames[0]), expected[0])
+
+    def test_indicators_are_overwritten(self):
+        df = make_candles(200, 7).set_index('timestamp')
+        first = add_technical_indicators(df)
+        again = add_technical_indicators(first)
+        self.assertEqual(list(again.columns), ['open', 'high', 'low', 'close', 'volume', *INDICATOR_COLUMNS])
+        pd.testing.assert_frame_equal(again, first)
+
+    def test_streaming_matches_batch(self):
+        frames = [make_candles(400, seed) for seed in range(4)]
+        blocks = {column: np.stack([df[column].to_numpy() for df in frames], axis=1) for column in ['high', 'low', 'close', 'volume']}
+        # Seeded from the first 150 candles, halted market included, then fed one candle at a time
+        streaming = StreamingIndicators(*(blocks[column][:150] for column in ['high', 'low', 'close', 'volume']))
+        rows = np.stack([streaming.update(*(blocks[column][i] for column in ['high', 'low', 'close', 'volume'])) for i in range(150, 400)])
+
+        indicators = compute_indicators(blocks['high'], blocks['low'], blocks['close'], blocks['volume'])
+        expected = np.stack([indicators[column] for column in INDICATOR_COLUMNS], axis=-1)[150:]
+        self.assertFalse(np.isnan(expected).any())
+        for feature, column in enumerate(INDICATOR_COLUMNS):
+            scale = np.abs(expected[:, :, feature]).max()
+            np.testing.assert_allclose(rows[:, :, feature], expected[:, :, feature], rtol=1e-9, atol=1e-9 * scale, err_msg=column)
+
+        # An undefined value repeats the previous row, like the trailing fill of the batch
+        flat = np.full(4, 123.0)
+        rows = np.stack([streaming.update(flat, flat, flat, np.ones(4)) for _ in range(20)])
+        self.assertFalse(np.isnan(rows).any())
+        # From the 14th flat candle on the stochastic oscillator is undefined
+        stoch_k = rows[:, :, INDICATOR_COLUMNS.index('stoch_k')]
+        np.testing.assert_array_equal(stoch_k[13:], np.broadcast_to(stoch_k[12], stoch_k[13:].shape))
+
+        with self.assertRaises(ValueError):
+            StreamingIndicators(*(blocks[column][:20] for column in ['high', 'low', 'close', 'volume']))
+
+    def test_fill_gaps(self):
+        values = np.array([[np.nan, 1.0], [2.0, np.nan], [np.nan, np.nan], [8.0, 4.0], [np.nan, np.nan]])
+        expected = pd.DataFrame(values).interpolate(method='linear').bfill().to_numpy()
+        np.testing.assert_array_equal(fill_gaps(values), expected)
+
+if __name__ == '__main__':
+    unittest.main()
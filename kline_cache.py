@@ -0,0 +1,157 @@
+import os
+import time
+import logging
+import numpy as np
+import pandas as pd
+
+# One record per candle, open times in epoch milliseconds like the Binance API
+KLINE_DTYPE = np.dtype([
+    ('timestamp', np.int64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.float64),
+])
+
+# Intervals whose candles open on multiples of their length since the epoch
+INTERVAL_MS = {
+    '1s': 1000,
+    '1m': 60 * 1000,
+    '3m': 3 * 60 * 1000,
+    '5m': 5 * 60 * 1000,
+    '15m': 15 * 60 * 1000,
+    '30m': 30 * 60 * 1000,
+    '1h': 60 * 60 * 1000,
+    '2h': 2 * 60 * 60 * 1000,
+    '4h': 4 * 60 * 60 * 1000,
+    '6h': 6 * 60 * 60 * 1000,
+    '8h': 8 * 60 * 60 * 1000,
+    '12h': 12 * 60 * 60 * 1000,
+    '1d': 24 * 60 * 60 * 1000,
+}
+
+def merge_ranges(ranges):
+    """Union of closed [start, end] ranges of open times, touching ranges are joined."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+class KlineCache:
+    """
+    On-disk cache of the klines fetched from Binance, one .npz file per symbol and interval.
+
+    A file holds the closed candles fetched so far and the ranges of open times already asked
+    for, so a request is served from disk and only the parts of its range never fetched go
+    to the network. Ranges with no candle, before a symbol was listed, are remembered as well.
+    The candle still open at the time of a request is returned but never stored.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, symbol, interval):
+        return os.path.join(self.directory, f"{symbol}_{interval}.npz")
+
+    def load(self, symbol, interval):
+        """
+        Load the cached klines of a symbol and interval.
+
+        :return: Tuple of (records, ranges), records of KLINE_DTYPE sorted by open time and a list
+            of the [start, end] ranges of open times already fetched.
+        """
+        path = self.path(symbol, interval)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=KLINE_DTYPE), []
+        with np.load(path) as cached:
+            return cached['candles'], cached['ranges'].tolist()
+
+    def save(self, symbol, interval, candles, ranges):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(symbol, interval)
+        # Write next to the file and rename, concurrent runs never read a partial file
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'wb') as file:
+            np.savez(file, candles=candles, ranges=np.asarray(ranges, dtype=np.int64).reshape(-1, 2))
+        os.replace(temporary_path, path)
+
+    def missing_ranges(self, ranges, start, end, step):
+        """Parts of [start, end] not covered by the cached ranges, as [start, end] open times."""
+        missing = []
+        for cached_start, cached_end in merge_ranges(ranges):
+            if cached_end < start or cached_start > end:
+                continue
+            if cached_start > start:
+                missing.append([start, cached_start - step])
+            start = max(start, cached_end + step)
+        if start <= end:
+            missing.append([start, end])
+        return missing
+
+    def get(self, symbol, interval, limit, end_time, fetch):
+        """
+        Get the last klines opened at or before a time, fetching only the ones not cached.
+
+        :param symbol: The symbol of the klines.
+        :param interval: The interval of the klines, intervals not in INTERVAL_MS are not cached.
+        :param limit: The number of klines.
+        :param end_time: Latest open time in epoch milliseconds, None for now.
+        :param fetch: Function (limit, end_time) fetching klines from the exchange, returning a
+            DataFrame with a 'timestamp' column of open times and OHLCV columns.
+        :return: DataFrame with the 'timestamp' and OHLCV columns, sorted by open time.
+        """
+        if interval not in INTERVAL_MS:
+            return fetch(limit, end_time)
+
+        step = INTERVAL_MS[interval]
+        now = int(time.time() * 1000)
+        end = min(now if end_time is None else int(end_time), now)
+        end -= end % step
+        start = end - (limit - 1) * step
+        # Only candles closed by now are stored
+        last_closed = now - now % step - step
+
+        candles, ranges = self.load(symbol, interval)
+        fetched = []
+        for missing_start, missing_end in self.missing_ranges(ranges, start, end, step):
+            count = (missing_end - missing_start) // step + 1
+            logging.debug(f"Fetching {count} {interval} klines for {symbol} missing from the cache")
+            df = fetch(count, missing_end)
+            records = klines_records(df)
+            fetched.append(records[records['timestamp'] >= missing_start])
+            if missing_start <= last_closed:
+                ranges.append([missing_start, min(missing_end, last_closed)])
+
+        if fetched:
+            new_candles = np.concatenate(fetched)
+            stored = np.concatenate((candles, new_candles[new_candles['timestamp'] <= last_closed]))
+            # Keep the latest fetch of a candle fetched twice
+            _, unique = np.unique(stored['timestamp'][::-1], return_index=True)
+            stored = stored[::-1][unique]
+            self.save(symbol, interval, stored, merge_ranges(ranges))
+            candles = np.concatenate((stored, new_candles[new_candles['timestamp'] > last_closed]))
+
+        selected = candles[(candles['timestamp'] >= start) & (candles['timestamp'] <= end)]
+        return klines_frame(selected)
+
+def klines_records(df):
+    """KLINE_DTYPE records of a DataFrame with 'timestamp' open times and OHLCV columns."""
+    records = np.empty(len(df), dtype=KLINE_DTYPE)
+    records['timestamp'] = pd.DatetimeIndex(df['timestamp']).asi8 // 10**6
+    for field in KLINE_DTYPE.names[1:]:
+        records[field] = df[field].to_numpy(dtype=np.float64)
+    return records
+
+def klines_frame(records):
+    """DataFrame of KLINE_DTYPE records, with the columns fetch_binance_klines builds."""
+    df = pd.DataFrame({field: records[field] for field in KLINE_DTYPE.names[1:]})
+    df.insert(0, 'timestamp', pd.to_datetime(records['timestamp'], unit='ms'))
+    return df
+
+def default_kline_cache():
+    """The cache at KLINE_CACHE_PATH, None when the variable is not set."""
+    directory = os.getenv('KLINE_CACHE_PATH')
+    return KlineCache(directory) if directory else None
@@ -0,0 +1,97 @@
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+from utilities import fetch_binance_klines, fetch_binance_ohlcv
+from kline_cache import INTERVAL_MS, KlineCache
+
+LISTING_TIME = int(pd.Timestamp('2023-06-01').value // 10**6)
+
+class FakeBinance(BaseHTTPRequestHandler):
+    """Klines endpoint answering like Binance from a deterministic price curve, counting requests."""
+    requests = []
+
+    def do_GET(self):
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        FakeBinance.requests.append(query)
+        step = INTERVAL_MS[query['interval']]
+        now = int(time.time() * 1000)
+        end = min(int(query.get('endTime', now)), now)
+        last_open = end - end % step
+        opens = last_open - step * np.arange(int(query['limit']))[::-1]
+        opens = opens[opens >= LISTING_TIME]
+        body = json.dumps([[int(t), *[str(100 + np.sin(t / 1e8) + k) for k in range(4)], '10', int(t + step - 1), '0', 0, '0', '0', '0'] for t in opens])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+class TestKlineCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBinance)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = KlineCache(self.directory)
+        FakeBinance.requests = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fetch(self, limit, end_time, cache=None):
+        return fetch_binance_klines('BTC', '1h', limit, end_time, cache=self.cache if cache is None else cache, base_url=self.base_url)
+
+    def test_second_request_is_served_from_disk(self):
+        df, start_time, end_time = self.fetch(200, '2024-01-10')
+        self.assertEqual(len(FakeBinance.requests), 1)
+        uncached, _, _ = self.fetch(200, '2024-01-10', cache=False)
+        pd.testing.assert_frame_equal(df, uncached)
+
+        FakeBinance.requests = []
+        cached, cached_start, cached_end = self.fetch(200, '2024-01-10')
+        self.assertEqual(FakeBinance.requests, [])
+        pd.testing.assert_frame_equal(cached, df)
+        self.assertEqual((cached_start, cached_end), (start_time, end_time))
+
+    def test_only_missing_ranges_are_fetched(self):
+        self.fetch(100, '2024-01-10')
+        FakeBinance.requests = []
+        # 50 older and 24 newer candles around the cached range
+        df, _, _ = self.fetch(174, '2024-01-11')
+        self.assertEqual(sorted(int(request['limit']) for request in FakeBinance.requests), [24, 50])
+        pd.testing.assert_frame_equal(df, self.fetch(174, '2024-01-11', cache=False)[0])
+
+    def test_candles_before_listing_are_not_refetched(self):
+        raw = fetch_binance_ohlcv('BTC', '1d', 30, LISTING_TIME + 9 * INTERVAL_MS['1d'], base_url=self.base_url)
+        self.assertEqual(len(raw), 10)
+        fetch = lambda limit, end_time: fetch_binance_ohlcv('BTC', '1d', limit, end_time, base_url=self.base_url)
+        self.assertEqual(len(self.cache.get('BTC', '1d', 30, LISTING_TIME + 9 * INTERVAL_MS['1d'], fetch)), 10)
+        FakeBinance.requests = []
+        self.assertEqual(len(self.cache.get('BTC', '1d', 30, LISTING_TIME + 9 * INTERVAL_MS['1d'], fetch)), 10)
+        self.assertEqual(FakeBinance.requests, [])
+
+    def test_open_candle_is_not_stored(self):
+        fetch = lambda limit, end_time: fetch_binance_ohlcv('BTC', '1m', limit, end_time, base_url=self.base_url)
+        df = self.cache.get('BTC', '1m', 5, None, fetch)
+        candles, ranges = self.cache.load('BTC', '1m')
+        self.assertEqual(len(candles), len(df) - 1)
+        self.assertLess(ranges[-1][1], df['timestamp'].iloc[-1].value // 10**6)
+
+if __name__ == '__main__':
+    unittest.main()
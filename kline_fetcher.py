@@ -0,0 +1,147 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+BINANCE_API_URL = "https://api.binance.com"
+
+class TokenBucket:
+    """
+    Token bucket rate limiter shared by threads.
+
+    Tokens refill continuously at rate per second up to capacity, and acquire blocks until the
+    requested tokens are available, so bursts are allowed but the long run rate is bounded.
+    """
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Take tokens from the bucket, waiting for them when it is empty."""
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            self.sleep(wait)
+
+class KlineFetcher:
+    """
+    Fetch klines of many symbols concurrently over a pooled HTTP session.
+
+    Requests from every thread share one requests.Session, whose connection pool is sized for the
+    workers, and one TokenBucket counting the request weight of the klines endpoint against the
+    exchange limit per minute. Rate limited (429, 418) and server errors are retried with a
+    jittered exponential backoff, honouring Retry-After when the exchange sends it.
+    """
+    RETRY_STATUSES = (418, 429, 500, 502, 503, 504)
+
+    def __init__(self, max_workers=8, weight_per_minute=3000, request_weight=2, retries=3, backoff_factor=0.3, base_url=BINANCE_API_URL, session=None):
+        self.max_workers = max_workers
+        self.request_weight = request_weight
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.base_url = base_url
+        # Half of the 6000 weight per minute of Binance by default, leaving room for the live bot
+        self.bucket = TokenBucket(weight_per_minute / 60, weight_per_minute / 6)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.num_requests = 0
+        self.num_retries = 0
+        self.lock = threading.Lock()  # Guards the counters, updated from the worker threads
+
+    def backoff(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None:
+            return float(retry_after)
+        return self.backoff_factor * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def get_json(self, path, params):
+        """
+        GET an endpoint of the exchange within the rate limit, retrying transient failures.
+
+        :param path: The path of the endpoint, such as /api/v3/klines.
+        :param params: The query parameters.
+        :return: The decoded JSON body.
+        """
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire(self.request_weight)
+            with self.lock:
+                self.num_requests += 1
+            response = None
+            try:
+                response = self.session.get(f"{self.base_url}{path}", params=params, timeout=10)
+                if response.status_code not in self.RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.json()
+                error = requests.exceptions.HTTPError(f"HTTP {response.status_code}", response=response)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            if attempt == self.retries:
+                raise error
+            with self.lock:
+                self.num_retries += 1
+            logging.debug(f"Attempt {attempt + 1} for {params} failed: {error}")
+            time.sleep(self.backoff(attempt, response))
+
+    def fetch_ohlcv(self, symbol, interval, limit=100, end_time=None):
+        """
+        Page through the klines of a symbol, same result as utilities.fetch_binance_ohlcv.
+
+        :param end_time: Latest open time in epoch milliseconds, None for now.
+        :return: DataFrame with the 'timestamp' and OHLCV columns, sorted by open time.
+        """
+        klines = []
+        while len(klines) < limit:
+            params = {'symbol': symbol + 'USDT', 'interval': interval, 'limit': min(limit - len(klines), 1000)}
+            if end_time is not None:
+                params['endTime'] = end_time
+            data = self.get_json('/api/v3/klines', params)
+            if isinstance(data, dict) and 'code' in data:
+                raise Exception(f"API Error: {data['msg']}")
+            if not data:
+                break
+            klines = data + klines
+            end_time = data[0][0] - 1
+            if len(data) < params['limit']:
+                break
+
+        klines = pd.DataFrame([kline[:6] for kline in klines], columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        klines['timestamp'] = pd.to_datetime(klines['timestamp'], unit='ms')
+        klines[['open', 'high', 'low', 'close', 'volume']] = klines[['open', 'high', 'low', 'close', 'volume']].apply(pd.to_numeric).astype(float)
+        return klines
+
+    def map(self, function, items):
+        """
+        Call a function on items from the worker threads.
+
+        :return: List aligned with items of the results, or of the exceptions raised.
+        """
+        def call(item):
+            try:
+                return function(item)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(call, items))
+
+    def close(self):
+        self.session.close()
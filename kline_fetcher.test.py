@@ -0,0 +1,109 @@
+import json
+import logging
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+from utilities import fetch_binance_ohlcv, preprocess_data
+from kline_fetcher import KlineFetcher, TokenBucket
+
+HOUR_MS = 60 * 60 * 1000
+
+class MockBinance(BaseHTTPRequestHandler):
+    """Hourly klines endpoint with a fixed latency, failing the first requests of a symbol on demand."""
+    latency = 0.0
+    failures = {}
+
+    def do_GET(self):
+        time.sleep(MockBinance.latency)
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        symbol = query['symbol']
+        if MockBinance.failures.get(symbol, 0) > 0:
+            MockBinance.failures[symbol] -= 1
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        end = int(query['endTime'])
+        opens = end - end % HOUR_MS - HOUR_MS * np.arange(int(query['limit']))[::-1]
+        seed = sum(map(ord, symbol))
+        prices = [[str(10 + seed % 7 + np.sin(t / 1e7 + seed) + k / 10) for k in range(4)] for t in opens]
+        body = json.dumps([[int(t), *price, '12.5', int(t + HOUR_MS - 1), '0', 0, '0', '0', '0'] for t, price in zip(opens, prices)])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+class TestKlineFetcher(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), MockBinance)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        MockBinance.latency = 0.0
+        MockBinance.failures = {}
+        self.end_time = int(pd.Timestamp('2024-03-01').value // 10**6)
+
+    def test_token_bucket_waits_for_tokens(self):
+        now = [0.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            now[0] += seconds
+
+        bucket = TokenBucket(rate=10, capacity=20, clock=lambda: now[0], sleep=sleep)
+        bucket.acquire(20)
+        self.assertEqual(waits, [])
+        bucket.acquire(5)
+        self.assertAlmostEqual(sum(waits), 0.5)
+
+    def test_same_klines_as_sequential_fetch(self):
+        fetcher = KlineFetcher(base_url=self.base_url)
+        df = fetcher.fetch_ohlcv('BTC', '1h', 2500, self.end_time)
+        pd.testing.assert_frame_equal(df, fetch_binance_ohlcv('BTC', '1h', 2500, self.end_time, base_url=self.base_url))
+        self.assertEqual(fetcher.num_requests, 3)
+
+    def test_rate_limited_requests_are_retried(self):
+        MockBinance.failures = {'ETHUSDT': 2}
+        fetcher = KlineFetcher(base_url=self.base_url, backoff_factor=0.01)
+        self.assertEqual(len(fetcher.fetch_ohlcv('ETH', '1h', 10, self.end_time)), 10)
+        self.assertEqual(fetcher.num_retries, 2)
+
+        MockBinance.failures = {'ETHUSDT': 5}
+        with self.assertRaises(Exception):
+            KlineFetcher(base_url=self.base_url, retries=1, backoff_factor=0.01).fetch_ohlcv('ETH', '1h', 10, self.end_time)
+
+    def test_concurrent_preprocess_data(self):
+        # Every request takes 100ms, one page per symbol
+        MockBinance.latency = 0.1
+        symbols = [f'SYM{i}' for i in range(12)]
+        end_time = pd.Timestamp('2024-03-01').to_pydatetime()
+        results, durations = [], []
+        for max_workers in [1, 12]:
+            fetcher = KlineFetcher(max_workers=max_workers, base_url=self.base_url)
+            started = time.perf_counter()
+            results.append(preprocess_data(len(symbols), symbols, '1h', 200, end_time, fetcher=fetcher))
+            durations.append(time.perf_counter() - started)
+            fetcher.close()
+        logging.info(f"Sequential fetch: {durations[0]:.2f}s, concurrent fetch: {durations[1]:.2f}s")
+
+        np.testing.assert_array_equal(results[0][0], results[1][0])
+        self.assertEqual(results[0][1], results[1][1])
+        self.assertEqual(results[1][3], sorted(symbols))
+        self.assertLess(durations[1], durations[0] / 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,12 +9,15 @@ from stable_baselines3.common.vec_env import VecNormalize
 from stable_baselines3.common.monitor import Monitor
 from utilities import calculate_reward
 import pandas as pd
+import numpy as np
 import logging
 import ccxt
 import threading
 import queue
 import pprint  # Add this import at the top of your file
 from tabulate import tabulate  # Import tabulate
+from indicators import INDICATOR_COLUMNS
+from feature_window import FeatureWindow
 
 from interactions import setup_env, get_nonce, fetch_symbols, open_trade, close_trade, fetch_open_trades, close_all_open_trades
 from man_adjust_sl import update_stop_loss_for_profitable_trades, fetch_open_trades2
@@ -27,6 +30,12 @@ import time
 # Initialize a buffer to store messages
 message_buffer = {}
 
+# Indicators of the live candles, seeded from the historical window on the first closed candle
+streaming_indicators = None
+
+# Preallocated window of the latest feature rows the environment observes
+feature_window = None
+
 # Initialize a queue to communicate between threads
 risk_management_queue = queue.Queue()
 
@@ -47,6 +56,7 @@ risk_thread.start()
 # Define WebSocket event handlers
 # Define WebSocket event handlers
 def on_message(ws, message):
+    global streaming_indicators
     logging.debug(f"Received raw message: {message}")  # Debug level log for raw message
 
     try:
@@ -107,58 +117,32 @@ def on_message(ws, message):
                 logging.debug(f"Appended kline data to message_buffer for timestamp: {timestamp}")  # Debug level log for data appending
                 
                 if len(message_buffer[timestamp]) == len(financial_params['symbols']):
-                    from utilities import transform_to_matrix, add_technical_indicators
+                    from indicators import StreamingIndicators
                     logging.info(f"Received all messages for timestamp: {timestamp}")  # Info level log for all messages received
                     
-                    message_buffer[timestamp] = sorted(message_buffer[timestamp], key=lambda x: x.iloc[0]['symbol'])
+                    symbols = sorted(financial_params['symbols'])
+                    candles = pd.concat(message_buffer.pop(timestamp)).set_index('symbol').loc[symbols]
+                    candle_time = pd.to_datetime(timestamp, unit='ms')
+                    mapping = live_env.envs[0].get_wrapper_attr('mapping')
                     logging.debug(f"Sorted message_buffer for timestamp: {timestamp}")  # Debug level log for buffer sorting
                     
-                    # logging.info(f"Current window: {current_window}")
-                    
-                    for index, symbol in enumerate(sorted(financial_params['symbols'])):
-                        cols = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
-                        
-                        # Check if it's the first batch of messages
-                        if len(message_buffer) == 1:
-                            dfw = current_window[symbol]  # First batch
-                            logging.debug(f"First batch for symbol {symbol}: {len(dfw)} candles")
-                        else:
-                            dfw = current_window[symbol].iloc[1:]  # Subsequent batches
-                            logging.debug(f"Subsequent batch for symbol {symbol}: {len(dfw)} candles")
-
-                        dfc = message_buffer[timestamp][index]
-                        logging.debug(f"Current batch for symbol {symbol}: {len(dfc)} candles")
-                        dfw.reset_index(inplace=True)
-                        dfc.reset_index(inplace=True)
-                        
-                        # Concatenate without dropping duplicates immediately
-                        current_window[symbol] = pd.concat([dfw[cols], dfc[cols]], axis=0)
-                        
-                        logging.debug(f"Before drop duplicates for symbol {symbol}: {len(current_window[symbol])} candles")  # Debug level log for window update
-                        
-                        # Sort and drop duplicates after concatenation
-                        current_window[symbol] = current_window[symbol].sort_values(by='timestamp').drop_duplicates(subset=['timestamp'], keep='last')
-                        current_window[symbol].set_index('timestamp', inplace=True)
-                        
-                        # if current_window[symbol] length is financial_params['limit'] - 1
-                        if len(current_window[symbol]) == financial_params['limit'] - 1:
-                            # duplicate the first row
-                            current_window[symbol] = pd.concat([current_window[symbol].iloc[0:1], current_window[symbol]], axis=0)
-                        
-                        current_window[symbol] = add_technical_indicators(current_window[symbol])
-                        
-                        logging.info(f"Updated current window for symbol {symbol}: {len(current_window[symbol])} candles")  # Debug level log for window update
-                        logging.debug(f"{current_window[symbol].head()}")  # Debug level log for window update
+                    if streaming_indicators is None:
+                        # Seed the indicators from the candles before this one, the last fetched candle was still open
+                        history = feature_window.data_matrix[feature_window.timestamps < candle_time.value]
+                        streaming_indicators = StreamingIndicators(*(history[:, :, mapping[column]] for column in ['high', 'low', 'close', 'volume']))
+                        logging.debug(f"Seeded streaming indicators from {len(history)} candles")
                     
-                    # Print the columns of the DataFrame
-                    # print(current_window[symbol].columns)
-                
-                    timestamps = current_window[symbol].index.tolist()
-
-                    data = transform_to_matrix(current_window)
-                    logging.debug(f"Preprocessed data for current_window")  # Debug level log for data preprocessing
+                    # One feature row per symbol, written in place in the feature window
+                    features = streaming_indicators.update(candles['high'].values, candles['low'].values, candles['close'].values, candles['volume'].values)
+                    rows = np.empty(feature_window.data_matrix.shape[1:])
+                    for column in ['open', 'high', 'low', 'close', 'volume']:
+                        rows[:, mapping[column]] = candles[column].values
+                    for index, column in enumerate(INDICATOR_COLUMNS):
+                        rows[:, mapping[column]] = features[:, index]
+                    replaced = feature_window.append(rows, candle_time)
+                    logging.info(f"Updated feature window with the candles of {len(symbols)} symbols")  # Debug level log for window update
                     
-                    live_env.envs[0].get_wrapper_attr('update_data')(data, timestamps)
+                    live_env.envs[0].get_wrapper_attr('append_data')(feature_window.data_matrix, feature_window.timestamps, replaced)
                     logging.info(f"Updated environment with new data")  # Info level log for environment update
                     
                     obs = live_env.envs[0].get_wrapper_attr('next_observation')()
@@ -215,7 +199,7 @@ def on_close(ws, close_status_code, close_msg):
     start_trading_bot()  # Restart the trading bot
 
 def on_open(ws):
-    global live_env, model, financial_params, valid_symbols, current_window
+    global live_env, model, financial_params, valid_symbols, current_window, streaming_indicators, feature_window
     
     logging.info("WebSocket connection opened")
     logging.debug("Initializing trading bot components")
@@ -252,9 +236,11 @@ def on_open(ws):
     # # Prepare historical data
     data_matrix, timestamps, mapping, valid_symbols, current_window = preprocess_data(financial_params['target_num_symbols'], financial_params['symbols'], financial_params['interval'], financial_params['limit'])
     financial_params['symbols'] = valid_symbols
+    streaming_indicators = None
+    feature_window = FeatureWindow(data_matrix, timestamps)
     
     # Initialize the environment with live data
-    environment = TradingEnvironment(data_matrix=data_matrix, timestamps=timestamps, mapping=mapping, render_mode='human', params=selected_params, reward_function=calculate_reward, market_data=None, live_mode=True)
+    environment = TradingEnvironment(data_matrix=feature_window.data_matrix, timestamps=feature_window.timestamps, mapping=mapping, render_mode='human', params=selected_params, reward_function=calculate_reward, market_data=None, live_mode=True)
     live_env = DummyVecEnv([lambda: Monitor(environment)])
     live_env = VecNormalize(live_env, norm_obs=True, norm_reward=True, clip_obs=10.)
     
@@ -0,0 +1,48 @@
+# Random walk markets shared by the tests of the environments and their indexes
+import numpy as np
+import pandas as pd
+from utilities import add_technical_indicators
+
+def make_market(num_symbols=6, limit=200, seed=0):
+    # Random walk candles, priced low enough for the positions to reach the minimum leverage
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range('2024-01-01', periods=limit, freq='4h')
+    frames = []
+    for _ in range(num_symbols):
+        close = rng.uniform(0.2, 3) * np.exp(np.cumsum(rng.normal(0, 0.03, limit)))
+        open = np.r_[close[0], close[:-1]]
+        df = pd.DataFrame({
+            'timestamp': timestamps,
+            'open': open,
+            'high': np.maximum(open, close) * (1 + rng.uniform(0, 0.03, limit)),
+            'low': np.minimum(open, close) * (1 - rng.uniform(0, 0.03, limit)),
+            'close': close,
+            'volume': rng.lognormal(7, 0.5, limit),
+        })
+        frames.append(add_technical_indicators(df).set_index('timestamp'))
+    data_matrix = np.stack([df.values for df in frames], axis=1)
+    mapping = {name: i for i, name in enumerate(frames[0].columns)}
+    return data_matrix, list(timestamps), mapping
+
+def make_market_1s(num_symbols=4, limit=150, seed=0):
+    # 1 minute candles built from random walk 1s candles, the 1s frames feed the 1s risk management
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range('2024-01-01', periods=limit, freq='1min')
+    seconds = pd.date_range('2024-01-01', periods=limit * 60, freq='1s')
+    frames, market_data = [], []
+    for _ in range(num_symbols):
+        price = rng.uniform(0.2, 3) * np.exp(np.cumsum(rng.normal(0, 0.002, limit * 60)))
+        second_data = pd.DataFrame({'low': price * (1 - rng.uniform(0, 0.001, len(price))), 'high': price * (1 + rng.uniform(0, 0.001, len(price)))}, index=seconds)
+        market_data.append(second_data)
+        df = pd.DataFrame({
+            'timestamp': timestamps,
+            'open': price[::60],
+            'high': second_data['high'].values.reshape(limit, 60).max(axis=1),
+            'low': second_data['low'].values.reshape(limit, 60).min(axis=1),
+            'close': price[59::60],
+            'volume': rng.lognormal(7, 0.5, limit),
+        })
+        frames.append(add_technical_indicators(df).set_index('timestamp'))
+    data_matrix = np.stack([df.values for df in frames], axis=1)
+    mapping = {name: i for i, name in enumerate(frames[0].columns)}
+    return data_matrix, list(timestamps), mapping, market_data
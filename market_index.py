@@ -0,0 +1,476 @@
+import numpy as np
+from positions import epoch_ns
+from market_store import DAY_NS
+
+def fractal_centers(data_matrix, mapping, window=5):
+    """
+    Candle of the latest fractal high and low confirmed at every step of the data matrix.
+
+    A fractal centered on candle c is only visible once the candles after it have closed, so
+    it is recorded at step c + window // 2. The result matches the backward scan done by
+    TradingEnvironment.calculate_fractal_high/low at each step, -1 where no fractal exists.
+
+    :param data_matrix: Array of shape (steps, symbols, features).
+    :param mapping: Mapping of feature names to indices.
+    :param window: The number of candles of a fractal pattern.
+    :return: Tuple of (high_centers, low_centers) int arrays of shape (steps, symbols).
+    """
+    half = window // 2
+    centers = []
+    for feature, sign in (('high', 1), ('low', -1)):
+        prices = data_matrix[:, :, mapping[feature]]
+        num_steps = len(prices)
+        center = prices[half:num_steps - half] * sign
+        is_fractal = np.ones(center.shape, dtype=bool)
+        for offset in range(1, half + 1):
+            is_fractal &= center > prices[half - offset:num_steps - half - offset] * sign
+            is_fractal &= center > prices[half + offset:num_steps - half + offset] * sign
+        # The scan never looks at a pattern starting on the first candle
+        is_fractal[0] = False
+
+        # Forward fill the fractal candles from the step at which they are confirmed
+        confirmed = np.full(prices.shape, -1)
+        steps, symbols = np.nonzero(is_fractal)
+        confirmed[steps + 2 * half, symbols] = steps + half
+        centers.append(np.maximum.accumulate(confirmed, axis=0))
+
+    return tuple(centers)
+
+def fractal_levels(data_matrix, mapping, window=5):
+    """
+    Precompute the latest fractal high and low known at every step of the data matrix.
+
+    :param data_matrix: Array of shape (steps, symbols, features).
+    :param mapping: Mapping of feature names to indices.
+    :param window: The number of candles of a fractal pattern.
+    :return: Tuple of (fractal_highs, fractal_lows) arrays of shape (steps, symbols), NaN where no fractal exists.
+    """
+    levels = []
+    for feature, confirmed in zip(('high', 'low'), fractal_centers(data_matrix, mapping, window)):
+        prices = data_matrix[:, :, mapping[feature]]
+        level = np.take_along_axis(prices, np.maximum(confirmed, 0), axis=0)
+        levels.append(np.where(confirmed >= 0, level, np.nan))
+
+    return tuple(levels)
+
+class MirroredRows:
+    """
+    Rows of a sliding window kept in a buffer of 2 * window rows, as FeatureWindow does.
+
+    Every row is written at k and k + window, so the window is always a contiguous view and
+    sliding it by one row costs one row write.
+    """
+    def __init__(self, rows):
+        self.window = len(rows)
+        self.buffer = np.empty((2 * self.window,) + rows.shape[1:], dtype=rows.dtype)
+        self.buffer[:self.window] = self.buffer[self.window:] = rows
+        # Row of the oldest entry, the next one to be replaced
+        self.start = 0
+
+    @property
+    def rows(self):
+        """View of the rows of the window, the oldest first."""
+        return self.buffer[self.start:self.start + self.window]
+
+    def push(self, row):
+        """Add a row after the latest one, dropping the oldest."""
+        self.start = (self.start + 1) % self.window
+        self.replace(row)
+
+    def replace(self, row):
+        """Overwrite the latest row."""
+        latest = (self.start - 1) % self.window
+        self.buffer[latest] = self.buffer[latest + self.window] = row
+
+class FractalIndex:
+    """
+    Latest confirmed fractal high and low of every (step, symbol) of a data matrix.
+
+    The levels are computed in one vectorized pass the first time they are needed, so looking
+    up the fractals of a new position is O(1) instead of a backward scan of the data matrix.
+    Pointing the index at a new data matrix rebuilds it lazily, while append only computes the
+    levels of the candle added by the live loop.
+    """
+    def __init__(self, mapping, window=5):
+        self.mapping = mapping
+        self.window = window
+        self.data_matrix = None
+        # Fractal (high, low) levels and the candles they were found on, per step and symbol
+        self.levels = None
+        self.centers = None
+        # Candles dropped from the front of the data matrix since the levels were built, the
+        # centers count the candles from the first one of the build
+        self.dropped = 0
+
+    def update(self, data_matrix):
+        """Use a new data matrix, the levels are rebuilt on the next lookup."""
+        self.data_matrix = data_matrix
+        self.levels = None
+        self.centers = None
+
+    def build(self):
+        if self.levels is not None:
+            return
+        centers = np.stack(fractal_centers(self.data_matrix, self.mapping, self.window), axis=1)
+        prices = self.data_matrix[:, :, [self.mapping['high'], self.mapping['low']]].transpose(0, 2, 1)
+        levels = np.take_along_axis(prices, np.maximum(centers, 0), axis=0)
+        self.levels = MirroredRows(np.where(centers >= 0, levels, np.nan))
+        self.centers = MirroredRows(centers)
+        self.dropped = 0
+
+    def append(self, data_matrix, replaced=False):
+        """
+        Use the data matrix of the live loop after a candle was added to it.
+
+        Only the levels of the latest step are computed, from the last candles of the pattern,
+        so the cost of a candle does not depend on the length of the data matrix.
+
+        :param data_matrix: The data matrix slid by one candle, or with its latest candle replaced.
+        :param replaced: Whether the latest candle was replaced instead of a new one added.
+        """
+        self.data_matrix = data_matrix
+        if self.levels is None:
+            return
+        half = self.window // 2
+        # The levels carried from the step before the latest one
+        previous = -1 if replaced else 0
+        if len(data_matrix) + previous > 0:
+            levels = self.levels.rows[previous - 1]
+            centers = self.centers.rows[previous - 1]
+        else:
+            levels = np.full(self.levels.rows.shape[1:], np.nan)
+            centers = np.full(self.centers.rows.shape[1:], -1)
+        if not replaced:
+            self.dropped += 1
+
+        # A fractal centered half a pattern before the latest candle is confirmed by it
+        center = len(data_matrix) - 1 - half
+        if center >= half:
+            pattern = data_matrix[center - half:center + half + 1][:, :, [self.mapping['high'], self.mapping['low']]] * [1, -1]
+            others = np.delete(pattern, half, axis=0)
+            is_fractal = np.all(pattern[half] > others, axis=0).T
+            levels = np.where(is_fractal, data_matrix[center][:, [self.mapping['high'], self.mapping['low']]].T, levels)
+            centers = np.where(is_fractal, self.dropped + center, centers)
+
+        if replaced:
+            self.levels.replace(levels)
+            self.centers.replace(centers)
+        else:
+            self.levels.push(levels)
+            self.centers.push(centers)
+
+    def levels_at(self, step, symbol_index):
+        """
+        Get the fractal levels known at a step, or an array of steps.
+
+        :return: Tuple of (fractal_highs, fractal_lows), NaN where no fractal was found.
+        """
+        self.build()
+        levels = self.levels.rows[step, :, symbol_index]
+        # Patterns starting on the first candle of the data matrix or before it are not visible
+        visible = self.centers.rows[step, :, symbol_index] - self.dropped > self.window // 2
+        levels = np.where(visible, levels, np.nan)
+        return levels[..., 0][()], levels[..., 1][()]
+
+    def lookup(self, step, symbol_index):
+        """
+        Get the fractals known at a step, as calculate_fractal_high/low would find them.
+
+        :param step: The current step in the data matrix.
+        :param symbol_index: The index of the symbol.
+        :return: Tuple of (fractal_high, fractal_low), None where no fractal was found.
+        """
+        fractal_high, fractal_low = self.levels_at(step, symbol_index)
+        return None if np.isnan(fractal_high) else fractal_high, None if np.isnan(fractal_low) else fractal_low
+
+class RollingStats:
+    """
+    Prefix sums of a few features of a data matrix, per symbol.
+
+    Means and standard deviations over any window ending at a step are answered in O(1) from
+    the running counts, sums and sums of squares, skipping NaN values like np.nanmean does.
+    The sums are rebuilt lazily when the index is pointed at a new data matrix, and extended
+    by one row when append adds a candle.
+    """
+    def __init__(self, mapping, features=('close', 'atr', 'volume')):
+        self.mapping = mapping
+        self.features = {feature: i for i, feature in enumerate(features)}
+        self.data_matrix = None
+        # Running (counts, sums, squares) of shape (steps + 1, 3, symbols, features)
+        self.prefixes = None
+        # Candles added by append since the sums were built
+        self.appended = 0
+
+    def update(self, data_matrix):
+        """Use a new data matrix, the sums are rebuilt on the next lookup."""
+        self.data_matrix = data_matrix
+        self.prefixes = None
+
+    def totals(self, rows):
+        """Counts, sums and sums of squares of the features of candle rows, NaN skipped."""
+        values = rows[..., [self.mapping[feature] for feature in self.features]].astype(np.float64)
+        valid = ~np.isnan(values)
+        values = np.where(valid, values, 0.0)
+        return np.stack((valid.astype(np.float64), values, values ** 2), axis=-3)
+
+    def build(self):
+        if self.prefixes is not None:
+            return
+        totals = self.totals(self.data_matrix)
+        # A leading row of zeros makes the sum over steps [start, end) equal to sums[end] - sums[start]
+        self.prefixes = MirroredRows(np.concatenate((np.zeros((1, ) + totals.shape[1:]), np.cumsum(totals, axis=0))))
+        self.appended = 0
+
+    def append(self, data_matrix, replaced=False):
+        """
+        Use the data matrix of the live loop after a candle was added to it.
+
+        Only the prefix row of the latest candle is computed, so the cost of a candle does not
+        depend on the length of the data matrix. The sums keep growing from the candles that
+        were dropped, so they are rebuilt once every data matrix length to bound rounding.
+
+        :param data_matrix: The data matrix slid by one candle, or with its latest candle replaced.
+        :param replaced: Whether the latest candle was replaced instead of a new one added.
+        """
+        self.data_matrix = data_matrix
+        if self.prefixes is None:
+            return
+        if not replaced:
+            self.appended += 1
+            if self.appended >= len(data_matrix):
+                self.prefixes = None
+                return
+        previous = self.prefixes.rows[-2 if replaced else -1]
+        row = previous + self.totals(data_matrix[-1])
+        if replaced:
+            self.prefixes.replace(row)
+        else:
+            self.prefixes.push(row)
+
+    def window_sums(self, feature, step, symbol_index, window=None):
+        self.build()
+        end = np.asarray(step) + 1
+        start = 0 if window is None else np.maximum(0, end - window)
+        prefixes = self.prefixes.rows
+        index = self.features[feature]
+        totals = prefixes[end, :, symbol_index, index] - prefixes[start, :, symbol_index, index]
+        return totals[..., 0], totals[..., 1], totals[..., 2]
+
+    def mean(self, feature, step, symbol_index, window=None):
+        """
+        Mean of a feature over the window of candles ending at a step, the step included.
+
+        :param feature: The name of the feature.
+        :param step: The last step of the window, or an array of steps.
+        :param symbol_index: The index of the symbol.
+        :param window: The number of candles of the window, None for all candles up to the step.
+        :return: The mean, NaN when the window has no values.
+        """
+        count, total, _ = self.window_sums(feature, step, symbol_index, window)
+        return np.divide(total, count, out=np.full(np.shape(total), np.nan), where=count > 0)[()]
+
+    def std(self, feature, step, symbol_index, window=None):
+        """Population standard deviation of a feature over the window ending at a step, see mean."""
+        count, total, squares = self.window_sums(feature, step, symbol_index, window)
+        mean = np.divide(total, count, out=np.full(np.shape(total), np.nan), where=count > 0)
+        variance = np.divide(squares, count, out=np.full(np.shape(total), np.nan), where=count > 0) - mean ** 2
+        # Rounding can leave a tiny negative variance for flat windows
+        return np.sqrt(np.maximum(variance, 0))[()]
+
+def candle_extremes(lows, highs, starts, ends):
+    """
+    Lowest low and highest high of the 1s rows [start, end) of every candle, skipping NaN.
+
+    :return: Tuple of (min_lows, max_highs), inf and -inf for the candles without rows.
+    """
+    min_lows = np.full(len(starts), np.inf)
+    max_highs = np.full(len(starts), -np.inf)
+    # The rows between candles land on the odd bounds and are dropped, a sentinel row keeps
+    # the last end a valid index
+    candles = np.flatnonzero(ends > starts)
+    bounds = np.column_stack((starts[candles], ends[candles])).ravel()
+    if len(bounds):
+        min_lows[candles] = np.fmin.reduceat(np.append(lows, np.inf), bounds)[::2]
+        max_highs[candles] = np.fmax.reduceat(np.append(highs, -np.inf), bounds)[::2]
+    return min_lows, max_highs
+
+class IntrabarIndex:
+    """
+    1s candles of every symbol, with the rows falling inside each candle of the environment.
+
+    The 1s times, lows and highs are kept as contiguous NumPy arrays sorted by time, and the
+    start and end rows of every candle are found with searchsorted over the int64 times. The
+    risk checks then slice the seconds of one candle instead of masking the whole 1s history.
+    The lowest low and highest high of the seconds of every candle are kept too, so a candle
+    whose range reaches no level can be skipped without scanning its seconds.
+    The row offsets are rebuilt lazily when the index is pointed at new candle timestamps.
+    """
+    def __init__(self, market_data):
+        self.times = []
+        self.lows = []
+        self.highs = []
+        for df in market_data:
+            if df is None:
+                self.times.append(None)
+                self.lows.append(None)
+                self.highs.append(None)
+                continue
+            times = epoch_ns(df.index)
+            order = np.argsort(times, kind='stable') if np.any(times[1:] < times[:-1]) else slice(None)
+            self.times.append(np.ascontiguousarray(times[order]))
+            self.lows.append(np.ascontiguousarray(df['low'].to_numpy(dtype=np.float64)[order]))
+            self.highs.append(np.ascontiguousarray(df['high'].to_numpy(dtype=np.float64)[order]))
+        self.timestamps = None
+        self.starts = None
+        self.ends = None
+        self.min_lows = None
+        self.max_highs = None
+
+    def update(self, timestamps):
+        """Use new candle timestamps in epoch nanoseconds, the offsets are rebuilt on the next lookup."""
+        self.timestamps = timestamps
+        self.starts = None
+        self.ends = None
+        self.min_lows = None
+        self.max_highs = None
+
+    def build(self):
+        if self.starts is not None:
+            return
+        # A candle covers the seconds strictly between the previous candle time and its own
+        previous = np.concatenate((self.timestamps[:1], self.timestamps[:-1]))
+        self.starts = []
+        self.ends = []
+        # Candles without seconds, or symbols without 1s data, have a range that reaches no level
+        self.min_lows = np.full((len(self.timestamps), len(self.times)), np.inf)
+        self.max_highs = np.full((len(self.timestamps), len(self.times)), -np.inf)
+        for symbol_index, times in enumerate(self.times):
+            if times is None:
+                self.starts.append(None)
+                self.ends.append(None)
+                continue
+            starts = np.searchsorted(times, previous, side='right')
+            ends = np.maximum(np.searchsorted(times, self.timestamps, side='left'), starts)
+            self.starts.append(starts)
+            self.ends.append(ends)
+
+            self.min_lows[:, symbol_index], self.max_highs[:, symbol_index] = candle_extremes(self.lows[symbol_index], self.highs[symbol_index], starts, ends)
+
+    def has_data(self, symbol_index):
+        return self.times[symbol_index] is not None
+
+    def rows(self, step, symbol_index):
+        """
+        Get the 1s rows of the candle at a step.
+
+        :param step: The current step in the data matrix.
+        :param symbol_index: The index of the symbol.
+        :return: Slice of the 1s arrays of the symbol.
+        """
+        self.build()
+        return slice(self.starts[symbol_index][step], self.ends[symbol_index][step])
+
+    def extremes(self, step, symbol_indices):
+        """
+        Get the lowest low and highest high of the seconds of the candle at a step.
+
+        :param step: The current step in the data matrix.
+        :param symbol_indices: The index of a symbol, or an array of them.
+        :return: Tuple of (min_low, max_high), inf and -inf when the candle has no seconds.
+        """
+        self.build()
+        return self.min_lows[step, symbol_indices], self.max_highs[step, symbol_indices]
+
+    def window(self, step, symbol_index):
+        """
+        Get the 1s candles of the candle at a step, as views of the sorted arrays.
+
+        :param step: The current step in the data matrix.
+        :param symbol_index: The index of the symbol.
+        :return: Tuple of (low_prices, high_prices, times) arrays.
+        """
+        rows = self.rows(step, symbol_index)
+        return self.lows[symbol_index][rows], self.highs[symbol_index][rows], self.times[symbol_index][rows]
+
+    def windows(self, step, symbol_indices):
+        """
+        Stack the 1s candles of several symbols at a step, ragged with offsets.
+
+        :param step: The current step in the data matrix.
+        :param symbol_indices: The indices of one or more symbols having 1s data.
+        :return: Tuple of (low_prices, high_prices, times, offsets), where the candles of the
+            n-th symbol are the rows offsets[n] to offsets[n + 1] of the stacked arrays.
+        """
+        rows = [self.rows(step, i) for i in symbol_indices]
+        offsets = np.concatenate(([0], np.cumsum([row.stop - row.start for row in rows])))
+
+        def stack(arrays):
+            return np.concatenate([arrays[i][row] for i, row in zip(symbol_indices, rows)])
+
+        return stack(self.lows), stack(self.highs), stack(self.times), offsets
+
+class ShardedIntrabarIndex:
+    """
+    IntrabarIndex over a MarketDataProvider, reading the 1s candles of a candle on demand.
+
+    Nothing is loaded up front: the seconds of a candle come from the day shards cached by the
+    provider, which is shared with the other environments of the process and bounded by its
+    memory budget. The first time the extremes of a candle are asked for, those of every candle
+    ending the same day are reduced in one pass over the day and kept, so the check of whether
+    a candle reaches a level is a lookup and only the candles reaching one read their seconds.
+    """
+    def __init__(self, provider, symbols):
+        self.provider = provider
+        self.symbols = list(symbols)
+        self.available = [provider.has_symbol(symbol) for symbol in self.symbols]
+        self.timestamps = None
+
+    def update(self, timestamps):
+        """Use new candle timestamps in epoch nanoseconds, the extremes are reduced again on demand."""
+        self.timestamps = timestamps
+        self.days = np.asarray(timestamps) // DAY_NS
+        shape = (len(timestamps), len(self.symbols))
+        self.min_lows = np.full(shape, np.inf)
+        self.max_highs = np.full(shape, -np.inf)
+        self.reduced = np.zeros(shape, dtype=bool)
+
+    def has_data(self, symbol_index):
+        return self.available[symbol_index]
+
+    def records(self, step, symbol_index):
+        # A candle covers the seconds strictly between the previous candle time and its own
+        start_time = self.timestamps[max(step - 1, 0)]
+        return self.provider.window(self.symbols[symbol_index], int(start_time), int(self.timestamps[step]))
+
+    def reduce_day(self, step, symbol_index):
+        # Every candle ending the day of the candle at step, from one read of its seconds
+        first = np.searchsorted(self.days, self.days[step], side='left')
+        last = np.searchsorted(self.days, self.days[step], side='right')
+        timestamps = np.asarray(self.timestamps[first:last], dtype=np.int64)
+        previous = np.asarray(self.timestamps[max(first - 1, 0):last - 1], dtype=np.int64)
+        if first == 0:
+            previous = np.concatenate((timestamps[:1], previous))
+        records = self.provider.window(self.symbols[symbol_index], int(previous[0]), int(timestamps[-1]))
+        times = records['timestamp']
+        starts = np.searchsorted(times, previous, side='right')
+        ends = np.maximum(np.searchsorted(times, timestamps, side='left'), starts)
+        self.min_lows[first:last, symbol_index], self.max_highs[first:last, symbol_index] = candle_extremes(records['low'], records['high'], starts, ends)
+        self.reduced[first:last, symbol_index] = True
+
+    def extremes(self, step, symbol_indices):
+        """See IntrabarIndex.extremes."""
+        for symbol_index in np.atleast_1d(symbol_indices):
+            if self.available[symbol_index] and not self.reduced[step, symbol_index]:
+                self.reduce_day(step, symbol_index)
+        return self.min_lows[step, symbol_indices], self.max_highs[step, symbol_indices]
+
+    def window(self, step, symbol_index):
+        """See IntrabarIndex.window, the prices are converted to float64."""
+        records = self.records(step, symbol_index)
+        return records['low'].astype(np.float64), records['high'].astype(np.float64), records['timestamp']
+
+    def windows(self, step, symbol_indices):
+        """See IntrabarIndex.windows."""
+        windows = [self.window(step, i) for i in symbol_indices]
+        offsets = np.concatenate(([0], np.cumsum([len(times) for _, _, times in windows])))
+        return tuple(np.concatenate(arrays) for arrays in zip(*windows)) + (offsets, )
@@ -0,0 +1,182 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import utilities  # Imported before environment, which imports it back
+from parameters import selected_params
+from environment import TradingEnvironment
+from market_index import FractalIndex, IntrabarIndex, RollingStats, ShardedIntrabarIndex
+from market_store import MarketDataProvider, MarketStore
+from feature_window import FeatureWindow
+from market_fixtures import make_market
+
+class TestFractalIndex(unittest.TestCase):
+    def setUp(self):
+        self.data_matrix, self.timestamps, self.mapping = make_market(num_symbols=4, limit=120)
+        params = dict(selected_params)
+        params.update({'symbols': [f'SYM{i}' for i in range(self.data_matrix.shape[1])], 'basic_risk_mgmt': True})
+        self.env = TradingEnvironment(self.data_matrix, self.timestamps, self.mapping, params=params)
+
+    def assert_matches_scan(self, index):
+        for step in range(len(self.env.timestamps)):
+            for i in range(self.env.num_symbols):
+                self.assertEqual(index.lookup(step, i), (self.env.calculate_fractal_high(step, i), self.env.calculate_fractal_low(step, i)))
+
+    def test_matches_backward_scan(self):
+        index = FractalIndex(self.mapping)
+        index.update(self.data_matrix)
+        self.assert_matches_scan(index)
+
+    def test_update_data_rebuilds(self):
+        # Slide the window by one new candle, as the live loop does
+        data_matrix, timestamps, _ = make_market(num_symbols=4, limit=120, seed=1)
+        self.env.fractal_index.lookup(0, 0)
+        self.env.update_data(data_matrix, timestamps)
+        self.assert_matches_scan(self.env.fractal_index)
+
+    def test_append_matches_rebuild(self):
+        # Slide a feature window over the candles, replacing the latest one now and then
+        window = FeatureWindow(self.data_matrix[:40], self.timestamps[:40])
+        index = FractalIndex(self.mapping)
+        index.update(window.data_matrix)
+        index.lookup(0, 0)
+        for step in range(40, len(self.data_matrix)):
+            if step % 7 == 0:
+                # The closed version of the latest candle
+                self.assertTrue(window.append(self.data_matrix[step - 1] * 1.02, self.timestamps[step - 1]))
+                index.append(window.data_matrix, True)
+            replaced = window.append(self.data_matrix[step], self.timestamps[step])
+            index.append(window.data_matrix, replaced)
+            rebuilt = FractalIndex(self.mapping)
+            rebuilt.update(window.data_matrix.copy())
+            for level, expected in zip(index.levels_at(np.arange(40), 1), rebuilt.levels_at(np.arange(40), 1)):
+                np.testing.assert_array_equal(level, expected)
+            self.assertEqual(index.lookup(39, 2), rebuilt.lookup(39, 2))
+
+class TestRollingStats(unittest.TestCase):
+    def setUp(self):
+        self.data_matrix, self.timestamps, self.mapping = make_market(num_symbols=4, limit=120)
+        self.stats = RollingStats(self.mapping)
+        self.stats.update(self.data_matrix)
+
+    def test_window_statistics(self):
+        closes = self.data_matrix[:, 1, self.mapping['close']]
+        atr = self.data_matrix[:, 1, self.mapping['atr']]
+        for step in [0, 10, len(closes) - 1]:
+            self.assertAlmostEqual(self.stats.std('close', step, 1), np.std(closes[:step + 1]))
+            self.assertAlmostEqual(self.stats.std('close', step, 1, window=5), np.std(closes[max(0, step - 4):step + 1]))
+        # The first ATR values are NaN and skipped
+        self.assertAlmostEqual(self.stats.mean('atr', 50, 1), np.nanmean(atr[:51]))
+        np.testing.assert_allclose(self.stats.mean('close', np.array([3, 7]), 1, window=2), [closes[2:4].mean(), closes[6:8].mean()])
+
+    def test_append_matches_rebuild(self):
+        window = FeatureWindow(self.data_matrix[:30], self.timestamps[:30])
+        self.stats.update(window.data_matrix)
+        self.stats.mean('close', 0, 0)
+        steps = np.arange(30)
+        for step in range(30, len(self.data_matrix)):
+            if step % 7 == 0:
+                # The closed version of the latest candle
+                self.assertTrue(window.append(self.data_matrix[step - 1] * 1.02, self.timestamps[step - 1]))
+                self.stats.append(window.data_matrix, True)
+            replaced = window.append(self.data_matrix[step], self.timestamps[step])
+            self.stats.append(window.data_matrix, replaced)
+            rebuilt = RollingStats(self.mapping)
+            rebuilt.update(window.data_matrix.copy())
+            for feature in ['close', 'atr', 'volume']:
+                np.testing.assert_allclose(self.stats.mean(feature, steps, 2, window=14), rebuilt.mean(feature, steps, 2, window=14), rtol=1e-9)
+                # The rounding of a zero variance is amplified by the square root, skip the first step
+                np.testing.assert_allclose(self.stats.std(feature, steps[1:], 2), rebuilt.std(feature, steps[1:], 2), rtol=1e-6)
+
+    def test_append_cost_does_not_depend_on_window(self):
+        # Per candle time of the live path for a short and a long window
+        rng = np.random.default_rng(1)
+        durations = []
+        for length in [100, 10000]:
+            data_matrix = rng.lognormal(size=(length, 20, len(self.mapping)))
+            window = FeatureWindow(data_matrix, pd.date_range('2024-01-01', periods=length, freq='1min'))
+            stats, fractals = RollingStats(self.mapping), FractalIndex(self.mapping)
+            stats.update(window.data_matrix)
+            fractals.update(window.data_matrix)
+            stats.mean('close', length - 1, 0)
+            fractals.lookup(length - 1, 0)
+            started = time.perf_counter()
+            for minute in range(50):
+                replaced = window.append(data_matrix[minute], pd.Timestamp('2025-01-01') + pd.Timedelta(minutes=minute))
+                stats.append(window.data_matrix, replaced)
+                fractals.append(window.data_matrix, replaced)
+                stats.std('close', length - 1, 0, window=20)
+                fractals.lookup(length - 1, 0)
+            durations.append(time.perf_counter() - started)
+        self.assertLess(durations[1], durations[0] * 5)
+
+    def test_leverage_ignores_future_candles(self):
+        params = dict(selected_params)
+        params.update({'symbols': [f'SYM{i}' for i in range(self.data_matrix.shape[1])], 'basic_risk_mgmt': True})
+        env = TradingEnvironment(self.data_matrix, self.timestamps, self.mapping, params=params)
+        env.current_step = 60
+        leverage = env.calculate_leverage(0, 100)
+
+        future = self.data_matrix.copy()
+        future[61:] *= 3
+        env.update_data(future, self.timestamps)
+        self.assertEqual(env.calculate_leverage(0, 100), leverage)
+
+class TestIntrabarIndex(unittest.TestCase):
+    def test_windows_match_time_masks(self):
+        rng = np.random.default_rng(0)
+        timestamps = pd.date_range('2024-01-01', periods=6, freq='1min').asi8
+        seconds = pd.date_range('2023-12-31 23:59:30', '2024-01-01 00:06:30', freq='1s')
+        df = pd.DataFrame({'low': rng.normal(size=len(seconds)), 'high': rng.normal(size=len(seconds))}, index=seconds)
+        # Shuffled 1s rows are sorted once by the index
+        index = IntrabarIndex([df.sample(frac=1, random_state=0), None])
+        index.update(timestamps)
+        times = seconds.asi8
+        for step in range(len(timestamps)):
+            start_time = timestamps[max(step - 1, 0)]
+            mask = (times > start_time) & (times < timestamps[step])
+            low_prices, high_prices, window_times = index.window(step, 0)
+            np.testing.assert_array_equal(window_times, times[mask])
+            np.testing.assert_array_equal(low_prices, df['low'].values[mask])
+            np.testing.assert_array_equal(high_prices, df['high'].values[mask])
+            min_low, max_high = index.extremes(step, 0)
+            self.assertEqual(min_low, df['low'].values[mask].min(initial=np.inf))
+            self.assertEqual(max_high, df['high'].values[mask].max(initial=-np.inf))
+        self.assertEqual(len(index.window(0, 0)[2]), 0)
+        self.assertEqual(len(index.window(1, 0)[2]), 59)
+        # No 1s data never reaches a level
+        self.assertEqual(index.extremes(3, 1), (np.inf, -np.inf))
+
+    def test_sharded_extremes_are_looked_up(self):
+        # 5 hour candles over 3 days of 1s data, candles ending a day start in the previous one
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        rng = np.random.default_rng(1)
+        seconds = pd.date_range('2024-01-01', '2024-01-03 23:59:59', freq='1s')
+        df = pd.DataFrame({'open': 1.0, 'high': rng.normal(size=len(seconds)), 'low': rng.normal(size=len(seconds)), 'close': 1.0, 'volume': 1.0}, index=seconds)
+        store = MarketStore(directory)
+        for day in pd.date_range('2024-01-01', periods=3, freq='D'):
+            store.write_day('AAA', day, df.loc[day:day + pd.Timedelta('86399s')])
+        timestamps = pd.date_range('2024-01-01 02:00', '2024-01-03 23:00', freq='5h').asi8
+
+        loaded = IntrabarIndex([df, None])
+        loaded.update(timestamps)
+        provider = MarketDataProvider(store)
+        sharded = ShardedIntrabarIndex(provider, ['AAA', 'BBB'])
+        sharded.update(timestamps)
+        for step in range(len(timestamps)):
+            np.testing.assert_array_equal(sharded.extremes(step, np.array([0, 1])), loaded.extremes(step, np.array([0, 1])))
+            self.assertEqual(sharded.extremes(step, 0), loaded.extremes(step, 0))
+            np.testing.assert_array_equal(sharded.window(step, 0)[0], loaded.window(step, 0)[0])
+
+        # Each day of seconds was reduced once, the extremes are now lookups
+        reads = provider.hits + provider.misses
+        for step in range(len(timestamps)):
+            sharded.extremes(step, 0)
+        self.assertEqual(provider.hits + provider.misses, reads)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,260 @@
+import argparse
+import glob
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# One record per 1s candle, times in epoch nanoseconds. Prices keep the float64 of the CSV
+# market data, float32 would move the SL, TP and liquidation first hits of high priced symbols
+CANDLE_DTYPE = np.dtype([
+    ('timestamp', np.int64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.float32),
+])
+
+DAY_FORMAT = '%Y%m%d'
+DAY_NS = 24 * 60 * 60 * 10**9
+
+class MarketStore:
+    """
+    Binary store of 1s candles, one .npy shard of CANDLE_DTYPE records per symbol and day.
+
+    Shards live in <root>/<SYMBOL>/<YYYYMMDD>.npy and are memory-mapped when read, so loading
+    a date range only touches the days in the range, instead of parsing every daily CSV of
+    the symbol. Use convert_csv_tree, or this module as a script, to build the store from the
+    MARKET_DATA_PATH tree written by mkt_download_mkt_data.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def shard_path(self, symbol, day):
+        return os.path.join(self.root, symbol, f"{pd.Timestamp(day).strftime(DAY_FORMAT)}.npy")
+
+    def days(self, symbol):
+        """Sorted days for which a symbol has a shard."""
+        paths = glob.glob(os.path.join(self.root, symbol, '*.npy'))
+        return sorted(pd.to_datetime(os.path.basename(path)[:-4], format=DAY_FORMAT) for path in paths)
+
+    def load_day(self, symbol, day):
+        """Memory-map the shard of one day, None when the store has no data for it."""
+        path = self.shard_path(symbol, day)
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode='r')
+
+    def write_day(self, symbol, day, candles):
+        """
+        Write the shard of one day, replacing any previous one.
+
+        :param symbol: The symbol of the candles.
+        :param day: The day of the candles.
+        :param candles: DataFrame with a DatetimeIndex or a 'timestamp' column and OHLCV columns,
+            or an array of CANDLE_DTYPE records sorted by time, written as is.
+        """
+        if isinstance(candles, np.ndarray):
+            records = candles.astype(CANDLE_DTYPE, copy=False)
+        else:
+            if 'timestamp' in candles.columns:
+                candles = candles.set_index('timestamp')
+            candles = candles.sort_index()
+            records = np.empty(len(candles), dtype=CANDLE_DTYPE)
+            records['timestamp'] = pd.DatetimeIndex(pd.to_datetime(candles.index)).asi8
+            for field in CANDLE_DTYPE.names[1:]:
+                records[field] = candles[field].to_numpy(dtype=CANDLE_DTYPE[field])
+
+        path = self.shard_path(symbol, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write next to the shard and rename, readers never see a partial file
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'wb') as file:
+            np.save(file, records)
+        os.replace(temporary_path, path)
+
+    def read(self, symbol, start_time, end_time):
+        """
+        Load the 1s candles of the days between two times.
+
+        :param symbol: The symbol to load.
+        :param start_time: Time in the first day to load.
+        :param end_time: Time in the last day to load.
+        :return: Array of CANDLE_DTYPE records sorted by time, empty when no day is stored.
+        """
+        days = pd.date_range(pd.Timestamp(start_time).normalize(), pd.Timestamp(end_time).normalize(), freq='D')
+        shards = [shard for shard in (self.load_day(symbol, day) for day in days) if shard is not None]
+        if not shards:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        # Shards written with float32 prices by former versions are promoted
+        return np.concatenate([shard.astype(CANDLE_DTYPE, copy=False) for shard in shards])
+
+    def read_frame(self, symbol, start_time, end_time):
+        """Same as read, as a DataFrame indexed by timestamp like the CSV market data."""
+        return candles_frame(self.read(symbol, start_time, end_time))
+
+class MarketDataProvider:
+    """
+    Day shards of a MarketStore loaded on first access and kept in a least recently used cache.
+
+    The cache holds at most memory_budget bytes of candles, so the memory follows the days the
+    environments are stepping through rather than the whole backtest range. One provider per
+    store is shared by every environment of the process, see shared_market_data_provider.
+    """
+    def __init__(self, store, memory_budget=2**30):
+        self.store = store
+        self.memory_budget = memory_budget
+        self.shards = OrderedDict()  # (symbol, day number) -> records, None for missing days
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def has_symbol(self, symbol):
+        return os.path.isdir(os.path.join(self.store.root, symbol))
+
+    def day(self, symbol, day_number):
+        """
+        Get the candles of a day, loading the shard on a miss.
+
+        :param symbol: The symbol of the candles.
+        :param day_number: The day as a number of days since the epoch.
+        :return: Array of CANDLE_DTYPE records, None when the store has no data for the day.
+        """
+        key = (symbol, day_number)
+        with self.lock:
+            if key in self.shards:
+                self.hits += 1
+                self.shards.move_to_end(key)
+                return self.shards[key]
+            self.misses += 1
+
+        shard = self.store.load_day(symbol, pd.Timestamp(day_number * DAY_NS))
+        if shard is not None:
+            shard = np.array(shard, dtype=CANDLE_DTYPE)  # Read the memory map once, the cache accounts for the copy
+
+        with self.lock:
+            if key not in self.shards:
+                self.shards[key] = shard
+                self.size += 0 if shard is None else shard.nbytes
+            self.evict()
+        return shard
+
+    def evict(self):
+        # Drop the least recently used days until the cache fits the budget, keeping the newest
+        while self.size > self.memory_budget and len(self.shards) > 1:
+            _, shard = self.shards.popitem(last=False)
+            self.size -= 0 if shard is None else shard.nbytes
+
+    def window(self, symbol, start_time, end_time):
+        """
+        Get the candles strictly between two times.
+
+        :param symbol: The symbol of the candles.
+        :param start_time: Start time in epoch nanoseconds, excluded.
+        :param end_time: End time in epoch nanoseconds, excluded.
+        :return: Array of CANDLE_DTYPE records, a view of the cached shard when the window fits in one day.
+        """
+        shards = [self.day(symbol, day_number) for day_number in range(start_time // DAY_NS, end_time // DAY_NS + 1)]
+        shards = [shard for shard in shards if shard is not None]
+        if not shards:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        records = shards[0] if len(shards) == 1 else np.concatenate(shards)
+        times = records['timestamp']
+        start = np.searchsorted(times, start_time, side='right')
+        end = max(start, np.searchsorted(times, end_time, side='left'))
+        return records[start:end]
+
+# Providers are dropped with the last environment using them, with the days they cache
+_providers = weakref.WeakValueDictionary()
+_providers_lock = threading.Lock()
+
+def shared_market_data_provider(root, memory_budget=2**30):
+    """
+    Get the provider of a store shared by the environments of the process.
+
+    :param root: Root directory of the store.
+    :param memory_budget: Bytes of day shards kept in memory, the latest budget asked for applies.
+    :return: The MarketDataProvider of the store.
+    """
+    with _providers_lock:
+        key = os.path.abspath(root)
+        provider = _providers.get(key)
+        if provider is None:
+            provider = _providers[key] = MarketDataProvider(MarketStore(root), memory_budget)
+        provider.memory_budget = memory_budget
+    return provider
+
+def temporary_market_data_provider(memory_budget=2**30):
+    """
+    Get the shared provider of a new store in a temporary directory, removed with the provider.
+
+    Generated candles are written to a store of their own, so they never mix with the days of
+    MARKET_STORE_PATH nor hit the days cached from the store of a former run.
+
+    :param memory_budget: Bytes of day shards kept in memory.
+    :return: The MarketDataProvider of the store, its root is store.root.
+    """
+    root = tempfile.mkdtemp(prefix='market_store_')
+    provider = shared_market_data_provider(root, memory_budget)
+    weakref.finalize(provider, shutil.rmtree, root, ignore_errors=True)
+    return provider
+
+def candles_frame(records):
+    """DataFrame of an array of CANDLE_DTYPE records, indexed by timestamp."""
+    index = pd.DatetimeIndex(records['timestamp'].view('datetime64[ns]'), name='timestamp')
+    return pd.DataFrame({field: records[field] for field in CANDLE_DTYPE.names[1:]}, index=index)
+
+def convert_csv_tree(source, destination, symbols=None, overwrite=False):
+    """
+    Convert the daily CSV files of MARKET_DATA_PATH to a MarketStore.
+
+    :param source: Directory holding one directory of <YYYYMMDD>.csv files per symbol.
+    :param destination: Root directory of the store.
+    :param symbols: Symbols to convert, None for every directory of the source.
+    :param overwrite: Whether to convert days that already have a shard.
+    :return: The number of shards written.
+    """
+    store = MarketStore(destination)
+    if symbols is None:
+        symbols = sorted(name for name in os.listdir(source) if os.path.isdir(os.path.join(source, name)))
+
+    written = 0
+    for symbol in symbols:
+        for file in sorted(glob.glob(os.path.join(source, symbol, '*.csv'))):
+            day = pd.to_datetime(os.path.basename(file).replace('.csv', ''), format=DAY_FORMAT)
+            if not overwrite and os.path.exists(store.shard_path(symbol, day)):
+                continue
+            try:
+                df = pd.read_csv(file, usecols=['timestamp', 'open', 'high', 'low', 'close', 'volume'], parse_dates=['timestamp'])
+            except (pd.errors.EmptyDataError, ValueError) as e:
+                logging.warning(f"Skipping {file}: {e}")
+                continue
+            if df.empty:
+                logging.warning(f"File {file} is empty. Skipping.")
+                continue
+            store.write_day(symbol, day, df)
+            written += 1
+        logging.info(f"Converted market data for symbol: {symbol}")
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert the daily 1s CSV files to a binary market store.')
+    parser.add_argument('-s', '--source', default=os.getenv('MARKET_DATA_PATH'), type=str, help='Directory of the CSV market data (default: MARKET_DATA_PATH)')
+    parser.add_argument('-d', '--destination', default=os.getenv('MARKET_STORE_PATH'), type=str, help='Directory of the store (default: MARKET_STORE_PATH)')
+    parser.add_argument('--symbols', nargs='*', default=None, help='Symbols to convert, all by default')
+    parser.add_argument('--overwrite', action='store_true', help='Convert days that already have a shard')
+
+    args = parser.parse_args()
+    if not args.source or not args.destination:
+        parser.error("Both a source and a destination are required")
+
+    logging.basicConfig(level=logging.INFO)
+    count = convert_csv_tree(args.source, args.destination, args.symbols, args.overwrite)
+    logging.info(f"Wrote {count} day shards to {args.destination}")
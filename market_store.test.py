@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from utilities import add_technical_indicators
+from parameters import selected_params
+from environment import TradingEnvironment
+from market_store import CANDLE_DTYPE, MarketDataProvider, MarketStore, convert_csv_tree, shared_market_data_provider
+
+def write_csv_tree(directory, symbols, days, seed=0):
+    # Daily 1 minute CSV files laid out like MARKET_DATA_PATH
+    rng = np.random.default_rng(seed)
+    frames = {}
+    for symbol in symbols:
+        os.makedirs(os.path.join(directory, symbol))
+        for day in pd.date_range('2024-01-01', periods=days, freq='D'):
+            index = pd.date_range(day, periods=24 * 60, freq='1min', name='timestamp')
+            price = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, len(index))))
+            df = pd.DataFrame({'open': price, 'high': price * 1.001, 'low': price * 0.999, 'close': price, 'volume': rng.lognormal(5, 1, len(index)), 'rsi': 50.0}, index=index)
+            df.to_csv(os.path.join(directory, symbol, f"{day.strftime('%Y%m%d')}.csv"))
+            frames[symbol, day] = df
+    return frames
+
+class TestMarketStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.directory, 'csv')
+        self.store_path = os.path.join(self.directory, 'store')
+        self.frames = write_csv_tree(self.csv_path, ['BTC', 'ETH'], days=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_convert_and_read_range(self):
+        self.assertEqual(convert_csv_tree(self.csv_path, self.store_path), 6)
+        # Converting again skips the days already in the store
+        self.assertEqual(convert_csv_tree(self.csv_path, self.store_path), 0)
+
+        store = MarketStore(self.store_path)
+        self.assertEqual(store.days('ETH'), list(pd.date_range('2024-01-01', periods=3, freq='D')))
+        records = store.read('ETH', '2024-01-02 12:00', '2024-01-03 06:00')
+        self.assertEqual(records.dtype, CANDLE_DTYPE)
+
+        expected = pd.concat([self.frames['ETH', day] for day in pd.date_range('2024-01-02', periods=2, freq='D')])
+        df = store.read_frame('ETH', '2024-01-02 12:00', '2024-01-03 06:00')
+        pd.testing.assert_index_equal(df.index, expected.index)
+        self.assertEqual(list(df.columns), ['open', 'high', 'low', 'close', 'volume'])
+        np.testing.assert_allclose(df['low'], expected['low'], rtol=1e-12)
+
+    def test_prices_are_stored_exactly(self):
+        # A high priced symbol with a level a few ticks away, float32 would round it across the low
+        seconds = pd.date_range('2024-01-01', periods=60, freq='1s')
+        price = 67123.45 + np.arange(60) * 0.01
+        candles = pd.DataFrame({'open': price, 'high': price + 0.01, 'low': price - 0.01, 'close': price, 'volume': 1.0}, index=seconds)
+        store = MarketStore(self.store_path)
+        store.write_day('BTC', '2024-01-01', candles)
+        df = store.read_frame('BTC', '2024-01-01', '2024-01-01')
+        for field in ['open', 'high', 'low', 'close']:
+            np.testing.assert_array_equal(df[field], candles[field])
+        self.assertNotEqual(np.float32(67123.45 - 0.01), 67123.45 - 0.01)
+
+    def test_days_are_memory_mapped(self):
+        convert_csv_tree(self.csv_path, self.store_path, symbols=['BTC'])
+        store = MarketStore(self.store_path)
+        self.assertIsInstance(store.load_day('BTC', '2024-01-01'), np.memmap)
+        self.assertIsNone(store.load_day('ETH', '2024-01-01'))
+        self.assertEqual(len(store.read('BTC', '2025-01-01', '2025-01-02')), 0)
+
+    def test_provider_keeps_days_within_budget(self):
+        convert_csv_tree(self.csv_path, self.store_path)
+        store = MarketStore(self.store_path)
+        day_size = store.load_day('BTC', '2024-01-01').nbytes
+        provider = MarketDataProvider(store, memory_budget=2 * day_size)
+
+        start_time, end_time = pd.Timestamp('2024-01-01 23:00').value, pd.Timestamp('2024-01-02 01:00').value
+        records = provider.window('BTC', start_time, end_time)
+        self.assertEqual(len(records), 119)
+        self.assertTrue(np.all((records['timestamp'] > start_time) & (records['timestamp'] < end_time)))
+        self.assertEqual(provider.misses, 2)
+
+        # A third day evicts the least recently used one
+        provider.window('BTC', pd.Timestamp('2024-01-03 01:00').value, pd.Timestamp('2024-01-03 02:00').value)
+        self.assertLessEqual(provider.size, 2 * day_size)
+        self.assertEqual(list(provider.shards), [('BTC', 19724), ('BTC', 19725)])
+        provider.window('BTC', pd.Timestamp('2024-01-02 01:00').value, pd.Timestamp('2024-01-02 02:00').value)
+        self.assertEqual(provider.hits, 1)
+
+        self.assertIs(shared_market_data_provider(self.store_path), shared_market_data_provider(self.store_path + '/'))
+
+    def test_lazy_environment_matches_loaded_market_data(self):
+        # 1 minute candles over 1s data of a single day, as in environment.test.vectorized
+        rng = np.random.default_rng(0)
+        limit, symbols = 150, ['AAA', 'BBB', 'CCC']
+        timestamps = pd.date_range('2024-01-01', periods=limit, freq='1min')
+        seconds = pd.date_range('2024-01-01', periods=limit * 60, freq='1s')
+        store = MarketStore(self.store_path)
+        frames, market_data = [], []
+        for symbol in symbols:
+            # Not rounded, the store keeps the float64 prices of the loaded data
+            price = rng.uniform(0.2, 3) * np.exp(np.cumsum(rng.normal(0, 0.002, limit * 60)))
+            second_data = pd.DataFrame({'open': price, 'high': price * 1.0005, 'low': price * 0.9995, 'close': price, 'volume': 1.0}, index=seconds)
+            store.write_day(symbol, '2024-01-01', second_data)
+            market_data.append(second_data)
+            df = pd.DataFrame({'timestamp': timestamps, 'open': price[::60], 'high': second_data['high'].values.reshape(limit, 60).max(axis=1),
+                               'low': second_data['low'].values.reshape(limit, 60).min(axis=1), 'close': price[59::60], 'volume': rng.lognormal(7, 0.5, limit)})
+            frames.append(add_technical_indicators(df).set_index('timestamp'))
+        data_matrix = np.stack([df.values for df in frames], axis=1)
+        mapping = {name: i for i, name in enumerate(frames[0].columns)}
+
+        params = dict(selected_params)
+        params.update({'symbols': symbols, 'basic_risk_mgmt': False, 'risk_mgmt': 'percentage', 'sl_mult_perc': 0.2, 'tp_mult_perc': 0.3, 'boost_factor': 1})
+        histories = []
+        for loaded, step_mode in [(market_data, 'scalar'), (None, 'scalar'), (None, 'vectorized')]:
+            params['step_mode'] = step_mode
+            os.environ['MARKET_STORE_PATH'] = self.store_path
+            try:
+                env = TradingEnvironment(data_matrix, list(timestamps), mapping, params=params, market_data=loaded)
+            finally:
+                del os.environ['MARKET_STORE_PATH']
+            env.reset()
+            actions = np.random.default_rng(1)
+            done = False
+            while not done:
+                _, _, done, _, _ = env.step(actions.integers(0, len(env.actions_available), len(symbols)))
+            histories.append(env.history.to_dataframe())
+        self.assertGreater((histories[0]['exit_reason'] != 'std').sum(), 0)
+        pd.testing.assert_frame_equal(histories[0], histories[1])
+        pd.testing.assert_frame_equal(histories[0], histories[2])
+
+if __name__ == '__main__':
+    unittest.main()
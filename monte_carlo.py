@@ -0,0 +1,259 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from utilities import initialize_environments  # Imported before environment, which imports it back
+from stable_baselines3 import PPO
+from environment import TradingEnvironment
+from indicators import OHLCV_COLUMNS, compute_indicators, fill_gaps
+from rewards import calculate_reward
+from synthetic import convert_interval_to_seconds, generate_market_conditions, generate_regime_switching_market
+from vec_env import SharedDataMatrix
+
+def make_scenarios(num_runs, seed=None, synthetic_share=0.5, block_size=24):
+    """
+    Draw the specs of the runs of a Monte Carlo study.
+
+    A spec is a small dictionary with the seed of the run, so workers receive a few bytes and
+    rebuild the market themselves instead of receiving a pickled environment. Synthetic runs
+    switch between one to three regimes of the 'training' market conditions, with a random
+    regime duration and correlation; bootstrap runs resample the blocks of the reference data.
+
+    :param num_runs: Number of runs.
+    :param seed: Seed of the study, the same seed gives the same specs.
+    :param synthetic_share: Share of synthetic runs, the others being bootstrap resamples.
+    :param block_size: Number of candles of the blocks of the bootstrap runs.
+    :return: List of scenario dictionaries.
+    """
+    rng = np.random.default_rng(seed)
+    regime_names = list(generate_market_conditions('training', rng))
+    scenarios = []
+    for run in range(num_runs):
+        if rng.random() < synthetic_share:
+            regimes = rng.choice(regime_names, size=rng.integers(1, 4), replace=False)
+            scenario = {'kind': 'synthetic', 'regimes': sorted(regimes.tolist()), 'mean_regime_duration': float(rng.uniform(1, 10)), 'correlation': float(rng.uniform(0.2, 0.8))}
+        else:
+            scenario = {'kind': 'bootstrap', 'block_size': block_size}
+        scenario.update(run=run, seed=int(rng.integers(2**32)))
+        scenarios.append(scenario)
+    return scenarios
+
+def synthetic_candles(scenario, reference, mapping, interval):
+    """
+    Generate candles of the regime mix of a scenario, one step per candle of the interval.
+
+    :param scenario: Synthetic scenario of make_scenarios.
+    :param reference: The (candles, symbols, features) data matrix giving the shape, the first
+        prices and the volume scale of the symbols.
+    :param mapping: Feature mapping of the reference.
+    :param interval: Interval of the candles.
+    :return: Array of shape (candles, symbols, 5) of OHLCV candles.
+    """
+    rng = np.random.default_rng(scenario['seed'])
+    market_conditions = generate_market_conditions('training', rng)
+    regimes = {name: market_conditions[name] for name in scenario['regimes']}
+    num_candles, num_symbols = reference.shape[:2]
+    dt = convert_interval_to_seconds(interval) / (24 * 60 * 60)
+    candles, _ = generate_regime_switching_market(num_symbols, num_candles, dt, rng, regimes, mean_regime_duration=scenario['mean_regime_duration'], correlation=scenario['correlation'], S0=reference[0, :, mapping['close']])
+    # Volumes on the scale of the reference symbols
+    candles[..., 4] *= np.median(reference[..., mapping['volume']], axis=0) / np.median(candles[..., 4], axis=0)
+    return candles
+
+def bootstrap_candles(scenario, reference, mapping):
+    """
+    Resample the candles of the reference with a moving block bootstrap.
+
+    Blocks of consecutive candles are drawn for all symbols together, keeping their
+    correlation, and chained relative to the previous close so the prices stay continuous.
+
+    :param scenario: Bootstrap scenario of make_scenarios.
+    :param reference: The (candles, symbols, features) data matrix to resample.
+    :param mapping: Feature mapping of the reference.
+    :return: Array of shape (candles, symbols, 5) of OHLCV candles.
+    """
+    rng = np.random.default_rng(scenario['seed'])
+    ohlcv = np.stack([reference[..., mapping[column]] for column in OHLCV_COLUMNS], axis=-1).astype(np.float64)
+    num_candles = len(ohlcv)
+    block_size = min(scenario['block_size'], num_candles - 1)
+
+    # Open, high, low and close of every candle relative to the previous close
+    relative = ohlcv[1:, :, :4] / ohlcv[:-1, :, 3:4]
+    starts = rng.integers(0, num_candles - block_size, size=-(-(num_candles - 1) // block_size))
+    rows = (starts[:, np.newaxis] + np.arange(block_size)).ravel()[:num_candles - 1]
+
+    closes = ohlcv[0, :, 3] * np.cumprod(relative[rows, :, 3], axis=0)
+    previous_closes = np.concatenate((ohlcv[:1, :, 3], closes[:-1]))
+    candles = np.empty_like(ohlcv)
+    candles[0] = ohlcv[0]
+    candles[1:, :, :4] = previous_closes[..., np.newaxis] * relative[rows]
+    candles[1:, :, 4] = ohlcv[1:, :, 4][rows]
+    return candles
+
+def candles_to_features(candles, mapping):
+    """
+    Build the data matrix of OHLCV candles, with the features of a mapping.
+
+    :param candles: Array of shape (candles, symbols, 5) of OHLCV candles.
+    :param mapping: Feature mapping of the OHLCV and technical indicator columns.
+    :return: Array of shape (candles, symbols, features).
+    """
+    indicators = compute_indicators(*(candles[..., OHLCV_COLUMNS.index(column)] for column in ['high', 'low', 'close', 'volume']))
+    data_matrix = np.empty(candles.shape[:2] + (len(mapping),))
+    for name, column in mapping.items():
+        data_matrix[..., column] = candles[..., OHLCV_COLUMNS.index(name)] if name in OHLCV_COLUMNS else indicators[name]
+    return fill_gaps(data_matrix)
+
+def run_scenario(scenario, policy, reference, timestamps, mapping, params):
+    """
+    Play one episode of the policy over the market of a scenario.
+
+    :param scenario: Scenario of make_scenarios.
+    :param policy: The PPO model choosing the actions.
+    :param reference: The (candles, symbols, features) data matrix the scenarios are built from.
+    :param timestamps: Open times of the candles.
+    :param mapping: Feature mapping of the reference.
+    :param params: Parameters of the environment.
+    :return: Summary dictionary of the run: net profit, maximum drawdown of the net worth,
+        reliability as the share of winning trades, number of trades and liquidations, and
+        the error message of a failed run.
+    """
+    started = time.perf_counter()
+    summary = {'run': scenario['run'], 'kind': scenario['kind'], 'seed': scenario['seed']}
+    try:
+        if scenario['kind'] == 'synthetic':
+            candles = synthetic_candles(scenario, reference, mapping, params['interval'])
+        elif scenario['kind'] == 'bootstrap':
+            candles = bootstrap_candles(scenario, reference, mapping)
+        else:
+            raise ValueError(f"Unknown scenario kind: {scenario['kind']}")
+
+        env = TradingEnvironment(candles_to_features(candles, mapping), timestamps, mapping, render_mode=None, params=params, reward_function=calculate_reward)
+        observation, _ = env.reset(seed=scenario['seed'])
+        net_worths = [env.net_worth]
+        done = False
+        while not done:
+            action, _ = policy.predict(observation, deterministic=True)
+            observation, _, terminated, truncated, _ = env.step(action)
+            net_worths.append(env.net_worth)
+            done = terminated or truncated
+
+        net_worths = np.asarray(net_worths, dtype=np.float64)
+        peaks = np.maximum.accumulate(net_worths)
+        history = env.history.to_dataframe()
+        pnls = history['pnl'].to_numpy() if len(history) else np.empty(0)
+        summary.update(
+            net_profit=float(net_worths[-1] - params['initial_balance']),
+            max_drawdown=float(np.max(np.where(peaks > 0, (peaks - net_worths) / peaks, 0))),
+            reliability=float(np.mean(pnls > 0)) if len(pnls) else 0.0,
+            num_trades=len(pnls),
+            liquidations=int(np.sum(history['exit_reason'] == 'liq')) if len(history) else 0,
+            error=None,
+        )
+    except Exception as e:
+        logging.error(f"Monte Carlo run {scenario['run']} failed with exception: {e}")
+        summary.update(net_profit=np.nan, max_drawdown=np.nan, reliability=np.nan, num_trades=0, liquidations=0, error=str(e))
+    summary['duration'] = time.perf_counter() - started
+    return summary
+
+# Policy and reference data of a pool worker, loaded once by init_worker
+worker_state = {}
+
+def init_worker(model_path, shared_data, timestamps, mapping, params):
+    import torch
+    torch.set_num_threads(1)  # One core per worker, the pool provides the parallelism
+    worker_state.update(
+        policy=PPO.load(model_path, device='cpu'),
+        reference=shared_data.load(),
+        timestamps=timestamps,
+        mapping=mapping,
+        params=params,
+    )
+
+def run_in_worker(scenario):
+    return run_scenario(scenario, **worker_state)
+
+def run_monte_carlo(model_path, data_matrix, timestamps, mapping, params, scenarios, num_workers=None, start_method=None):
+    """
+    Run the scenarios of a Monte Carlo study in a pool of processes.
+
+    Every worker loads the policy once and maps the reference data matrix from a shared .npy
+    file, then receives scenario specs and sends back the summaries of run_scenario. The 1s
+    market data is not resampled, so the runs use the basic risk management.
+
+    :param model_path: Path of the saved PPO model.
+    :param data_matrix: The (candles, symbols, features) reference data matrix.
+    :param timestamps: Open times of the candles.
+    :param mapping: Feature mapping of the data matrix, with the OHLCV columns.
+    :param params: Parameters of the environment.
+    :param scenarios: Scenarios of make_scenarios.
+    :param num_workers: Number of processes, the number of CPUs when None.
+    :param start_method: Multiprocessing start method, the platform default if None.
+    :return: Generator of the summaries, in the order the runs complete.
+    """
+    params = dict(params, basic_risk_mgmt=True)
+    shared_data = SharedDataMatrix(np.asarray(data_matrix, dtype=np.float64))
+    context = multiprocessing.get_context(start_method)
+    executor = ProcessPoolExecutor(num_workers or os.cpu_count(), mp_context=context, initializer=init_worker, initargs=(model_path, shared_data, timestamps, mapping, params))
+    try:
+        futures = [executor.submit(run_in_worker, scenario) for scenario in scenarios]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Runs still queued when the caller stops early are dropped
+        executor.shutdown(cancel_futures=True)
+        shared_data.close()
+
+def summarize(summaries):
+    """
+    Aggregate the run summaries of a study.
+
+    :param summaries: Summaries of run_scenario.
+    :return: Dictionary of the number of runs and failures, the mean, median and 5th percentile
+        of the net profit, the probability of profit, the mean and worst drawdowns and the
+        mean reliability of the completed runs.
+    """
+    completed = [summary for summary in summaries if summary['error'] is None]
+    net_profits = np.array([summary['net_profit'] for summary in completed])
+    drawdowns = np.array([summary['max_drawdown'] for summary in completed])
+    reliabilities = np.array([summary['reliability'] for summary in completed])
+    if not completed:
+        net_profits = drawdowns = reliabilities = np.full(1, np.nan)
+    return {
+        'runs': len(summaries),
+        'failed': len(summaries) - len(completed),
+        'mean_net_profit': float(np.mean(net_profits)),
+        'median_net_profit': float(np.median(net_profits)),
+        'p5_net_profit': float(np.percentile(net_profits, 5)),
+        'probability_of_profit': float(np.mean(net_profits > 0)),
+        'mean_max_drawdown': float(np.mean(drawdowns)),
+        'worst_max_drawdown': float(np.max(drawdowns)),
+        'mean_reliability': float(np.mean(reliabilities)),
+    }
+
+if __name__ == '__main__':
+    from parameters import selected_params, training_params
+
+    parser = argparse.ArgumentParser(description='Monte Carlo evaluation of the PPO policy over synthetic and bootstrapped markets.')
+    parser.add_argument('-r', '--runs', default=1000, type=int, help='Number of runs')
+    parser.add_argument('-w', '--workers', default=os.cpu_count(), type=int, help='Number of worker processes')
+    parser.add_argument('-s', '--seed', default=None, type=int, help='Seed of the study')
+    parser.add_argument('--synthetic-share', default=0.5, type=float, help='Share of synthetic runs, the others resample the test data')
+    parser.add_argument('--block-size', default=24, type=int, help='Number of candles of the bootstrap blocks')
+    parser.add_argument('-m', '--model', default=selected_params['model_name'], type=str, help='Path of the saved PPO model')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    _, _, test_env, _, _ = initialize_environments(selected_params, training_params)
+    scenarios = make_scenarios(args.runs, args.seed, args.synthetic_share, args.block_size)
+    started = time.perf_counter()
+    summaries = []
+    for summary in run_monte_carlo(args.model, test_env.data_matrix, test_env.timestamps, test_env.mapping, test_env.params, scenarios, args.workers):
+        summaries.append(summary)
+        if len(summaries) % max(1, args.runs // 10) == 0:
+            logging.info(f"{len(summaries)}/{args.runs} runs in {time.perf_counter() - started:.1f}s")
+
+    for name, value in summarize(summaries).items():
+        print(f"{name}: {value}")
@@ -0,0 +1,75 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from monte_carlo import bootstrap_candles, candles_to_features, make_scenarios, run_monte_carlo, run_scenario, summarize
+from stable_baselines3 import PPO
+from parameters import selected_params
+from environment import TradingEnvironment
+from indicators import INDICATOR_COLUMNS, OHLCV_COLUMNS
+from rewards import calculate_reward
+from synthetic import generate_market_conditions, generate_regime_switching_market
+
+class TestMonteCarlo(unittest.TestCase):
+    def setUp(self):
+        # 300 hourly candles of 3 symbols as the reference market
+        rng = np.random.default_rng(0)
+        candles, _ = generate_regime_switching_market(3, 300, 1 / 24, rng, generate_market_conditions('training', rng))
+        self.mapping = {name: index for index, name in enumerate(OHLCV_COLUMNS + list(INDICATOR_COLUMNS))}
+        self.data_matrix = candles_to_features(candles, self.mapping)
+        self.timestamps = pd.date_range('2024-01-01', periods=300, freq='1h')
+        self.params = dict(selected_params, symbols=['AAA', 'BBB', 'CCC'], interval='1h', basic_risk_mgmt=True)
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        env = TradingEnvironment(self.data_matrix, self.timestamps, self.mapping, params=self.params, reward_function=calculate_reward)
+        self.model_path = os.path.join(self.directory, 'model')
+        PPO('MlpPolicy', env, seed=0).save(self.model_path)
+
+    def test_bootstrap_keeps_the_candles_of_the_reference(self):
+        scenario = {'run': 0, 'kind': 'bootstrap', 'seed': 1, 'block_size': 24}
+        candles = bootstrap_candles(scenario, self.data_matrix, self.mapping)
+        np.testing.assert_array_equal(candles, bootstrap_candles(scenario, self.data_matrix, self.mapping))
+        self.assertEqual(candles.shape, (300, 3, 5))
+
+        # Every candle relative to the previous close is one of the reference, for all symbols together
+        reference = self.data_matrix[..., :5]
+        relative = reference[1:, :, :4] / reference[:-1, :, 3:4]
+        resampled = candles[1:, :, :4] / candles[:-1, :, 3:4]
+        matches = np.all(np.isclose(resampled[:, np.newaxis], relative[np.newaxis], rtol=1e-12), axis=(2, 3))
+        self.assertTrue(matches.any(axis=1).all())
+        self.assertFalse(np.array_equal(candles, reference))
+
+    def test_parallel_runs_match_serial_runs(self):
+        scenarios = make_scenarios(8, seed=3)
+        self.assertEqual(scenarios, make_scenarios(8, seed=3))
+        self.assertEqual({scenario['kind'] for scenario in scenarios}, {'synthetic', 'bootstrap'})
+
+        started = time.perf_counter()
+        summaries = sorted(run_monte_carlo(self.model_path, self.data_matrix, self.timestamps, self.mapping, self.params, scenarios, num_workers=2), key=lambda summary: summary['run'])
+        logging.info(f"{len(scenarios)} runs in {time.perf_counter() - started:.2f}s")
+
+        policy = PPO.load(self.model_path, device='cpu')
+        for scenario, summary in zip(scenarios, summaries):
+            self.assertIsNone(summary['error'])
+            expected = run_scenario(scenario, policy, self.data_matrix, self.timestamps, self.mapping, self.params)
+            for name in ['run', 'kind', 'seed', 'net_profit', 'max_drawdown', 'reliability', 'num_trades', 'liquidations']:
+                self.assertEqual(summary[name], expected[name], name)
+
+        study = summarize(summaries)
+        self.assertEqual(study['runs'], 8)
+        self.assertEqual(study['failed'], 0)
+        self.assertGreaterEqual(study['worst_max_drawdown'], study['mean_max_drawdown'])
+
+    def test_failed_runs_are_summarized(self):
+        scenario = {'run': 0, 'kind': 'unknown', 'seed': 1}
+        summary = run_scenario(scenario, None, self.data_matrix, self.timestamps, self.mapping, self.params)
+        self.assertIn('unknown', summary['error'])
+        self.assertEqual(summarize([summary])['failed'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
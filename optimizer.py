@@ -168,6 +168,7 @@ def objective(timesteps, num_episodes, n_steps_index, batch_size_index, n_epochs
 
     # Evaluate on the test set
     actions_history, rewards_history, episode_durations, balances, net_worths = agent.evaluate(episodes=training_params['num_episodes'])
+    agent.close()
 
     # Redirect print to both console and file
     with DualOutput(os.path.join(plot_dir, "output_recap.log")) as dual_output:
@@ -41,6 +41,14 @@ constant_params = {
     'slippage': 0.0005,    # 0.05% slippage 
     'bid_ask_spread': 0.0002,  # 0.02% bid-ask spread
     'borrowing_fee_per_hour': 0.0001,  # 0.01% per hour
+    'step_mode': 'scalar',  # 'scalar' or 'vectorized'
+    'leverage_window': None,  # Candles used for the leverage volatility and averages, None for all candles so far
+    'kelly_window': 100,  # Recent trades used to compute the Kelly fraction
+    'history_spill_threshold': None,  # Closed trades kept in memory before the history spills to disk, None to never spill
+    'random_start': 0,  # Fraction of the data in which episodes may start, 0 always starts at the first candle
+    'risk_kernel': 'auto',  # 1s risk check: 'cython', 'numpy', 'loop', or 'auto' for cython when built
+    'market_data_memory_mb': 1024,  # Memory of the 1s day shards cached from MARKET_STORE_PATH, shared by the environments
+    'synth_stream': False,  # Write the synthetic 1s data day by day to a temporary store instead of keeping it in memory
 }
 
 
@@ -102,7 +110,7 @@ field_is_train_model = False
 unittest_params = {
     'target_num_symbols': field_target,
     'market_data': 'random', # 'original' or 'random' or 'synthetic'
-    'synth_mode': 'testing', # 'training' or 'testing'
+    'synth_mode': 'testing', # 'training' or 'testing' or 'regimes'
     # 'symbols': sorted(['ADA', 'BNB', 'EOS', 'ETH', 'IOTA', 'LTC', 'NEO', 'QTUM', 'XLM', 'XRP']),
     # 'symbols': sorted(['BTC', 'ETC', 'ICX', 'LINK', 'NULS', 'ONT', 'TRX', 'LTC', 'NEO', 'VET']),
     # 'symbols': sorted(['LTC', 'DOGE', 'SHIB', 'PEOPLE', 'FLOKI', 'PEPE', 'MEME', 'BONK', 'WIF', 'BOME']),
@@ -145,7 +153,7 @@ optim_params = {
 
 synth_params = {
     'market_data': 'synthetic', # 'original' or 'random' or 'synthetic'
-    'synth_mode': 'training', # 'training' or 'testing'
+    'synth_mode': 'training', # 'training' or 'testing' or 'regimes'
     'end_time': '2024-10-30',
     'limit': 100, # 240,
     'interval': '1d',
@@ -168,7 +176,11 @@ live_params = {
 training_params = {
     'train_model': field_is_train_model,
     'timesteps': 1_000_000,
-    'num_episodes': 10
+    'num_episodes': 10,
+    'vec_env': 'dummy',  # 'dummy', 'batched' or 'subproc'
+    'num_envs': 1,  # Episodes simulated together by the batched environment
+    'num_workers': 4,  # Subprocesses of the subproc environment
+    'seed': None,  # Base seed of the subproc workers, worker k uses seed + k
 }
 
 specific_params = unittest_params
@@ -0,0 +1,243 @@
+import numpy as np
+import pandas as pd
+
+POSITION_SIDES = {
+    'long': 1,
+    'short': -1,
+}
+
+SIDE_NAMES = {side: name for name, side in POSITION_SIDES.items()}
+
+NO_TIME = np.iinfo(np.int64).min  # Integer value of NaT, the open time of a flat symbol
+
+def epoch_ns(times):
+    """
+    Convert timestamps to int64 epoch nanoseconds, integers are taken as epoch nanoseconds already.
+
+    :param times: A timestamp, or a sequence or index of timestamps.
+    :return: An int64 array with the shape of times.
+    """
+    values = np.asarray(times)
+    if values.dtype.kind in 'iu':
+        return values.astype(np.int64, copy=False)
+    return np.asarray(pd.DatetimeIndex(values.ravel()).asi8).reshape(values.shape)
+
+class PositionBook:
+    """
+    Struct-of-arrays store for the open position of every symbol.
+
+    Each field of a position lives in a preallocated NumPy array indexed by symbol, so the
+    environment and the reward functions can work on all symbols at once instead of walking
+    a list of dictionaries. A symbol is flat when its side is 0 (1 for long, -1 for short).
+
+    The book can also be created with a (num_envs, num_symbols) shape, in which case every
+    field is a 2D array and the batched environments index it with (env, symbol) pairs.
+    """
+    PRICE_FIELDS = ('entry_price', 'sl_price', 'tp_price', 'liq_price', 'max_price')
+    VALUE_FIELDS = ('position_size', 'leverage', 'collateral', 'borrowing_fee', 'balance', 'risk_per_trade')
+
+    def __init__(self, num_symbols):
+        self.side = np.zeros(num_symbols, dtype=np.int8)
+        self.shape = self.side.shape
+        self.num_symbols = self.shape[-1]
+        self.open_step = np.full(self.shape, -1, dtype=np.int64)
+        self.open_time = np.full(self.shape, NO_TIME, dtype=np.int64)  # Epoch nanoseconds
+        for field in self.PRICE_FIELDS:
+            setattr(self, field, np.full(self.shape, np.nan))
+        for field in self.VALUE_FIELDS:
+            setattr(self, field, np.zeros(self.shape))
+
+    @property
+    def is_open(self):
+        return self.side != 0
+
+    def reset(self):
+        self.clear(slice(None))
+
+    def open(self, symbol_index, type, open_step, open_time, **fields):
+        """
+        Record a new position for a symbol, or for several at once.
+
+        :param symbol_index: The index of the symbol, or any NumPy index selecting several positions.
+        :param type: 'long' or 'short', or an array of sides (1 or -1) aligned with the index.
+        :param open_step: The data matrix step at which the position was opened.
+        :param open_time: The time of the opening candle in epoch nanoseconds, or an array of them.
+        :param fields: Values for the price and value fields of the position.
+        """
+        self.side[symbol_index] = POSITION_SIDES[type] if isinstance(type, str) else type
+        self.open_step[symbol_index] = open_step
+        self.open_time[symbol_index] = epoch_ns(open_time)
+        for field in self.PRICE_FIELDS + self.VALUE_FIELDS:
+            value = fields.get(field)
+            getattr(self, field)[symbol_index] = np.nan if value is None else value
+
+    def clear(self, symbol_index):
+        """Flatten the position(s) selected by an index, a slice or a boolean mask."""
+        self.side[symbol_index] = 0
+        self.open_step[symbol_index] = -1
+        self.open_time[symbol_index] = NO_TIME
+        for field in self.PRICE_FIELDS:
+            getattr(self, field)[symbol_index] = np.nan
+        for field in self.VALUE_FIELDS:
+            getattr(self, field)[symbol_index] = 0
+
+    def unrealized_pnl(self, prices):
+        """
+        Compute the leveraged PnL of every open position at the given prices.
+
+        :param prices: Array of prices, one per symbol.
+        :return: Array of PnL values, 0 for flat symbols.
+        """
+        pnl = (prices - self.entry_price) * self.position_size * self.leverage * self.side
+        return np.where(self.is_open, pnl, 0.0)
+
+    def returns(self, pnl):
+        """Return on collateral for each symbol, 0 where there is no collateral."""
+        return np.divide(pnl, self.collateral, out=np.zeros(self.shape), where=self.collateral != 0)
+
+    def level_hits(self, symbol_indices, low_prices, high_prices):
+        """
+        Detect which positions touched their max, TP, liquidation or SL level within a candle.
+
+        Levels are checked with the same precedence as the scalar risk management: max, then
+        take-profit, then liquidation, then stop-loss; the first level touched wins.
+
+        :param symbol_indices: Array of symbol indices to check.
+        :param low_prices: Low price of the candle for each of those symbols.
+        :param high_prices: High price of the candle for each of those symbols.
+        :return: Tuple of (hit mask, exit prices, exit reasons), aligned with symbol_indices.
+        """
+        side = self.side[symbol_indices]
+        long, short = side == 1, side == -1
+        # Upper levels (max, TP) are touched by the high of a long or the low of a short,
+        # lower levels (liquidation, SL) by the low of a long or the high of a short
+        checks = (
+            ('max', self.max_price[symbol_indices], True),
+            ('tp', self.tp_price[symbol_indices], True),
+            ('liq', self.liq_price[symbol_indices], False),
+            ('sl', self.sl_price[symbol_indices], False),
+        )
+
+        hit = np.zeros(side.shape, dtype=bool)
+        exit_prices = np.full(side.shape, np.nan)
+        exit_reasons = np.full(side.shape, None, dtype=object)
+        for reason, level, upper in checks:
+            if upper:
+                touched = (long & (high_prices >= level)) | (short & (low_prices <= level))
+            else:
+                touched = (long & (low_prices <= level)) | (short & (high_prices >= level))
+            touched &= ~hit
+            exit_prices[touched] = level[touched]
+            exit_reasons[touched] = reason
+            hit |= touched
+
+        return hit, exit_prices, exit_reasons
+
+    def to_dict(self, symbol_index):
+        """Dictionary view of one position, {} when the symbol is flat."""
+        if not self.side[symbol_index]:
+            return {}
+
+        def level(value):
+            return None if np.isnan(value) else value
+
+        return {
+            'open_time': pd.Timestamp(self.open_time[symbol_index]),
+            'type': SIDE_NAMES[self.side[symbol_index]],
+            'entry_price': self.entry_price[symbol_index],
+            'leverage': self.leverage[symbol_index],
+            'collateral': self.collateral[symbol_index],
+            'position_size': self.position_size[symbol_index],
+            'sl_price': level(self.sl_price[symbol_index]),
+            'tp_price': level(self.tp_price[symbol_index]),
+            'liq_price': level(self.liq_price[symbol_index]),
+            'max_price': level(self.max_price[symbol_index]),
+            'borrowing_fee': self.borrowing_fee[symbol_index],
+            'trailing_stop': None,
+            'balance': self.balance[symbol_index],
+            'risk_per_trade': self.risk_per_trade[symbol_index],
+        }
+
+    def view(self):
+        """Read-only list-like view of the positions as dictionaries, built on access."""
+        return PositionsView(self)
+
+class PositionsView:
+    """Sequence of position dictionaries backed by a PositionBook, for infos and the live order path."""
+    def __init__(self, book):
+        self.book = book
+
+    def __len__(self):
+        return self.book.num_symbols
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.book.to_dict(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("position index out of range")
+        return self.book.to_dict(index)
+
+    def __iter__(self):
+        return (self.book.to_dict(i) for i in range(len(self)))
+
+    def __repr__(self):
+        return repr(list(self))
+
+class TradeStats:
+    """
+    Win and loss statistics of the last trades, kept in a ring buffer.
+
+    Closing a trade updates the running win/loss counts and sums in O(1), so the Kelly sizing
+    of a new position does not scan the trade history. PnLs are stored as integer cents, the
+    precision of the history, which keeps the running sums exact however long the run.
+    """
+    def __init__(self, window=100):
+        self.window = window
+        self.pnls = np.zeros(window, dtype=np.int64)
+        self.count = 0
+        self.cursor = 0
+        self.num_wins = 0
+        self.num_losses = 0
+        self.win_sum = 0
+        self.loss_sum = 0
+
+    def update(self, cents, sign):
+        if cents > 0:
+            self.num_wins += sign
+            self.win_sum += sign * cents
+        elif cents < 0:
+            self.num_losses += sign
+            self.loss_sum += sign * cents
+
+    def add(self, pnl):
+        """
+        Record the PnL of a closed trade, dropping the oldest one once the window is full.
+
+        :param pnl: The PnL of the trade, rounded to cents.
+        """
+        cents = int(round(pnl * 100))
+        if self.count == self.window:
+            self.update(self.pnls[self.cursor], -1)
+        else:
+            self.count += 1
+        self.pnls[self.cursor] = cents
+        self.update(cents, 1)
+        self.cursor = (self.cursor + 1) % self.window
+
+    def statistics(self):
+        """
+        Calculate win probability and win/loss ratio of the recorded trades.
+
+        :return: Tuple containing win probability and win/loss ratio.
+        """
+        total_trades = self.num_wins + self.num_losses
+        win_probability = self.num_wins / total_trades if total_trades > 0 else 0
+
+        average_win = self.win_sum / 100 / self.num_wins if self.num_wins > 0 else 0
+        average_loss = self.loss_sum / 100 / self.num_losses if self.num_losses > 0 else 0
+
+        win_loss_ratio = average_win / abs(average_loss) if average_loss != 0 else 0
+
+        return win_probability, win_loss_ratio
@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+import pandas as pd
+from positions import PositionBook, TradeStats
+
+class TestPositionBook(unittest.TestCase):
+
+    def setUp(self):
+        self.book = PositionBook(3)
+        self.book.open(0, 'long', open_step=1, open_time=pd.Timestamp('2024-01-01'), entry_price=100, leverage=50, collateral=10, position_size=0.1, sl_price=95, tp_price=110, liq_price=90, max_price=118, borrowing_fee=0.001, balance=1000, risk_per_trade=0.05)
+        self.book.open(2, 'short', open_step=1, open_time=pd.Timestamp('2024-01-01'), entry_price=100, leverage=50, collateral=10, position_size=0.1, sl_price=105, tp_price=90, liq_price=110, max_price=82, borrowing_fee=0.001, balance=1000, risk_per_trade=0.05)
+
+    def test_dict_view(self):
+        positions = self.book.view()
+        self.assertEqual(len(positions), 3)
+        self.assertEqual(positions[1], {})
+        self.assertEqual(positions[0]['type'], 'long')
+        self.assertEqual(positions[2]['type'], 'short')
+        self.assertEqual(positions[-1]['sl_price'], 105)
+
+    def test_unrealized_pnl(self):
+        pnl = self.book.unrealized_pnl(np.array([102.0, 50.0, 102.0]))
+        np.testing.assert_allclose(pnl, [10.0, 0.0, -10.0])
+        np.testing.assert_allclose(self.book.returns(pnl), [1.0, 0.0, -1.0])
+
+    def test_level_hits_precedence(self):
+        # The long touches both its TP and its SL, the short only its TP; TP wins over SL
+        hit, prices, reasons = self.book.level_hits(np.arange(3), np.array([94.0, 1.0, 89.0]), np.array([111.0, 1.0, 101.0]))
+        np.testing.assert_array_equal(hit, [True, False, True])
+        self.assertEqual(list(reasons[hit]), ['tp', 'tp'])
+        np.testing.assert_allclose(prices[hit], [110, 90])
+
+    def test_clear(self):
+        self.book.clear(0)
+        self.assertFalse(self.book.is_open[0])
+        self.assertTrue(np.isnan(self.book.sl_price[0]))
+        self.assertEqual(self.book.position_size[0], 0)
+
+class TestTradeStats(unittest.TestCase):
+
+    def test_matches_recent_history(self):
+        stats = TradeStats(window=10)
+        pnls = np.round(np.random.default_rng(0).normal(0, 5, 35), 2)
+        pnls[[3, 20]] = 0
+        for n, pnl in enumerate(pnls, start=1):
+            stats.add(pnl)
+            recent = pnls[max(0, n - 10):n]
+            wins, losses = recent[recent > 0], recent[recent < 0]
+            win_probability, win_loss_ratio = stats.statistics()
+            self.assertAlmostEqual(win_probability, len(wins) / (len(wins) + len(losses)))
+            self.assertAlmostEqual(win_loss_ratio, np.mean(wins) / abs(np.mean(losses)) if len(wins) and len(losses) else 0)
+
+    def test_empty(self):
+        self.assertEqual(TradeStats().statistics(), (0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
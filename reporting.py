@@ -138,6 +138,17 @@ def risk_return_ratio(returns):
 #     return round(mean_return / std_dev, 3) if std_dev != 0 else 0
 
 
+def trade_history_frame(history):
+    """
+    Convert a trade history to a DataFrame.
+
+    :param history: A TradeLog, whose numeric columns are exported without copying, or a list of trade dictionaries.
+    :return: DataFrame with one row per trade.
+    """
+    if hasattr(history, 'to_dataframe'):
+        return history.to_dataframe(categorical=False)
+    return pd.DataFrame(history)
+
 def count_exit_reasons(history_df, reason):
     """Count the number of occurrences of a specific exit reason."""
     return np.sum(history_df['exit_reason'] == reason)
@@ -145,7 +156,7 @@ def count_exit_reasons(history_df, reason):
 def log_trade_history(history, save_path='trade_history.csv'):
     
      # Convert history to a DataFrame
-    history_df = pd.DataFrame(history)
+    history_df = trade_history_frame(history)
     
     # Write history_df to a CSV file
     with open(save_path, mode='w', newline='') as file:
@@ -159,7 +170,7 @@ def log_trade_history(history, save_path='trade_history.csv'):
 
 def log_cumulative_returns(history, save_path='cumulative_returns.png'):
      # Convert history to a DataFrame
-    history_df = pd.DataFrame(history)
+    history_df = trade_history_frame(history)
     
     # Calculate cumulative returns per symbol
     cumulative_returns = {}
@@ -256,7 +267,7 @@ def calmar(returns):
 
 def display_stats(history, market_conditions, environment, save_path='net_profits.png'):
     # Convert history to a DataFrame
-    history_df = pd.DataFrame(history)
+    history_df = trade_history_frame(history)
     
     if history_df.empty:
         raise ValueError("History data is empty.")
@@ -650,8 +661,9 @@ def display_stats(history, market_conditions, environment, save_path='net_profit
     return portfolio_stats
 
 def plot_histograms(trade_history, rewards, actions_per_symbol, save_path='histograms.png'):
-    collaterals = [trade['collateral'] for trade in trade_history]
-    leverages = [trade['leverage'] for trade in trade_history]
+    history_df = trade_history_frame(trade_history)
+    collaterals = history_df['collateral'].tolist() if 'collateral' in history_df else []
+    leverages = history_df['leverage'].tolist() if 'leverage' in history_df else []
     
     # Ensure all actions are 1-dimensional
     actions = [np.ravel(action) for action in actions_per_symbol]
@@ -722,8 +734,9 @@ def plot_histograms(trade_history, rewards, actions_per_symbol, save_path='histo
 
 def plot_financial_metrics(trade_history, save_path='financial_metrics.png'):
     symbol = 'Evolution of'
-    returns = np.array([trade['return'] for trade in trade_history])
-    cumulative_profits = np.cumsum(np.array([trade['pnl'] for trade in trade_history]))
+    history_df = trade_history_frame(trade_history)
+    returns = history_df['return'].to_numpy() if 'return' in history_df else np.array([])
+    cumulative_profits = np.cumsum(history_df['pnl'].to_numpy() if 'pnl' in history_df else np.array([]))
     sharpe_ratios = []
     max_drawdowns = []
     risk_to_reward_ratios = []
@@ -809,7 +822,8 @@ def plot_environment_counters(fractal_counter, percentage_counter, fallback_coun
 
 def plot_combined_metrics(trade_history, save_path='combined_metrics.png'):
     # Extract returns and cumulative returns
-    returns = np.array([trade['return'] for trade in trade_history])
+    history_df = trade_history_frame(trade_history)
+    returns = history_df['return'].to_numpy() if 'return' in history_df else np.array([])
     cumulative_returns = np.cumsum(returns)
 
     # Create a figure with a specific layout
@@ -853,7 +867,7 @@ def plot_returns_heatmap(history, save_path='returns_heatmap.png'):
     Parameters:
     history (list of dict): List containing trade history with 'return' and 'open_time' keys.
     """
-    history_df = pd.DataFrame(history)
+    history_df = trade_history_frame(history)
     
     # Convert 'return' to percentage
     history_df['return'] = history_df['return'] * 100
@@ -898,7 +912,7 @@ def plot_symbol(symbol, mapping, timestamps, symbol_data, history, title, save_p
     trade_history = history
     # Convert trade_history to a DataFrame if it's not already
     if not isinstance(trade_history, pd.DataFrame):
-        trade_history = pd.DataFrame(trade_history)
+        trade_history = trade_history_frame(trade_history)
     
     # Convert timestamps to pandas DatetimeIndex
     timestamp = pd.to_datetime(timestamps)
@@ -1002,7 +1016,7 @@ def plot_combined_correlation_heatmap(history, group_by='symbol', save_path='com
     save_path (str): The path where the heatmap image will be saved.
     """
     # Convert history to a DataFrame
-    history_df = pd.DataFrame(history)
+    history_df = trade_history_frame(history)
 
     # Group by the specified column and calculate metrics for each group
     grouped_metrics = []
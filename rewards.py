@@ -3,34 +3,28 @@ import logging
 import traceback
 import numpy as np
 
+def unrealized_returns(self):
+    """
+    Compute the unrealized PnL and return on collateral of every position at the current close.
+
+    :param self: The trading environment.
+    :return: Tuple of (pnl, return_on_investment) arrays, 0 for symbols without a position.
+    """
+    current_prices = self.data_matrix[self.current_step, :, self.mapping['close']]
+    pnl = self.book.unrealized_pnl(current_prices)
+    return pnl, self.book.returns(pnl)
+
 def calculate_short_term_reward(self, action):
     try:
-        current_prices = self.data_matrix[self.current_step, :, self.mapping['close']]
         reward = 0
 
-        # Initialize arrays for pnl and return_on_investment
-        pnl = [0] * self.num_symbols
-        return_on_investment = [0] * self.num_symbols
-
-        for i in range(self.num_symbols):
-            position = self.positions[i]
-            if position:
-                entry_price = position['entry_price']
-                position_size = position['position_size']
-                leverage = position['leverage']
-                collateral = position['collateral']
-                
-                pnl[i] = (current_prices[i] - entry_price) * position_size * leverage
-                if position['type'] == 'short':
-                    pnl[i] = -pnl[i]  # Reverse PnL for short positions
-
-                # Calculate return
-                return_on_investment[i] = pnl[i] / collateral if collateral != 0 else 0
+        # Compute pnl and return_on_investment for all positions at once
+        pnl, return_on_investment = unrealized_returns(self)
 
         # Calculate metrics
-        net_profit_value = net_profit(np.array(pnl))
-        sharpe_ratio_value = sharpe(np.array(return_on_investment))
-        drawdown_value = max_drawdown(np.array(return_on_investment))
+        net_profit_value = net_profit(pnl)
+        sharpe_ratio_value = sharpe(return_on_investment)
+        drawdown_value = max_drawdown(return_on_investment)
 
         # Hyperparameters
         alpha = self.params.get('alpha', 1.0)
@@ -38,7 +32,7 @@ def calculate_short_term_reward(self, action):
         gamma = self.params.get('gamma', 1.0)
 
         # Calculate transaction costs
-        transaction_costs = sum(1 for action_value in action if action_value != 0) * float(self.params['trading_penalty'])
+        transaction_costs = np.count_nonzero(action) * float(self.params['trading_penalty'])
 
         # Calculate reward
         reward = (net_profit_value +
@@ -57,7 +51,6 @@ def calculate_short_term_reward(self, action):
 
 def calculate_combined_reward(self, action):
     try:
-        current_prices = self.data_matrix[self.current_step, :, self.mapping['close']]
         reward = 0
 
         # Define weights
@@ -65,29 +58,13 @@ def calculate_combined_reward(self, action):
         weight_sharpe_ratio = 0.35
         weight_max_drawdown = 0.35
 
-        # Initialize arrays for pnl and return_on_investment
-        pnl = [0] * self.num_symbols
-        return_on_investment = [0] * self.num_symbols
-
-        for i in range(self.num_symbols):
-            position = self.positions[i]
-            if position:
-                entry_price = position['entry_price']
-                position_size = position['position_size']
-                leverage = position['leverage']
-                collateral = position['collateral']
-                
-                pnl[i] = (current_prices[i] - entry_price) * position_size * leverage
-                if position['type'] == 'short':
-                    pnl[i] = -pnl[i]  # Reverse PnL for short positions
-
-                # Calculate return
-                return_on_investment[i] = pnl[i] / collateral if collateral != 0 else 0
+        # Compute pnl and return_on_investment for all positions at once
+        pnl, return_on_investment = unrealized_returns(self)
                 
         # Calculate metrics
-        net_profit_value = net_profit(np.array(pnl))
-        sharpe_ratio_value = sharpe(np.array(return_on_investment))
-        max_drawdown_value = max_drawdown(np.array(return_on_investment))
+        net_profit_value = net_profit(pnl)
+        sharpe_ratio_value = sharpe(return_on_investment)
+        max_drawdown_value = max_drawdown(return_on_investment)
 
         # Update min and max values for normalization
         self.min_max_values['net_profit'] = [min(self.min_max_values['net_profit'][0], net_profit_value),
@@ -124,58 +101,36 @@ def calculate_combined_reward(self, action):
 
 def calculate_consecutive_pnl_reward(self, action):
     try:
-        current_prices = self.data_matrix[self.current_step, :, self.mapping['close']]
         reward = 0
 
-        # Initialize arrays for pnl, consecutive positive PnLs, and previous returns
-        pnl = [0] * self.num_symbols
-        consecutive_positive_pnls = [0] * self.num_symbols  # Track consecutive positive PnLs
-        previous_returns = self.previous_returns if hasattr(self, 'previous_returns') else [0] * self.num_symbols
-
-        # Initialize rate_of_change
-        rate_of_change = 0
-
-        # Initialize holding duration
-        holding_duration = self.holding_duration if hasattr(self, 'holding_duration') else [0] * self.num_symbols
-
-        for i in range(self.num_symbols):
-            position = self.positions[i]
-            if position:
-                entry_price = position['entry_price']
-                position_size = position['position_size']
-                leverage = position['leverage']
-                collateral = position['collateral']
-                
-                pnl[i] = (current_prices[i] - entry_price) * position_size * leverage
-                if position['type'] == 'short':
-                    pnl[i] = -pnl[i]  # Reverse PnL for short positions
+        # Previous returns and holding duration are per-symbol arrays kept on the environment
+        previous_returns = self.previous_returns if hasattr(self, 'previous_returns') else np.zeros(self.num_symbols)
+        holding_duration = self.holding_duration if hasattr(self, 'holding_duration') else np.zeros(self.num_symbols)
 
-                # Calculate return
-                current_return = pnl[i] / collateral if collateral != 0 else 0
+        # Compute pnl and current return for all positions at once
+        pnl, current_return = unrealized_returns(self)
+        is_open = self.book.is_open
 
-                # Calculate rate of change of return
-                rate_of_change = current_return - previous_returns[i]
+        # Calculate rate of change of return
+        rate_of_change = np.where(is_open, current_return - previous_returns, 0)
 
-                # Update consecutive positive PnL count
-                if pnl[i] > 0:
-                    consecutive_positive_pnls[i] += 1 * rate_of_change
-                    holding_duration[i] += 1  # Increase holding duration for profitable trades
-                else:
-                    consecutive_positive_pnls[i] = 0
-                    holding_duration[i] = 0  # Reset holding duration for non-profitable trades
+        # Streaks only count open positions with a positive PnL
+        profitable = is_open & (pnl > 0)
+        consecutive_positive_pnls = np.where(profitable, rate_of_change, 0)  # Track consecutive positive PnLs
 
-                # Reward based on rate of change
-                # reward += rate_of_change
+        # Increase holding duration for profitable trades, reset it for non-profitable ones
+        holding_duration = np.where(profitable, holding_duration + 1, np.where(is_open, 0, holding_duration))
 
-                # Update previous return
-                previous_returns[i] = current_return
+        # Update previous return
+        previous_returns = np.where(is_open, current_return, previous_returns)
 
         # Calculate reward based on consecutive positive PnLs and holding duration
         # Increase the multiplier for holding duration to further encourage holding
-        reward += sum(consecutive_positive_pnls[i] * (1 + holding_duration[i] * float(self.params['holding_bonus'])) for i in range(self.num_symbols))  # Increase reward for longer holding
+        # Sums run over the symbol axis, so batched environments get one reward per episode
+        reward += np.sum(consecutive_positive_pnls * (1 + holding_duration * float(self.params['holding_bonus'])), axis=-1)  # Increase reward for longer holding
 
         # Introduce a penalty for trading activity
-        trading_penalty = sum(1 for action_value in action if action_value != 0) * float(self.params['trading_penalty'])
+        trading_penalty = np.count_nonzero(action, axis=-1) * float(self.params['trading_penalty'])
         reward -= trading_penalty
 
         # Store previous returns and holding duration for the next step
@@ -1,44 +1,82 @@
 # risk_management.pyx
+# Build in place with: python setup.py build_ext --inplace
 import numpy as np
 cimport numpy as cnp
+cimport cython
 
-def handle_risk_management_cython(int symbol_index, int position_type, 
-                                  cnp.ndarray[double] low_prices, 
-                                  cnp.ndarray[double] high_prices, 
-                                  cnp.ndarray[double] sl_prices, 
-                                  cnp.ndarray[double] tp_prices, 
-                                  cnp.ndarray[double] liq_prices, 
-                                  cnp.ndarray[double] max_prices, 
-                                  cnp.ndarray timestamps):
-    cdef double sl_price = sl_prices[symbol_index]
-    cdef double tp_price = tp_prices[symbol_index]
-    cdef double liq_price = liq_prices[symbol_index]
-    cdef double max_price = max_prices[symbol_index]
-    cdef int i, num_candles = low_prices.shape[0]
+# Level order of the hits, also the precedence when several levels are hit by the same candle
+RISK_LEVELS = ('max', 'liq', 'tp', 'sl')
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def first_hits(const double[::1] low_prices, const double[::1] high_prices, int position_type,
+               double max_price, double liq_price, double tp_price, double sl_price):
+    """
+    Find the first 1s candle hitting each level of a position, in a single pass.
+
+    The scan stops after the first candle hitting any level, since no later candle can change
+    which level closes the position. NaN levels are never hit.
+
+    :param low_prices: Contiguous 1s low prices.
+    :param high_prices: Contiguous 1s high prices.
+    :param position_type: 1 for long, 0 for short.
+    :return: Array with the first index hitting the max, liq, tp and sl levels, -1 when not hit.
+    """
+    cdef cnp.ndarray[cnp.int64_t] hits = np.full(4, -1, dtype=np.int64)
+    cdef Py_ssize_t i, num_candles = low_prices.shape[0]
+    cdef double low, high
+    cdef bint found = False
 
     for i in range(num_candles):
-        if max_price is not None:
-            if position_type == 1 and high_prices[i] >= max_price:
-                return symbol_index, max_price, "max", timestamps[i]
-            elif position_type == 0 and low_prices[i] <= max_price:
-                return symbol_index, max_price, "max", timestamps[i]
-
-        if liq_price is not None:
-            if position_type == 1 and low_prices[i] <= liq_price:
-                return symbol_index, liq_price, "liq", timestamps[i]
-            elif position_type == 0 and high_prices[i] >= liq_price:
-                return symbol_index, liq_price, "liq", timestamps[i]
-
-        if tp_price is not None:
-            if position_type == 1 and high_prices[i] >= tp_price:
-                return symbol_index, tp_price, "tp", timestamps[i]
-            elif position_type == 0 and low_prices[i] <= tp_price:
-                return symbol_index, tp_price, "tp", timestamps[i]
-
-        if sl_price is not None:
-            if position_type == 1 and low_prices[i] <= sl_price:
-                return symbol_index, sl_price, "sl", timestamps[i]
-            elif position_type == 0 and high_prices[i] >= sl_price:
-                return symbol_index, sl_price, "sl", timestamps[i]
-
-    return None, None, None, None
\ No newline at end of file
+        low = low_prices[i]
+        high = high_prices[i]
+        if position_type == 1:
+            if high >= max_price:
+                hits[0] = i
+                found = True
+            if low <= liq_price:
+                hits[1] = i
+                found = True
+            if high >= tp_price:
+                hits[2] = i
+                found = True
+            if low <= sl_price:
+                hits[3] = i
+                found = True
+        else:
+            if low <= max_price:
+                hits[0] = i
+                found = True
+            if high >= liq_price:
+                hits[1] = i
+                found = True
+            if low <= tp_price:
+                hits[2] = i
+                found = True
+            if high >= sl_price:
+                hits[3] = i
+                found = True
+        if found:
+            break
+
+    return hits
+
+def handle_risk_management_cython(int symbol_index, int position_type,
+                                  cnp.ndarray[double] low_prices,
+                                  cnp.ndarray[double] high_prices,
+                                  cnp.ndarray[double] sl_prices,
+                                  cnp.ndarray[double] tp_prices,
+                                  cnp.ndarray[double] liq_prices,
+                                  cnp.ndarray[double] max_prices,
+                                  cnp.ndarray timestamps):
+    cdef double[4] levels = [max_prices[symbol_index], liq_prices[symbol_index], tp_prices[symbol_index], sl_prices[symbol_index]]
+    hits = first_hits(np.ascontiguousarray(low_prices), np.ascontiguousarray(high_prices), position_type,
+                      levels[0], levels[1], levels[2], levels[3])
+
+    cdef int level
+    for level in range(4):
+        # Only the levels hit by the first candle are set, in order of precedence
+        if hits[level] >= 0:
+            return symbol_index, levels[level], RISK_LEVELS[level], timestamps[hits[level]]
+
+    return None, None, None, None
@@ -0,0 +1,66 @@
+import unittest
+import numpy as np
+from utilities import RISK_LEVELS, first_hits_compiled, first_hits_ragged, get_risk_management_1s, handle_risk_management_1s_loop
+
+class TestRiskKernels(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def random_case(self):
+        # A random 1s walk and levels around its start, some of them missing
+        num_candles = int(self.rng.integers(0, 300))
+        mid = 100 * np.exp(np.cumsum(self.rng.normal(0, 0.002, num_candles)))
+        low_prices = mid * (1 - self.rng.uniform(0, 0.001, num_candles))
+        high_prices = mid * (1 + self.rng.uniform(0, 0.001, num_candles))
+        levels = [np.where(self.rng.random(3) < 0.2, np.nan, 100 * self.rng.uniform(0.9, 1.1, 3)) for _ in range(4)]
+        timestamps = np.arange(num_candles, dtype=np.int64) * 10**9
+        position_type = int(self.rng.integers(0, 2))
+        symbol_index = int(self.rng.integers(0, 3))
+        return (symbol_index, position_type, low_prices, high_prices, *levels, timestamps)
+
+    def assert_matches_loop(self, kernel):
+        handle_risk_management = get_risk_management_1s(kernel)
+        reasons = set()
+        for _ in range(500):
+            case = self.random_case()
+            expected = handle_risk_management_1s_loop(*case)
+            self.assertEqual(handle_risk_management(*case), expected)
+            reasons.add(expected[2])
+        self.assertEqual(reasons, {None, 'max', 'liq', 'tp', 'sl'})
+
+    def test_numpy_matches_loop(self):
+        self.assert_matches_loop('numpy')
+
+    def test_compiled_matches_loop(self):
+        if first_hits_compiled is None:
+            self.skipTest("risk_management extension is not built")
+        self.assert_matches_loop('cython')
+
+    def test_ragged_matches_loop(self):
+        cases = [self.random_case() for _ in range(200)]
+        offsets = np.concatenate(([0], np.cumsum([len(case[2]) for case in cases])))
+        levels = [np.array([case[k][case[0]] for case in cases]) for k in (7, 6, 5, 4)]  # max, liq, tp, sl
+        hits = first_hits_ragged(np.concatenate([case[2] for case in cases]), np.concatenate([case[3] for case in cases]), offsets,
+                                 np.array([case[1] for case in cases]), *levels)
+        for n, case in enumerate(cases):
+            _, _, reason, exit_time = handle_risk_management_1s_loop(*case)
+            hit = np.flatnonzero(hits[n] >= 0)
+            if reason is None:
+                self.assertEqual(len(hit), 0)
+            else:
+                self.assertEqual(RISK_LEVELS[hit[0]], reason)
+                self.assertEqual(case[8][hits[n, hit[0]]], exit_time)
+
+    def test_precedence_within_one_candle(self):
+        # A single candle crossing every level of a long closes it at max
+        levels = [np.array([105.0]), np.array([110.0]), np.array([80.0]), np.array([120.0])]  # sl, tp, liq, max
+        for kernel in ['loop', 'numpy', 'auto']:
+            result = get_risk_management_1s(kernel)(0, 1, np.array([106.0, 70.0]), np.array([107.0, 130.0]), *levels, np.array([1, 2]))
+            self.assertEqual(result, (0, 120.0, 'max', 2))
+
+    def test_unknown_kernel(self):
+        with self.assertRaises(ValueError):
+            get_risk_management_1s('numba')
+
+if __name__ == '__main__':
+    unittest.main()
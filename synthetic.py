@@ -3,69 +3,13 @@ from datetime import datetime, timedelta
 # from utilities import identify_patterns
 import pandas as pd
 import matplotlib.pyplot as plt
+from scipy.signal import lfilter
+from market_store import CANDLE_DTYPE, DAY_NS
 
-def create_synthetic_data(limit=100, interval='1d', mode='testing'):
-    if mode == 'training':
-        market_conditions = {
-            'TUP': {'description': 'trending up', 'mu': 0.05, 'sigma': 0.1},
-            'TDO': {'description': 'trending down', 'mu': -0.05, 'sigma': 0.1},
-            'RANG': {'description': 'ranging', 'mu': 0.0, 'sigma': 0.05},
-            'VOLH': {'description': 'high vol', 'mu': 0.0, 'sigma': 0.3},
-            'VOLL': {'description': 'low vol', 'mu': 0.0, 'sigma': 0.01},
-            # 'CONS': {'description': 'consolidating', 'mu': 0.0, 'sigma': 0.02},
-            'BULL': {'description': 'bullish', 'mu': 0.03, 'sigma': 0.1},
-            'BEAR': {'description': 'bearish', 'mu': -0.03, 'sigma': 0.1},
-            'SIDE': {'description': 'sideways', 'mu': 0.0, 'sigma': 0.05},
-            'XBULL': {'description': 'extreme bullish', 'mu': 0.1, 'sigma': 0.2},
-            'XBEAR': {'description': 'extreme bearish', 'mu': -0.1, 'sigma': 0.2},
-            # 'BEARM': {'description': 'bear market', 'mu': -0.1, 'sigma': 0.3},
-            # 'BULLM': {'description': 'bull market', 'mu': 0.1, 'sigma': 0.3},
-            # 'STABM': {'description': 'stable market', 'mu': 0.02, 'sigma': 0.1},
-            # 'VOLM': {'description': 'volatile market', 'mu': 0.05, 'sigma': 0.5}
-        }
-    elif mode == 'testing':
-        expected_return = 0.1
-        volatility_max = 0.5
-        volatility_min = 0
-        price_min = 100
-        price_max = 1000
-        
-        num_cryptos = 10
-        
-        # Create 10 synthetic cryptos with random mu and sigma
-        market_conditions = {}
-        for i in range(num_cryptos):
-            # Randomly generate mu, sigma, and S0
-            mu = round(np.random.uniform(-expected_return, expected_return), 2)
-            sigma = round(np.random.uniform(volatility_min, volatility_max), 2)
-            S0 = round(np.random.uniform(price_min, price_max), 2)
-            
-            # Determine category based on mu and sigma using the given parameters
-            if mu > expected_return / 2 and sigma < volatility_max / 2:
-                category = 'BULL'
-                description = 'bullish'
-            elif mu < -expected_return / 2 and sigma < volatility_max / 2:
-                category = 'BEAR'
-                description = 'bearish'
-            elif abs(mu) <= expected_return / 2 and sigma < volatility_max / 3:
-                category = 'STAB'
-                description = 'stable'
-            elif mu > expected_return / 2 and sigma >= volatility_max / 2:
-                category = 'XBULL'
-                description = 'volatile bullish'
-            elif mu < -expected_return / 2 and sigma >= volatility_max / 2:
-                category = 'XBEAR'
-                description = 'volatile bearish'
-            else:
-                category = 'NEUT'
-                description = 'neutral'
-            
-            # Generate a crypto name based on the category
-            symbol = f"{category}{i+1}"
-            
-            market_conditions[symbol] = {'description': description, 'mu': mu, 'sigma': sigma, 'S0': S0}
-    else:
-        raise ValueError("Invalid mode. Please use 'training' or 'testing'.")
+def create_synthetic_data(limit=100, interval='1d', mode='testing', seed=None, volume='max'):
+    # One generator draws every random number, so a seed reproduces the whole dataset
+    rng = np.random.default_rng(seed)
+    market_conditions = generate_market_conditions(mode, rng)
 
     # S0 = 100  # Initial price
     T = limit  # Total time for 1 day (or adjust as needed)
@@ -80,7 +24,7 @@ def create_synthetic_data(limit=100, interval='1d', mode='testing'):
 
     for symbol, params in market_conditions.items():
         print(f"Generating market condition: {symbol} - {params['description']}: expected={params['mu']}, volatility={params['sigma']}")
-        open_prices, high_prices, low_prices, close_prices = generate_gbm_prices(round(np.random.uniform(1, 100), 2), params['mu'], params['sigma'], T, dt)
+        open_prices, high_prices, low_prices, close_prices = generate_gbm_prices(round(rng.uniform(1, 100), 2), params['mu'], params['sigma'], T, dt, rng=rng)
         
         # Calculate intra_volatility as the absolute price changes
         price_changes = np.diff(close_prices) / close_prices[:-1]
@@ -89,7 +33,7 @@ def create_synthetic_data(limit=100, interval='1d', mode='testing'):
         # Fix: Pad intra_volatility to match the length of coupled_volumes
         intra_volatility = np.insert(intra_volatility, 0, 0)  # Insert a zero at the beginning
 
-        volumes = generate_realistic_volumes(N, mu=7, sigma=0.5, theta=0.1, long_term_mean=1000, intra_volatility=intra_volatility)
+        volumes = generate_realistic_volumes(N, mu=7, sigma=0.5, theta=0.1, long_term_mean=1000, intra_volatility=intra_volatility, rng=rng)
 
         # print(f"Generated {symbol} | Length: {len(open_prices)}")
 
@@ -113,7 +57,7 @@ def create_synthetic_data(limit=100, interval='1d', mode='testing'):
         full_data_matrix.append(full_symbol_df)
 
         # Resample data to the specified interval
-        resampled_symbol_data, _ = pick_interval_data(full_symbol_data, interval)
+        resampled_symbol_data = resample_ohlcv(full_symbol_data, interval, volume)
         
         # Ensure resampled_symbol_data is a 2D array before appending
         if resampled_symbol_data.ndim == 1:
@@ -138,38 +82,349 @@ def create_synthetic_data(limit=100, interval='1d', mode='testing'):
 
     return resampled_data_matrix, full_data_matrix, resampled_timestamps, mapping, valid_symbols, market_conditions
 
-def pick_interval_data(data, interval):
-    # Convert interval to seconds
+def stream_synthetic_data(store, limit=100, interval='1d', mode='testing', seed=None, start_time=None, volume='max'):
+    """
+    Generate the synthetic market of create_synthetic_data chunk by chunk into a MarketStore.
+
+    The 1s candles are generated a chunk of whole days and whole candles at a time, written to
+    the day shards of the store and resampled to the interval right away, so the memory holds
+    one chunk of one symbol instead of the whole 1s series of every symbol. Times are implied
+    by the start time and the 1s step, the environments read the 1s candles back from the
+    store their market_store_path parameter or MARKET_STORE_PATH points to.
+
+    :param store: MarketStore receiving the 1s candles, one shard per symbol and day.
+    :param limit: Number of days to generate.
+    :param interval: Interval of the resampled candles.
+    :param mode: 'training' or 'testing', see generate_market_conditions.
+    :param seed: Seed of the generator, the same seed writes the same market.
+    :param start_time: Start of the first day, today when None.
+    :param volume: Aggregation of the volume of the resampled candles, see resample_ohlcv.
+    :return: Tuple of the (candles, symbols, 5) resampled data matrix, their open times,
+        the feature mapping, the symbols and their market conditions.
+    """
+    rng = np.random.default_rng(seed)
+    market_conditions = generate_market_conditions(mode, rng)
+
+    start_time = pd.Timestamp.now() if start_time is None else pd.Timestamp(start_time)
+    start_ns = start_time.normalize().value
+    day_seconds = DAY_NS // 10**9
     interval_seconds = convert_interval_to_seconds(interval)
-    
-    # Initialize lists to store resampled data
-    resampled_data = []
-    
-    # Iterate over the data in chunks of interval_seconds
-    for start in range(0, len(data), interval_seconds):
-        end = min(start + interval_seconds, len(data))
+    N = limit * day_seconds  # Number of time steps
+    # Chunks of whole days that also end on a candle boundary
+    chunk_size = int(np.lcm(day_seconds, interval_seconds))
+    dt = 1 / day_seconds  # Time step for one-second data
+
+    resampled_data_matrix = []
+    mapping = {'open': 0, 'high': 1, 'low': 2, 'close': 3, 'volume': 4}
+    valid_symbols = list(market_conditions.keys())
+
+    for symbol, params in market_conditions.items():
+        print(f"Generating market condition: {symbol} - {params['description']}: expected={params['mu']}, volatility={params['sigma']}")
+        last_price = round(rng.uniform(1, 100), 2)
+        resampled_chunks = []
+
+        for chunk_start in range(0, N, chunk_size):
+            size = min(chunk_size, N - chunk_start)
+            log_returns = generate_gbm_log_returns(params['mu'], params['sigma'], dt, size, rng)
+            if chunk_start == 0:
+                # The series starts at the initial price, like generate_gbm_prices
+                log_returns[0] = 0.0
+            prices = last_price * np.exp(np.cumsum(log_returns))
+
+            # Absolute price changes, the first one from the close of the previous chunk
+            previous_prices = np.concatenate(([last_price], prices[:-1]))
+            intra_volatility = np.abs(prices - previous_prices) / previous_prices
+            volumes = generate_realistic_volumes(size, mu=7, sigma=0.5, theta=0.1, long_term_mean=1000, intra_volatility=intra_volatility, rng=rng)
+            last_price = prices[-1]
+
+            chunk = np.column_stack((prices, prices, prices, prices, volumes))
+            write_days(store, symbol, start_ns + chunk_start * 10**9, chunk)
+
+            resampled_chunks.append(resample_ohlcv(chunk, interval_seconds, volume))
+
+        resampled_data_matrix.append(np.concatenate(resampled_chunks))
+
+    resampled_data_matrix = np.stack(resampled_data_matrix, axis=1)
+    timestamps = pd.date_range(pd.Timestamp(start_ns), periods=len(resampled_data_matrix), freq=f'{interval_seconds}s')
+
+    return resampled_data_matrix, timestamps, mapping, valid_symbols, market_conditions
+
+class RegimeSwitchingDays:
+    """
+    1s candles of a regime switching market over whole days, generated a chunk of whole days
+    and whole candles at a time, see generate_regime_switching_chunks.
+
+    Iterating yields the (first second, data) of every chunk, data being a buffer reused by the
+    next chunk. The candles are generated an hour at a time into it, so the temporaries of the
+    generator stay small next to the chunk. The drift and volatility realized by the symbols
+    and the steps spent in every regime are accumulated along the way, so the market
+    conditions are known without keeping the 1s series.
+    """
+    def __init__(self, limit, interval, num_symbols, rng, **market_params):
+        day_seconds = DAY_NS // 10**9
+        self.regimes = generate_market_conditions('training', rng)
+        self.dt = 1 / day_seconds  # Time step for one-second data
+        self.N = limit * day_seconds  # Number of time steps
+        # Chunks of whole days that also end on a candle boundary, whole hours as well
+        self.chunk_size = int(np.lcm(day_seconds, convert_interval_to_seconds(interval)))
+        self.num_symbols = num_symbols
+        self.hours = generate_regime_switching_chunks(num_symbols, self.N, self.dt, rng, self.regimes, 60 * 60, **market_params)
+        self.regime_counts = np.zeros(len(self.regimes), dtype=np.int64)
+        self.count = 0
+        self.sums = np.zeros(num_symbols)
+        self.squares = np.zeros(num_symbols)
+        self.last_log_close = None
+
+    def __iter__(self):
+        chunk = np.empty((min(self.chunk_size, self.N), self.num_symbols, 5))
+        chunk_start = 0
+        filled = 0
+        for data, regime_path in self.hours:
+            chunk[filled:filled + len(data)] = data
+            filled += len(data)
+            log_close = np.log(data[:, :, 3])
+            if self.last_log_close is not None:
+                log_close = np.concatenate((self.last_log_close[np.newaxis], log_close))
+            log_returns = np.diff(log_close, axis=0)
+            self.last_log_close = log_close[-1]
+            self.count += len(log_returns)
+            self.sums += log_returns.sum(axis=0)
+            self.squares += (log_returns**2).sum(axis=0)
+            self.regime_counts += np.bincount(regime_path, minlength=len(self.regimes))
+
+            if filled == len(chunk) or chunk_start + filled == self.N:
+                yield chunk_start, chunk[:filled]
+                chunk_start += filled
+                filled = 0
+
+    def market_conditions(self, symbols):
+        """
+        Realized expected return and volatility of the 1s log-returns of every symbol, per day
+        like the regime parameters, and the regime the market spent most time in.
+        """
+        mean = self.sums / self.count
+        sigmas = np.sqrt(np.maximum(self.squares / self.count - mean**2, 0)) / np.sqrt(self.dt)
+        mus = mean / self.dt + 0.5 * sigmas**2
+        dominant = list(self.regimes)[self.regime_counts.argmax()]
+        return {
+            symbol: {'description': f"regime switching, mostly {self.regimes[dominant]['description']}", 'mu': round(float(mus[index]), 2), 'sigma': round(float(sigmas[index]), 2)}
+            for index, symbol in enumerate(symbols)
+        }
+
+def create_regime_switching_data(limit=100, interval='1d', num_symbols=10, seed=None, volume='max', start_time=None, **market_params):
+    """
+    Generate a synthetic market of correlated symbols going through the regimes of the
+    'training' market conditions, see generate_regime_switching_market.
+
+    The market is generated a chunk of whole days at a time into one 1s array per symbol and
+    resampled chunk by chunk, so no (1s steps, symbols) temporary is ever allocated.
+
+    :param limit: Number of days to generate.
+    :param interval: Interval of the resampled candles.
+    :param num_symbols: Number of symbols.
+    :param seed: Seed of the generator, the same seed generates the same market.
+    :param volume: Aggregation of the volume of the resampled candles, see resample_ohlcv.
+    :param start_time: Time of the first 1s candle, now when None.
+    :param market_params: Regime, correlation and jump parameters of generate_regime_switching_market.
+    :return: Same tuple as create_synthetic_data, the market conditions holding the realized
+        expected return and volatility of every symbol and the regime it spent most time in.
+    """
+    rng = np.random.default_rng(seed)
+    market = RegimeSwitchingDays(limit, interval, num_symbols, rng, **market_params)
+    mapping = {'open': 0, 'high': 1, 'low': 2, 'close': 3, 'volume': 4}
+    valid_symbols = [f"REG{i+1}" for i in range(num_symbols)]
+
+    # The 1s DataFrames of the symbols are views of this array
+    full_data = np.empty((num_symbols, market.N, len(mapping)))
+    resampled_chunks = []
+    for chunk_start, data in market:
+        full_data[:, chunk_start:chunk_start + len(data)] = data.transpose(1, 0, 2)
+        resampled_chunks.append(resample_ohlcv(data, interval, volume))
+
+    start_time = pd.Timestamp.now() if start_time is None else pd.Timestamp(start_time)
+    timestamps = pd.date_range(start_time, periods=market.N, freq='1s', name='timestamp')
+    full_data_matrix = [pd.DataFrame(full_data[index], columns=list(mapping), index=timestamps) for index in range(num_symbols)]
+
+    resampled_data_matrix = np.concatenate(resampled_chunks)
+    resampled_timestamps = resample_timestamps(timestamps, interval)
+
+    return resampled_data_matrix, full_data_matrix, resampled_timestamps, mapping, valid_symbols, market.market_conditions(valid_symbols)
+
+def stream_regime_switching_data(store, limit=100, interval='1d', num_symbols=10, seed=None, volume='max', start_time=None, **market_params):
+    """
+    Generate the market of create_regime_switching_data chunk by chunk into a MarketStore.
+
+    Every chunk of whole days is written to the day shards of the store and resampled right
+    away, like stream_synthetic_data, so the memory holds one chunk of the market instead of
+    the whole 1s series of every symbol.
+
+    :param store: MarketStore receiving the 1s candles, one shard per symbol and day.
+    :param start_time: Start of the first day, today when None.
+    :return: Same tuple as stream_synthetic_data, the market conditions of create_regime_switching_data.
+    """
+    rng = np.random.default_rng(seed)
+    market = RegimeSwitchingDays(limit, interval, num_symbols, rng, **market_params)
+    mapping = {'open': 0, 'high': 1, 'low': 2, 'close': 3, 'volume': 4}
+    valid_symbols = [f"REG{i+1}" for i in range(num_symbols)]
+
+    start_time = pd.Timestamp.now() if start_time is None else pd.Timestamp(start_time)
+    start_ns = start_time.normalize().value
+    interval_seconds = convert_interval_to_seconds(interval)
+
+    resampled_chunks = []
+    for chunk_start, data in market:
+        for index, symbol in enumerate(valid_symbols):
+            write_days(store, symbol, start_ns + chunk_start * 10**9, data[:, index])
+        resampled_chunks.append(resample_ohlcv(data, interval_seconds, volume))
+
+    resampled_data_matrix = np.concatenate(resampled_chunks)
+    timestamps = pd.date_range(pd.Timestamp(start_ns), periods=len(resampled_data_matrix), freq=f'{interval_seconds}s')
+
+    return resampled_data_matrix, timestamps, mapping, valid_symbols, market.market_conditions(valid_symbols)
+
+def write_days(store, symbol, start_ns, ohlcv):
+    """
+    Write 1s candles to the day shards of a MarketStore.
+
+    :param store: MarketStore receiving the candles.
+    :param symbol: The symbol of the candles.
+    :param start_ns: Open time of the first candle in epoch nanoseconds, at the start of a day.
+    :param ohlcv: Array of shape (seconds, 5) of open, high, low, close, volume of whole days,
+        the last day may be partial.
+    """
+    day_seconds = DAY_NS // 10**9
+    for day_start in range(0, len(ohlcv), day_seconds):
+        day = ohlcv[day_start:day_start + day_seconds]
+        records = np.empty(len(day), dtype=CANDLE_DTYPE)
+        records['timestamp'] = start_ns + (day_start + np.arange(len(day))) * 10**9
+        for column, field in enumerate(CANDLE_DTYPE.names[1:]):
+            records[field] = day[:, column]
+        store.write_day(symbol, pd.Timestamp(int(records['timestamp'][0])), records)
+
+def generate_market_conditions(mode, rng):
+    """
+    Pick the market condition, expected return and volatility of every synthetic symbol.
+
+    :param mode: 'training' for the fixed set of conditions, 'testing' for 10 random symbols.
+    :param rng: np.random.Generator drawing the random symbols.
+    :return: Dictionary of the condition parameters by symbol.
+    """
+    if mode == 'training':
+        market_conditions = {
+            'TUP': {'description': 'trending up', 'mu': 0.05, 'sigma': 0.1},
+            'TDO': {'description': 'trending down', 'mu': -0.05, 'sigma': 0.1},
+            'RANG': {'description': 'ranging', 'mu': 0.0, 'sigma': 0.05},
+            'VOLH': {'description': 'high vol', 'mu': 0.0, 'sigma': 0.3},
+            'VOLL': {'description': 'low vol', 'mu': 0.0, 'sigma': 0.01},
+            # 'CONS': {'description': 'consolidating', 'mu': 0.0, 'sigma': 0.02},
+            'BULL': {'description': 'bullish', 'mu': 0.03, 'sigma': 0.1},
+            'BEAR': {'description': 'bearish', 'mu': -0.03, 'sigma': 0.1},
+            'SIDE': {'description': 'sideways', 'mu': 0.0, 'sigma': 0.05},
+            'XBULL': {'description': 'extreme bullish', 'mu': 0.1, 'sigma': 0.2},
+            'XBEAR': {'description': 'extreme bearish', 'mu': -0.1, 'sigma': 0.2},
+            # 'BEARM': {'description': 'bear market', 'mu': -0.1, 'sigma': 0.3},
+            # 'BULLM': {'description': 'bull market', 'mu': 0.1, 'sigma': 0.3},
+            # 'STABM': {'description': 'stable market', 'mu': 0.02, 'sigma': 0.1},
+            # 'VOLM': {'description': 'volatile market', 'mu': 0.05, 'sigma': 0.5}
+        }
+    elif mode == 'testing':
+        expected_return = 0.1
+        volatility_max = 0.5
+        volatility_min = 0
+        price_min = 100
+        price_max = 1000
         
-        # Extract the chunk of data for the current interval
-        interval_data = data[start:end]
+        num_cryptos = 10
         
-        # Calculate open, high, low, close, and volume for the interval
-        open_price = interval_data[0, 0]  # Open price of the first candle in the interval
-        high_price = np.max(interval_data[:, 1])  # Highest high in the interval
-        low_price = np.min(interval_data[:, 2])  # Lowest low in the interval
-        close_price = interval_data[-1, 3]  # Close price of the last candle in the interval
-        volume = np.max(interval_data[:, 4])  # Use max volume to capture spikes
-
-        # Append the aggregated data to the resampled list
-        resampled_data.append([open_price, high_price, low_price, close_price, volume])
-    
-    return np.array(resampled_data), None
+        # Create 10 synthetic cryptos with random mu and sigma
+        market_conditions = {}
+        for i in range(num_cryptos):
+            # Randomly generate mu, sigma, and S0
+            mu = round(rng.uniform(-expected_return, expected_return), 2)
+            sigma = round(rng.uniform(volatility_min, volatility_max), 2)
+            S0 = round(rng.uniform(price_min, price_max), 2)
+            
+            # Determine category based on mu and sigma using the given parameters
+            if mu > expected_return / 2 and sigma < volatility_max / 2:
+                category = 'BULL'
+                description = 'bullish'
+            elif mu < -expected_return / 2 and sigma < volatility_max / 2:
+                category = 'BEAR'
+                description = 'bearish'
+            elif abs(mu) <= expected_return / 2 and sigma < volatility_max / 3:
+                category = 'STAB'
+                description = 'stable'
+            elif mu > expected_return / 2 and sigma >= volatility_max / 2:
+                category = 'XBULL'
+                description = 'volatile bullish'
+            elif mu < -expected_return / 2 and sigma >= volatility_max / 2:
+                category = 'XBEAR'
+                description = 'volatile bearish'
+            else:
+                category = 'NEUT'
+                description = 'neutral'
+            
+            # Generate a crypto name based on the category
+            symbol = f"{category}{i+1}"
+            
+            market_conditions[symbol] = {'description': description, 'mu': mu, 'sigma': sigma, 'S0': S0}
+    else:
+        raise ValueError("Invalid mode. Please use 'training' or 'testing'.")
+
+    return market_conditions
+
+# Reductions of the 1s volumes of a candle
+VOLUME_AGGREGATIONS = {
+    'max': np.max,  # Captures spikes, what the synthetic data has always used
+    'sum': np.sum,  # Traded volume of the candle, as reported by exchanges
+}
+
+def resample_ohlcv(data, interval, volume='max'):
+    """
+    Aggregate OHLCV candles into candles of a longer interval.
+
+    The candles are reshaped into (candles, k, ...) blocks of k = interval seconds and every
+    field is an axis reduction over the blocks, the last candle aggregating the ragged tail.
+
+    :param data: Array of shape (N, 5) or (N, symbols, 5) of 1s open, high, low, close, volume.
+    :param interval: Interval string like '1h', or the number of candles per resampled candle.
+    :param volume: Aggregation of the volume, a key of VOLUME_AGGREGATIONS or a reduction
+        taking an array and an axis like np.sum.
+    :return: Array of shape (ceil(N / k), 5) or (ceil(N / k), symbols, 5).
+    """
+    k = convert_interval_to_seconds(interval) if isinstance(interval, str) else int(interval)
+    reduce_volume = VOLUME_AGGREGATIONS.get(volume, volume)
+    if not callable(reduce_volume):
+        raise ValueError(f"Unsupported volume aggregation: {volume}")
+
+    data = np.asarray(data)
+    num_full = len(data) // k
+    blocks = [data[:num_full * k].reshape((num_full, k) + data.shape[1:])]
+    if len(data) > num_full * k:
+        blocks.append(data[num_full * k:][np.newaxis])
+
+    resampled = np.empty((num_full + len(blocks) - 1,) + data.shape[1:], dtype=data.dtype)
+    start = 0
+    for block in blocks:
+        rows = resampled[start:start + len(block)]
+        rows[..., 0] = block[:, 0, ..., 0]  # Open of the first candle
+        rows[..., 1] = block[..., 1].max(axis=1)  # Highest high
+        rows[..., 2] = block[..., 2].min(axis=1)  # Lowest low
+        rows[..., 3] = block[:, -1, ..., 3]  # Close of the last candle
+        rows[..., 4] = reduce_volume(block[..., 4], axis=1)
+        start += len(block)
+    return resampled
+
+def pick_interval_data(data, interval, volume='max'):
+    # Same candles as resample_ohlcv, kept for the callers of the per symbol version
+    return resample_ohlcv(data, interval, volume), None
 
 def resample_timestamps(timestamps, interval):
     # Convert interval to seconds
     interval_seconds = convert_interval_to_seconds(interval)
     
-    # Resample timestamps by picking every interval_seconds-th timestamp
-    return [timestamps[i] for i in range(0, len(timestamps), interval_seconds)]
+    # Open time of every resampled candle, a slice of a list, array or DatetimeIndex
+    return timestamps[::interval_seconds]
 
 def convert_interval_to_seconds(interval):
     # Convert interval string to seconds
@@ -184,22 +439,24 @@ def convert_interval_to_seconds(interval):
     else:
         raise ValueError("Unsupported interval format")
 
-def generate_gbm_prices(S0, mu, sigma, T, dt):
+def generate_gbm_prices(S0, mu, sigma, T, dt, rng=None):
     """
     Generate prices using the Geometric Brownian Motion model.
+
+    The log-returns of all steps are drawn at once and cumulated, instead of a loop over steps.
     
     :param S0: Initial stock price
     :param mu: Expected return
     :param sigma: Volatility
     :param T: Total time
     :param dt: Time step
+    :param rng: np.random.Generator drawing the shocks, or a seed for one
     :return: Arrays of open, high, low, close prices
     """
+    rng = np.random.default_rng(rng)
     N = int(T / dt)  # Number of time steps
-    prices = np.zeros(N)
-    prices[0] = S0
-    for t in range(1, N):
-        prices[t] = prices[t-1] * np.exp((mu - 0.5 * sigma**2) * dt + sigma * np.sqrt(dt) * np.random.normal())
+    log_returns = generate_gbm_log_returns(mu, sigma, dt, N - 1, rng)
+    prices = S0 * np.exp(np.concatenate(([0.0], np.cumsum(log_returns))))
     
     # For simplicity, let's assume open, high, low, close are the same
     open_prices = prices
@@ -209,7 +466,164 @@ def generate_gbm_prices(S0, mu, sigma, T, dt):
     
     return open_prices, high_prices, low_prices, close_prices
 
-def generate_realistic_volumes(N, mu=7, sigma=0.5, theta=0.1, long_term_mean=1000, intra_volatility=None):
+def generate_gbm_log_returns(mu, sigma, dt, N, rng):
+    """
+    Draw the log-returns of N steps of a Geometric Brownian Motion.
+
+    :param mu: Expected return
+    :param sigma: Volatility
+    :param dt: Time step
+    :param N: Number of steps
+    :param rng: np.random.Generator drawing the shocks
+    :return: Array of N log-returns
+    """
+    return (mu - 0.5 * sigma**2) * dt + sigma * np.sqrt(dt) * rng.standard_normal(N)
+
+def generate_regime_path(N, transition_matrix, rng, initial_regime=None):
+    """
+    Simulate the regimes of a Markov chain over N steps.
+
+    The chain stays in a regime for a geometric number of steps of parameter one minus the
+    probability to stay, then moves to one of the other regimes in proportion to their
+    transition probabilities, so the loop runs once per regime change instead of per step.
+
+    :param N: Number of steps
+    :param transition_matrix: Array of shape (regimes, regimes) of the per step transition probabilities
+    :param rng: np.random.Generator drawing the regimes
+    :param initial_regime: Regime of the first step, drawn uniformly when None
+    :return: Array of N regime indices
+    """
+    transition_matrix = np.asarray(transition_matrix, dtype=np.float64)
+    num_regimes = len(transition_matrix)
+    regime = rng.integers(num_regimes) if initial_regime is None else initial_regime
+    path = np.empty(N, dtype=np.int64)
+    step = 0
+    while step < N:
+        leave = 1 - transition_matrix[regime, regime]
+        duration = rng.geometric(leave) if leave > 0 else N
+        path[step:step + duration] = regime
+        step += duration
+        if leave > 0:
+            others = transition_matrix[regime].copy()
+            others[regime] = 0
+            regime = rng.choice(num_regimes, p=others / others.sum())
+    return path
+
+def generate_regime_switching_market(num_symbols, N, dt, rng, regimes, transition_matrix=None, mean_regime_duration=1.0, correlation=0.5, jump_intensity=2.0, jump_mean=0.0, jump_std=0.02, S0=None):
+    """
+    Generate the 1s candles of correlated symbols in a market switching between regimes.
+
+    Every step draws the shocks of all symbols at once, correlated through the Cholesky
+    factor of the correlation matrix. The drift and volatility follow the regime of the
+    market, a Markov chain shared by the symbols, each symbol scaling the volatility by its
+    own factor. Poisson jumps of normal log sizes are added, their mean being taken out of
+    the drift (Merton jump-diffusion). The high and low of a candle are the extremes of a
+    Brownian bridge between its open and close, drawn from their exact distribution.
+
+    :param num_symbols: Number of symbols
+    :param N: Number of time steps
+    :param dt: Time step, in days like the regime parameters
+    :param rng: np.random.Generator drawing everything
+    :param regimes: Dictionary of the 'mu' and 'sigma' of every regime, like generate_market_conditions
+    :param transition_matrix: Array of shape (regimes, regimes) of the per step transition
+        probabilities, when None the regimes last mean_regime_duration days on average and
+        are followed by any other regime with the same probability
+    :param mean_regime_duration: Mean duration of a regime in days, for the default transitions
+    :param correlation: Correlation of the shocks of two symbols, or a correlation matrix
+    :param jump_intensity: Expected number of jumps per day
+    :param jump_mean: Mean of the log size of a jump
+    :param jump_std: Standard deviation of the log size of a jump
+    :param S0: Initial prices of the symbols, drawn between 1 and 100 when None
+    :return: Array of shape (N, symbols, 5) of open, high, low, close, volume and the array of N regimes
+    """
+    # The whole market as a single chunk
+    return next(generate_regime_switching_chunks(num_symbols, N, dt, rng, regimes, N, transition_matrix, mean_regime_duration, correlation, jump_intensity, jump_mean, jump_std, S0))
+
+def generate_regime_switching_chunks(num_symbols, N, dt, rng, regimes, chunk_size, transition_matrix=None, mean_regime_duration=1.0, correlation=0.5, jump_intensity=2.0, jump_mean=0.0, jump_std=0.02, S0=None):
+    """
+    Generate the candles of generate_regime_switching_market a chunk of steps at a time.
+
+    A chunk starts from the close and the regime of the previous one. The time spent in a
+    regime is geometric, so restarting the chain in the regime of the last step does not
+    change the law of the market, and the memory holds one chunk instead of N steps.
+
+    :param chunk_size: Number of steps of a chunk, the last chunk may be shorter.
+    :return: Generator of the (data, regime_path) of every chunk, see generate_regime_switching_market.
+    """
+    mus = np.array([params['mu'] for params in regimes.values()])
+    sigmas = np.array([params['sigma'] for params in regimes.values()])
+    num_regimes = len(regimes)
+    if transition_matrix is None:
+        stay = np.exp(-dt / mean_regime_duration) if num_regimes > 1 else 1.0
+        transition_matrix = np.full((num_regimes, num_regimes), (1 - stay) / max(num_regimes - 1, 1))
+        np.fill_diagonal(transition_matrix, stay)
+
+    if np.isscalar(correlation):
+        correlation = np.full((num_symbols, num_symbols), correlation)
+        np.fill_diagonal(correlation, 1.0)
+    cholesky = np.linalg.cholesky(correlation)
+    S0 = rng.uniform(1, 100, num_symbols).round(2) if S0 is None else np.asarray(S0, dtype=np.float64)
+    volatility_scales = rng.uniform(0.5, 1.5, num_symbols)
+    jump_compensation = jump_intensity * (np.exp(jump_mean + 0.5 * jump_std**2) - 1)
+
+    last_log_close = np.log(S0)
+    regime = None
+    for chunk_start in range(0, N, chunk_size):
+        size = min(chunk_size, N - chunk_start)
+        regime_path = generate_regime_path(size, transition_matrix, rng, initial_regime=regime)
+        regime = regime_path[-1]
+
+        # Drift and volatility of every step and symbol
+        sigma = sigmas[regime_path][:, np.newaxis] * volatility_scales
+        drift = (mus[regime_path][:, np.newaxis] - 0.5 * sigma**2 - jump_compensation) * dt
+
+        shocks = rng.standard_normal((size, num_symbols)) @ cholesky.T
+        log_returns = drift + sigma * np.sqrt(dt) * shocks
+        jumps = rng.poisson(jump_intensity * dt, (size, num_symbols))
+        jumped = jumps > 0
+        log_returns[jumped] += jump_mean * jumps[jumped] + jump_std * np.sqrt(jumps[jumped]) * rng.standard_normal(jumped.sum())
+
+        log_close = last_log_close + np.cumsum(log_returns, axis=0)
+        log_open = np.concatenate((last_log_close[np.newaxis], log_close[:-1]))
+        last_log_close = log_close[-1]
+
+        # Extremes of a Brownian bridge from 0 to the return: P(max > m) = exp(-2m(m - b) / v)
+        variance = sigma**2 * dt
+        high_excursion = np.sqrt(log_returns**2 - 2 * variance * np.log(rng.random((size, num_symbols))))
+        low_excursion = np.sqrt(log_returns**2 - 2 * variance * np.log(rng.random((size, num_symbols))))
+        log_high = log_open + 0.5 * (log_returns + high_excursion)
+        log_low = log_open + 0.5 * (log_returns - low_excursion)
+
+        intra_volatility = np.abs(np.expm1(log_returns))
+        volumes = generate_realistic_volumes(size * num_symbols, mu=7, sigma=0.5, theta=0.1, long_term_mean=1000, intra_volatility=intra_volatility.ravel(), rng=rng).reshape(size, num_symbols)
+
+        data = np.stack((np.exp(log_open), np.exp(log_high), np.exp(log_low), np.exp(log_close), volumes), axis=-1)
+        yield data, regime_path
+
+def generate_ou_process(N, theta, long_term_mean, sigma, x0=None, rng=None):
+    """
+    Generate a mean-reverting Ornstein-Uhlenbeck process in discrete time,
+    x[t] = x[t-1] + theta * (long_term_mean - x[t-1]) + sigma * e[t].
+
+    The deviation from the mean is an AR(1) recursion, run by scipy.signal.lfilter in one pass.
+
+    :param N: Number of time steps
+    :param theta: Mean-reversion speed
+    :param long_term_mean: Long-term mean
+    :param sigma: Standard deviation of the shocks
+    :param x0: Initial value, the long-term mean when None
+    :param rng: np.random.Generator drawing the shocks, or a seed for one
+    :return: Array of N values
+    """
+    rng = np.random.default_rng(rng)
+    x0 = long_term_mean if x0 is None else x0
+    deviations = np.empty(N)
+    deviations[:1] = x0 - long_term_mean
+    if N > 1:
+        deviations[1:] = lfilter([sigma], [1.0, -(1 - theta)], rng.standard_normal(N - 1), zi=[(1 - theta) * deviations[0]])[0]
+    return long_term_mean + deviations
+
+def generate_realistic_volumes(N, mu=7, sigma=0.5, theta=0.1, long_term_mean=1000, intra_volatility=None, rng=None):
     """
     Generate realistic trading volumes using different models.
     
@@ -219,27 +633,27 @@ def generate_realistic_volumes(N, mu=7, sigma=0.5, theta=0.1, long_term_mean=100
     :param theta: Mean-reversion speed for OU process
     :param long_term_mean: Long-term mean for OU process
     :param intra_volatility: Array of intra-candle volatilities
+    :param rng: np.random.Generator drawing the volumes, or a seed for one
     :return: Array of volumes
     """
+    rng = np.random.default_rng(rng)
+
     # Log-Normal Distribution
-    log_normal_volumes = np.exp(mu + sigma * np.random.normal(size=N))
+    log_normal_volumes = np.exp(mu + sigma * rng.standard_normal(N))
     
     # Mean-Reverting Process (Ornstein-Uhlenbeck)
-    ou_volumes = np.zeros(N)
-    ou_volumes[0] = long_term_mean
-    for t in range(1, N):
-        ou_volumes[t] = ou_volumes[t-1] + theta * (long_term_mean - ou_volumes[t-1]) + sigma * np.random.normal()
+    ou_volumes = generate_ou_process(N, theta, long_term_mean, sigma, rng=rng)
     
     # Volume-Volatility Coupling (example with log-normal)
     # Assuming sigma_t is the simulated price volatility
-    sigma_t = np.random.uniform(0.1, 0.5, N)  # Example volatility
-    coupled_volumes = np.exp(mu + sigma_t * np.random.normal(size=N))
+    sigma_t = rng.uniform(0.1, 0.5, N)  # Example volatility
+    coupled_volumes = np.exp(mu + sigma_t * rng.standard_normal(N))
     
     # Check if intra_volatility is iterable
     if intra_volatility is not None:
         if isinstance(intra_volatility, (list, np.ndarray)):
             # Increase volume where intra-candle volatility is high
-            volume_spike_factor = 1 + 20 * intra_volatility  # Further increase the spike factor
+            volume_spike_factor = 1 + 20 * np.asarray(intra_volatility)  # Further increase the spike factor
             coupled_volumes *= volume_spike_factor
 
             # Debugging: Print some values
@@ -249,13 +663,13 @@ def generate_realistic_volumes(N, mu=7, sigma=0.5, theta=0.1, long_term_mean=100
 
     # Alternative method: Add random spikes
     num_spikes = int(0.01 * N)  # 1% of the data points will have spikes
-    spike_indices = np.random.choice(N, num_spikes, replace=False)
+    spike_indices = rng.choice(N, num_spikes, replace=False)
     
     # Adjust the spike factor 
-    spike_factor = np.random.uniform(2, 5, size=num_spikes)
+    spike_factor = rng.uniform(2, 5, size=num_spikes)
     coupled_volumes[spike_indices] *= spike_factor  # Apply the spike factor
 
     # Ensure no negative volumes
     volumes = np.maximum(coupled_volumes, 0)
 
-    return volumes
\ No newline at end of file
+    return volumes
@@ -1,3 +1,9 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import tracemalloc
 import unittest
 import numpy as np
 import pandas as pd
@@ -30,6 +36,153 @@ class TestSyntheticData(unittest.TestCase):
         self.assertEqual(len(volumes), N, "Volume array length should match the number of time steps")
         self.assertTrue(all(volume > 0 for volume in volumes), "All volumes should be positive")
 
+    def test_vectorized_gbm_matches_recursion(self):
+        from synthetic import generate_gbm_prices
+
+        S0, mu, sigma, T, dt = 100, 0.05, 0.2, 1, 1 / (24 * 60)
+        close_prices = generate_gbm_prices(S0, mu, sigma, T, dt, rng=np.random.default_rng(7))[3]
+        shocks = np.random.default_rng(7).standard_normal(len(close_prices) - 1)
+        prices = [S0]
+        for shock in shocks:
+            prices.append(prices[-1] * np.exp((mu - 0.5 * sigma**2) * dt + sigma * np.sqrt(dt) * shock))
+        np.testing.assert_allclose(close_prices, prices, rtol=1e-10)
+
+    def test_vectorized_ou_matches_recursion(self):
+        from synthetic import generate_ou_process
+
+        N, theta, long_term_mean, sigma = 1000, 0.1, 1000, 0.5
+        values = generate_ou_process(N, theta, long_term_mean, sigma, x0=990, rng=np.random.default_rng(3))
+        shocks = np.random.default_rng(3).standard_normal(N - 1)
+        expected = [990]
+        for shock in shocks:
+            expected.append(expected[-1] + theta * (long_term_mean - expected[-1]) + sigma * shock)
+        np.testing.assert_allclose(values, expected, rtol=1e-12)
+
+    def test_seeded_generation_is_reproducible(self):
+        from synthetic import generate_realistic_volumes
+
+        # 10 days of 1s steps
+        started = time.perf_counter()
+        volumes = generate_realistic_volumes(10 * 24 * 60 * 60, rng=np.random.default_rng(1))
+        logging.info(f"Generated {len(volumes)} volumes in {time.perf_counter() - started:.2f}s")
+        np.testing.assert_array_equal(volumes, generate_realistic_volumes(10 * 24 * 60 * 60, rng=np.random.default_rng(1)))
+        self.assertFalse(np.array_equal(volumes, generate_realistic_volumes(10 * 24 * 60 * 60, rng=np.random.default_rng(2))))
+
+    def test_resample_ohlcv(self):
+        from synthetic import resample_ohlcv, resample_timestamps
+
+        def resample_loop(data, k, volume):
+            # The chunk by chunk loop pick_interval_data used to run
+            candles = []
+            for start in range(0, len(data), k):
+                chunk = data[start:start + k]
+                candles.append([chunk[0, 0], chunk[:, 1].max(), chunk[:, 2].min(), chunk[-1, 3], volume(chunk[:, 4])])
+            return np.array(candles)
+
+        rng = np.random.default_rng(5)
+        # 2 days and a ragged half hour of 1s candles for 4 symbols
+        data = rng.uniform(1, 100, size=(2 * 24 * 60 * 60 + 1800, 4, 5))
+        started = time.perf_counter()
+        resampled = resample_ohlcv(data, '1h', volume='sum')
+        logging.info(f"Resampled {data.shape} in {time.perf_counter() - started:.3f}s")
+        self.assertEqual(resampled.shape, (49, 4, 5))
+        for symbol in range(4):
+            np.testing.assert_allclose(resampled[:, symbol], resample_loop(data[:, symbol], 3600, np.sum), rtol=1e-12)
+            np.testing.assert_array_equal(resample_ohlcv(data[:, symbol], 3600), resample_loop(data[:, symbol], 3600, np.max))
+
+        timestamps = pd.date_range('2024-01-01', periods=len(data), freq='1s')
+        pd.testing.assert_index_equal(resample_timestamps(timestamps, '1h'), pd.date_range('2024-01-01', periods=49, freq='1h'))
+        with self.assertRaises(ValueError):
+            resample_ohlcv(data, '1h', volume='mean')
+
+    def test_regime_path_follows_transitions(self):
+        from synthetic import generate_regime_path
+
+        # Every regime can only move to the next one
+        transition_matrix = np.array([[0.99, 0.01, 0.0], [0.0, 0.98, 0.02], [0.05, 0.0, 0.95]])
+        path = generate_regime_path(200000, transition_matrix, np.random.default_rng(0), initial_regime=0)
+        changes = np.flatnonzero(np.diff(path))
+        np.testing.assert_array_equal(path[changes + 1], (path[changes] + 1) % 3)
+        # Mean durations of 1 / (1 - stay) steps
+        durations = np.diff(changes)
+        for regime, expected in enumerate([100, 50, 20]):
+            self.assertAlmostEqual(durations[path[changes[:-1] + 1] == regime].mean() / expected, 1, delta=0.1)
+
+    def test_regime_switching_market(self):
+        from synthetic import generate_market_conditions, generate_regime_switching_market
+
+        rng = np.random.default_rng(8)
+        regimes = generate_market_conditions('training', rng)
+        dt = 1 / (24 * 60 * 60)
+        N = 2 * 24 * 60 * 60  # 2 days
+        started = time.perf_counter()
+        data, regime_path = generate_regime_switching_market(6, N, dt, rng, regimes, mean_regime_duration=0.25, correlation=0.6, jump_intensity=0)
+        logging.info(f"Generated {data.shape} in {time.perf_counter() - started:.2f}s")
+
+        self.assertEqual(data.shape, (N, 6, 5))
+        self.assertTrue((data > 0).all())
+        open_prices, high_prices, low_prices, close_prices = (data[..., column] for column in range(4))
+        np.testing.assert_array_equal(open_prices[1:], close_prices[:-1])
+        self.assertTrue((high_prices >= np.maximum(open_prices, close_prices)).all())
+        self.assertTrue((low_prices <= np.minimum(open_prices, close_prices)).all())
+        self.assertTrue((high_prices > low_prices).all())
+        self.assertGreater(len(np.unique(regime_path)), 1)
+
+        # Correlated shocks
+        correlations = np.corrcoef(np.diff(np.log(close_prices), axis=0).T)
+        np.testing.assert_allclose(correlations[np.triu_indices(6, 1)], 0.6, atol=0.02)
+
+        # Jumps fatten the tails of the returns
+        data, _ = generate_regime_switching_market(2, N, dt, np.random.default_rng(8), regimes, jump_intensity=200, jump_std=0.01)
+        log_returns = np.diff(np.log(data[:, :, 3]), axis=0)
+        standardized = (log_returns - log_returns.mean(axis=0)) / log_returns.std(axis=0)
+        self.assertTrue(((standardized**4).mean(axis=0) > 5).all())
+
+    def test_create_regime_switching_data(self):
+        from synthetic import create_regime_switching_data
+
+        results = [create_regime_switching_data(2, '1h', 4, seed=9, start_time='2024-01-01') for _ in range(2)]
+        resampled_data_matrix, full_data_matrix, resampled_timestamps, mapping, valid_symbols, market_conditions = results[0]
+        self.assertEqual(resampled_data_matrix.shape, (48, 4, 5))
+        self.assertEqual(len(resampled_timestamps), 48)
+        self.assertEqual(len(full_data_matrix), 4)
+        self.assertEqual(list(market_conditions), valid_symbols)
+        np.testing.assert_array_equal(resampled_data_matrix, results[1][0])
+        # The candles aggregate the 1s candles of the symbol
+        first = full_data_matrix[0].loc[resampled_timestamps[0]:resampled_timestamps[1] - pd.Timedelta('1s')]
+        self.assertEqual(len(first), 3600)
+        self.assertEqual(resampled_data_matrix[0, 0, mapping['high']], first['high'].max())
+
+    def test_stream_regime_switching_data(self):
+        from synthetic import create_regime_switching_data, stream_regime_switching_data
+        from market_store import MarketStore
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = MarketStore(directory)
+        limit, num_symbols = 8, 4  # 8 days of 4 symbols
+
+        tracemalloc.start()
+        data_matrix, timestamps, mapping, valid_symbols, market_conditions = stream_regime_switching_data(store, limit, '1h', num_symbols, seed=9, start_time='2024-01-01')
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        full_size = limit * 24 * 60 * 60 * num_symbols * 5 * 8
+        logging.info(f"Peak memory {peak / 2**20:.1f}MB, whole 1s series {full_size / 2**20:.1f}MB")
+        self.assertLess(peak, full_size / 4)
+
+        # The same market as the one generated in memory
+        resampled_data_matrix, full_data_matrix, resampled_timestamps, _, symbols, conditions = create_regime_switching_data(limit, '1h', num_symbols, seed=9, start_time='2024-01-01')
+        np.testing.assert_array_equal(data_matrix, resampled_data_matrix)
+        np.testing.assert_array_equal(timestamps, resampled_timestamps)
+        self.assertEqual((valid_symbols, market_conditions), (symbols, conditions))
+        for index, symbol in enumerate(valid_symbols):
+            self.assertEqual(len(store.days(symbol)), limit)
+            candles = store.read(symbol, timestamps[0], timestamps[-1])
+            np.testing.assert_array_equal(candles['timestamp'], full_data_matrix[index].index.asi8)
+            np.testing.assert_array_equal(candles['close'], full_data_matrix[index]['close'])
+            # Every day opens at the close of the day before
+            np.testing.assert_array_equal(candles['open'][1:], candles['close'][:-1])
+
     def test_create_synthetic_data(self):
         from synthetic import create_synthetic_data
         
@@ -42,6 +195,69 @@ class TestSyntheticData(unittest.TestCase):
         self.assertGreater(len(valid_symbols), 0, "There should be valid symbols generated")
         self.assertGreater(len(market_conditions), 0, "Market conditions should not be empty")
 
+    def test_stream_synthetic_data(self):
+        from synthetic import pick_interval_data, stream_synthetic_data
+        from market_store import MarketStore
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = MarketStore(os.path.join(directory, 'first'))
+        limit = 3  # 3 days
+
+        tracemalloc.start()
+        data_matrix, timestamps, mapping, valid_symbols, market_conditions = stream_synthetic_data(store, limit, '1h', 'training', seed=4, start_time='2024-01-01 13:00')
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        full_size = limit * 24 * 60 * 60 * len(valid_symbols) * 5 * 8
+        logging.info(f"Peak memory {peak / 2**20:.1f}MB, whole 1s series {full_size / 2**20:.1f}MB")
+        self.assertLess(peak, full_size / 4)
+
+        self.assertEqual(data_matrix.shape, (limit * 24, len(valid_symbols), 5))
+        self.assertEqual(timestamps[0], pd.Timestamp('2024-01-01'))
+        self.assertTrue((np.diff(timestamps.asi8) == 3600 * 10**9).all())
+        for index, symbol in enumerate(valid_symbols):
+            self.assertEqual(len(store.days(symbol)), limit)
+            candles = store.read(symbol, timestamps[0], timestamps[-1])
+            np.testing.assert_array_equal(np.diff(candles['timestamp']), 10**9)
+            self.assertEqual(candles['timestamp'][0], timestamps[0].value)
+            # The candles are the resampled 1s candles of the store
+            ohlcv = np.column_stack([candles[field] for field in ['open', 'high', 'low', 'close', 'volume']])
+            np.testing.assert_allclose(pick_interval_data(ohlcv, '1h')[0], data_matrix[:, index], rtol=1e-6)
+            # The price continues from a day to the next
+            self.assertTrue((np.abs(np.diff(np.log(candles['close'].astype(np.float64)))) < 0.01).all())
+
+        again = stream_synthetic_data(MarketStore(os.path.join(directory, 'second')), limit, '1h', 'training', seed=4, start_time='2024-01-01')
+        np.testing.assert_array_equal(again[0], data_matrix)
+
+    def test_streamed_runs_use_their_own_store(self):
+        import gc
+        from parameters import selected_params, training_params
+        from utilities import initialize_environments
+
+        # Two runs of one process with different data, as the optimizer trials are
+        roots = []
+        for seed in [1, 2]:
+            financial = dict(selected_params, market_data='synthetic', synth_mode='training', limit=2, interval='1h', basic_risk_mgmt=False, synth_stream=True)
+            before = dict(financial)
+            _, _, env, agent, _ = initialize_environments(financial, dict(training_params, train_model=False, seed=seed))
+            # The run keeps its store and symbols in parameters of its own
+            self.assertEqual(financial, before)
+            self.assertNotIn('market_store_path', financial)
+            provider = env.intrabar_index.provider
+            roots.append(provider.store.root)
+            for index, symbol in enumerate(env.params['symbols']):
+                # The 1s candles of the first hour are the ones the candle was resampled from
+                candles = provider.window(symbol, env.timestamps[0] - 1, env.timestamps[1])
+                self.assertEqual(len(candles), 3600)
+                self.assertEqual(candles['high'].max(), env.data_matrix[0, index, env.mapping['high']])
+                self.assertEqual(candles['low'].min(), env.data_matrix[0, index, env.mapping['low']])
+            del env, agent, provider
+            gc.collect()
+            # The store of the run is removed with its environments
+            self.assertFalse(os.path.exists(roots[-1]))
+
+        self.assertNotEqual(roots[0], roots[1])
+
     def test_visualize_synthetic_data(self):
         from synthetic import create_synthetic_data
         from reporting import plot_symbol
@@ -52,11 +268,12 @@ class TestSyntheticData(unittest.TestCase):
         resampled_data_matrix, full_data_matrix, resampled_timestamps, mapping, valid_symbols, market_conditions = create_synthetic_data(limit, interval, 'training')
 
         # Visualize the first symbol's data using plot_symbol
+        save_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, save_path)
         for index, symbol in enumerate(valid_symbols):
             symbol_data = resampled_data_matrix[:, index, :]  # Directly use the numpy array
             trade_history = None  # Empty trade history for visualization
             title = 'Synthetic Data Visualization'
-            save_path = 'synthetic_data_visualization'
             plot_symbol(symbol, mapping, resampled_timestamps, symbol_data, trade_history, title, save_path)
 
 if __name__ == '__main__':
@@ -0,0 +1,197 @@
+import os
+import shutil
+import tempfile
+import weakref
+import numpy as np
+import pandas as pd
+
+class TradeLog:
+    """
+    Columnar, growable store of the closed trades of an environment.
+
+    Each field of a trade lives in a typed NumPy array: times are int64 epoch nanoseconds and
+    the symbol, type and exit reason are small integer codes into lists of categories. Trades
+    are appended a batch at a time and exported to pandas without copying the numeric columns.
+    Past spill_threshold trades in memory, the columns are written to .npz chunks on disk.
+
+    Indexing and iterating still give the trade dictionaries of the former list-based history.
+    """
+    COLUMNS = {
+        'episode': np.int32,
+        'open_time': np.int64,
+        'close_time': np.int64,
+        'symbol': np.int16,
+        'type': np.int8,
+        'entry_price': np.float64,
+        'exit_price': np.float64,
+        'position_size': np.float64,
+        'leverage': np.float64,
+        'collateral': np.float64,
+        'sl_price': np.float64,
+        'tp_price': np.float64,
+        'liq_price': np.float64,
+        'max_price': np.float64,
+        'exit_reason': np.int16,
+        'pnl': np.float64,
+        'return': np.float64,
+        'borrowing_fee': np.float64,
+        'balance': np.float64,
+        'risk_per_trade': np.float64,
+    }
+    TIME_COLUMNS = ('open_time', 'close_time')
+    TYPES = ['long', 'short']
+
+    def __init__(self, symbols, capacity=1024, spill_threshold=None, spill_dir=None):
+        self.symbols = list(symbols)
+        self.exit_reasons = []
+        self.exit_reason_codes = {}
+        self.capacity = capacity
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        self.size = 0
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir
+        self.chunks = []  # (path, length) of the trades spilled to disk, oldest first
+        self.num_spilled = 0
+        self.remove_spill_dir = None
+
+    def __len__(self):
+        return self.num_spilled + self.size
+
+    def exit_reason_code(self, reason):
+        if reason not in self.exit_reason_codes:
+            self.exit_reason_codes[reason] = len(self.exit_reasons)
+            self.exit_reasons.append(reason)
+        return self.exit_reason_codes[reason]
+
+    def append(self, symbol, side, exit_reason, **values):
+        """
+        Append a batch of trades.
+
+        :param symbol: Array of symbol indices.
+        :param side: Array of sides, 1 for long and -1 for short.
+        :param exit_reason: Sequence of exit reason names.
+        :param values: Arrays for the other columns, times in epoch nanoseconds.
+        """
+        unknown = values.keys() - self.COLUMNS.keys()
+        if unknown:
+            raise KeyError(f"Unknown trade columns: {sorted(unknown)}")
+        count = len(symbol)
+        if self.size + count > self.capacity:
+            self.capacity = max(2 * self.capacity, self.size + count)
+            for name, column in self.columns.items():
+                self.columns[name] = np.resize(column, self.capacity)
+
+        rows = slice(self.size, self.size + count)
+        self.columns['symbol'][rows] = symbol
+        self.columns['type'][rows] = np.asarray(side) == -1
+        self.columns['exit_reason'][rows] = [self.exit_reason_code(reason) for reason in exit_reason]
+        for name in self.COLUMNS.keys() - {'symbol', 'type', 'exit_reason'}:
+            # Columns missing from the batch are NaN, or 0 for the integer ones
+            self.columns[name][rows] = values.get(name, np.nan if self.columns[name].dtype.kind == 'f' else 0)
+        self.size += count
+
+        if self.spill_threshold and self.size >= self.spill_threshold:
+            self.spill()
+
+    def spill(self):
+        """Write the trades held in memory to a chunk on disk and empty the buffers."""
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='trade_log_')
+            # The directory created by the log goes with it, even when close is never called
+            self.remove_spill_dir = weakref.finalize(self, shutil.rmtree, self.spill_dir, ignore_errors=True)
+        path = os.path.join(self.spill_dir, f'trades_{len(self.chunks):06d}.npz')
+        np.savez(path, **{name: column[:self.size] for name, column in self.columns.items()})
+        self.chunks.append((path, self.size))
+        self.num_spilled += self.size
+        self.size = 0
+
+    def load_chunk(self, path):
+        with np.load(path) as chunk:
+            return {name: chunk[name] for name in self.COLUMNS}
+
+    def column_blocks(self):
+        """Yield (columns, length) for every spilled chunk, then for the trades in memory."""
+        for path, length in self.chunks:
+            yield self.load_chunk(path), length
+        yield self.columns, self.size
+
+    def categories(self, name):
+        return {'symbol': self.symbols, 'type': self.TYPES, 'exit_reason': self.exit_reasons}[name]
+
+    def to_dataframe(self, categorical=True):
+        """
+        Export the trades to a DataFrame.
+
+        The numeric and time columns of the trades in memory are views of the log buffers, so
+        the frame must be treated as read-only and is only valid until the next append.
+
+        :param categorical: Whether symbol, type and exit reason are pandas categoricals, or
+            plain object columns as in the former list-based history.
+        :return: DataFrame with one row per trade.
+        """
+        blocks = list(self.column_blocks())
+        if len(blocks) > 1:
+            columns = {name: np.concatenate([block[name][:length] for block, length in blocks]) for name in self.COLUMNS}
+            length = len(self)
+        else:
+            columns, length = blocks[0]
+
+        data = {}
+        for name in self.COLUMNS:
+            values = columns[name][:length]
+            if name in self.TIME_COLUMNS:
+                values = values.view('datetime64[ns]')
+            elif name in ('symbol', 'type', 'exit_reason'):
+                categories = self.categories(name)
+                if categorical:
+                    values = pd.Categorical.from_codes(values, categories=categories)
+                else:
+                    values = np.asarray(categories, dtype=object)[values]
+            data[name] = values
+        return pd.DataFrame(data, copy=False)
+
+    def record(self, columns, row):
+        """Trade dictionary of one row of a block of columns."""
+        trade = {}
+        for name in self.COLUMNS:
+            value = columns[name][row]
+            if name in self.TIME_COLUMNS:
+                value = pd.Timestamp(value)
+            elif name in ('symbol', 'type', 'exit_reason'):
+                value = self.categories(name)[value]
+            trade[name] = value
+        return trade
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("trade index out of range")
+        # Only the chunk holding the trade is read from disk
+        for path, length in self.chunks:
+            if index < length:
+                return self.record(self.load_chunk(path), index)
+            index -= length
+        return self.record(self.columns, index)
+
+    def __iter__(self):
+        for columns, length in self.column_blocks():
+            for row in range(length):
+                yield self.record(columns, row)
+
+    def __repr__(self):
+        return f"TradeLog({len(self)} trades)"
+
+    def close(self):
+        """Remove the chunks spilled to disk, and the directory when the log created it."""
+        for path, _ in self.chunks:
+            if os.path.exists(path):
+                os.remove(path)
+        self.chunks = []
+        self.num_spilled = 0
+        if self.remove_spill_dir is not None:
+            self.remove_spill_dir()
+            self.remove_spill_dir = None
+            self.spill_dir = None
@@ -0,0 +1,79 @@
+import os
+import gc
+import unittest
+import numpy as np
+import pandas as pd
+from trade_log import TradeLog
+
+def make_trades(count, offset=0):
+    symbol = np.arange(count) % 2
+    return {
+        'symbol': symbol,
+        'side': np.where(symbol == 0, 1, -1),
+        'exit_reason': np.array(['tp', 'sl', 'close'] * count, dtype=object)[:count],
+        'episode': np.ones(count, dtype=int),
+        'open_time': pd.date_range('2024-01-01', periods=count, freq='1h').asi8,
+        'close_time': pd.date_range('2024-01-01 00:30', periods=count, freq='1h').asi8,
+        'pnl': np.arange(offset, offset + count, dtype=float),
+    }
+
+class TestTradeLog(unittest.TestCase):
+
+    def test_record_view(self):
+        log = TradeLog(['BTC', 'ETH'], capacity=2)
+        log.append(**make_trades(5))
+        self.assertEqual(len(log), 5)
+        trade = log[-1]
+        self.assertEqual(trade['symbol'], 'BTC')
+        self.assertEqual(trade['type'], 'long')
+        self.assertEqual(trade['exit_reason'], 'sl')
+        self.assertEqual(trade['open_time'], pd.Timestamp('2024-01-01 04:00'))
+        self.assertEqual([t['pnl'] for t in log[1:3]], [1.0, 2.0])
+
+    def test_dataframe_export(self):
+        log = TradeLog(['BTC', 'ETH'])
+        log.append(**make_trades(4))
+        df = log.to_dataframe()
+        self.assertTrue(np.shares_memory(df['pnl'].to_numpy(), log.columns['pnl']))
+        self.assertEqual(df['close_time'].iloc[1], pd.Timestamp('2024-01-01 01:30'))
+        self.assertEqual(list(df['symbol'].cat.categories), ['BTC', 'ETH'])
+        self.assertEqual(log.to_dataframe(categorical=False)['type'].tolist(), ['long', 'short', 'long', 'short'])
+
+    def test_spill_to_disk(self):
+        log = TradeLog(['BTC', 'ETH'], spill_threshold=3)
+        log.append(**make_trades(3))
+        log.append(**make_trades(2, offset=3))
+        self.assertEqual(len(log.chunks), 1)
+        self.assertEqual(len(log), 5)
+        self.assertEqual(log.to_dataframe()['pnl'].tolist(), [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(log[2]['exit_reason'], 'close')
+        self.assertEqual([t['pnl'] for t in log], [0.0, 1.0, 2.0, 3.0, 4.0])
+        spill_dir = log.spill_dir
+        log.close()
+        self.assertEqual(len(log), 2)
+        self.assertFalse(os.path.exists(spill_dir))
+
+        # The directory of a log that is never closed is removed with the log
+        log = TradeLog(['BTC', 'ETH'], spill_threshold=3)
+        log.append(**make_trades(3))
+        spill_dir = log.spill_dir
+        self.assertTrue(os.path.exists(spill_dir))
+        del log
+        gc.collect()
+        self.assertFalse(os.path.exists(spill_dir))
+
+    def test_missing_columns_are_filled(self):
+        log = TradeLog(['BTC', 'ETH'], capacity=8)
+        # Garbage left in the buffers by a previous use
+        for column in log.columns.values():
+            column.fill(7)
+        log.append(**make_trades(3))
+        df = log.to_dataframe()
+        self.assertTrue(df['leverage'].isna().all())
+        self.assertTrue(df['entry_price'].isna().all())
+        self.assertEqual(df['pnl'].tolist(), [0.0, 1.0, 2.0])
+        with self.assertRaises(KeyError):
+            log.append(**make_trades(1), unknown=np.zeros(1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,8 +5,10 @@ import time
 import logging
 import numpy as np
 from time import sleep
-
-import ta
+from functools import partial
+from kline_cache import default_kline_cache
+from kline_fetcher import BINANCE_API_URL, KlineFetcher
+from indicators import add_indicators
 
 import warnings
 
@@ -27,66 +29,12 @@ ACTIONS_AVAILABLE = {
 
 def add_technical_indicators(df_original):
     logging.debug("Adding technical indicators")
-    df = df_original.copy()
-    df['ema_short'] = ta.trend.EMAIndicator(close=df['close'], window=12).ema_indicator()
-    df['ema_long'] = ta.trend.EMAIndicator(close=df['close'], window=26).ema_indicator()
-    df['rsi'] = ta.momentum.RSIIndicator(close=df['close'], window=14).rsi()
-    macd = ta.trend.MACD(close=df['close'])
-    df['macd'] = macd.macd()
-    df['macd_signal'] = macd.macd_signal()
-    df['macd_hist'] = macd.macd_diff()
-    df['boll_hband'] = ta.volatility.BollingerBands(close=df['close']).bollinger_hband()
-    df['boll_mband'] = ta.volatility.BollingerBands(close=df['close']).bollinger_mavg()
-    df['boll_lband'] = ta.volatility.BollingerBands(close=df['close']).bollinger_lband()
-    df['atr'] = ta.volatility.AverageTrueRange(high=df['high'], low=df['low'], close=df['close'], window=14).average_true_range()
-    
-    # Add DMI and ADX
-    dmi = ta.trend.ADXIndicator(high=df['high'], low=df['low'], close=df['close'], window=14)
-    df['adx'] = dmi.adx()
-    df['adx_neg'] = dmi.adx_neg()
-    df['adx_pos'] = dmi.adx_pos()
-    
-    df['obv'] = ta.volume.OnBalanceVolumeIndicator(close=df['close'], volume=df['volume']).on_balance_volume()
-    df['vwap'] = ta.volume.VolumeWeightedAveragePrice(high=df['high'], low=df['low'], close=df['close'], volume=df['volume']).volume_weighted_average_price()
-    
-    df['parabolic_sar'] = ta.trend.PSARIndicator(high=df['high'], low=df['low'], close=df['close']).psar()
-    # ichimoku = ta.trend.IchimokuIndicator(high=df['high'], low=df['low'])
-    # df['ichimoku_base_line'] = ichimoku.ichimoku_base_line()
-    # df['ichimoku_conversion_line'] = ichimoku.ichimoku_conversion_line()
-    # df['ichimoku_a'] = ichimoku.ichimoku_a()
-    # df['ichimoku_b'] = ichimoku.ichimoku_b()
-    stochastic = ta.momentum.StochasticOscillator(high=df['high'], low=df['low'], close=df['close'])
-    df['stoch_k'] = stochastic.stoch()
-    df['stoch_d'] = stochastic.stoch_signal()
-    df['roc'] = ta.momentum.ROCIndicator(close=df['close']).roc()
-    
-    # if btc_data is not None:
-    #     # Align BTC data timestamps with the main DataFrame
-    #     btc_data = btc_data.reindex(df.index, method='nearest')
-        
-    #     # Add BTC price data as technical indicators
-    #     df['btc_open'] = btc_data['open']
-    #     df['btc_high'] = btc_data['high']
-    #     df['btc_low'] = btc_data['low']
-    #     df['btc_close'] = btc_data['close']
-    #     df['btc_volume'] = btc_data['volume']
-
-
-    # Check for NaN values before interpolation
-    if df.isnull().values.any():
-        logging.debug("NaN values detected before interpolation.")
-    
-    # Fill NaN values using interpolation
-    df.interpolate(method='linear', inplace=True)
-
-    # Fill any remaining NaN values at the beginning with the first valid observation
-    df.bfill(inplace=True)  # Backward fill to handle leading NaNs
+    df = add_indicators([df_original])[0]
 
     # Check for NaN values after filling
     if df.isnull().values.any():
         logging.warning("NaN values detected after filling.")
-        
-    
+
     logging.debug(f"Technical indicators added: {df.head()}")
     return df
 
@@ -206,11 +154,8 @@ def identify_patterns(df):
 
     return patterns
 
-def fetch_binance_klines(symbol, interval, limit=100, end_time=None, retries=1, backoff_factor=0.3):
+def fetch_binance_klines(symbol, interval, limit=100, end_time=None, retries=1, backoff_factor=0.3, cache=None, base_url=BINANCE_API_URL, fetcher=None, indicators=True):
     logging.debug(f"Fetching Binance klines for {symbol} with interval {interval} and limit {limit}")
-    
-    base_url = "https://api.binance.com/api/v3/klines"
-    klines = []
 
     # Convert end_time to datetime if it's a string
     if isinstance(end_time, str):
@@ -220,6 +165,40 @@ def fetch_binance_klines(symbol, interval, limit=100, end_time=None, retries=1,
     if isinstance(end_time, datetime):
         end_time = int(end_time.timestamp() * 1000)
 
+    # Serve the klines from the cache at KLINE_CACHE_PATH when there is one, fetching only what it misses
+    if cache is None:
+        cache = default_kline_cache()
+
+    # A KlineFetcher pages over its pooled session and rate limiter instead of plain requests
+    def fetch(limit, end_time):
+        if fetcher is not None:
+            return fetcher.fetch_ohlcv(symbol, interval, limit, end_time)
+        return fetch_binance_ohlcv(symbol, interval, limit, end_time, retries, backoff_factor, base_url)
+
+    if cache:
+        klines = cache.get(symbol, interval, limit, end_time, fetch)
+    else:
+        klines = fetch(limit, end_time)
+    
+    # preprocess_data adds the indicators of all the symbols together
+    if indicators:
+        klines = add_technical_indicators(klines)
+    
+    klines.set_index('timestamp', inplace=True)
+    
+    logging.info(f"Fetched {len(klines)} klines for {symbol} with interval {interval} and limit {limit}")
+    return pd.DataFrame(klines), klines.index[0], klines.index[-1]
+
+def fetch_binance_ohlcv(symbol, interval, limit=100, end_time=None, retries=1, backoff_factor=0.3, base_url=BINANCE_API_URL):
+    """
+    Page through the Binance klines endpoint, without indicators or caching.
+
+    :param end_time: Latest open time in epoch milliseconds, None for now.
+    :return: DataFrame with the 'timestamp' and OHLCV columns, sorted by open time.
+    """
+    url = f"{base_url}/api/v3/klines"
+    klines = []
+
     total_fetch_time = 0
     fetch_count = 0
 
@@ -235,7 +214,7 @@ def fetch_binance_klines(symbol, interval, limit=100, end_time=None, retries=1,
         for attempt in range(retries):
             try:
                 fetch_start_time = time.time()  # Record the start time of this fetch
-                response = requests.get(base_url, params=params, timeout=10)
+                response = requests.get(url, params=params, timeout=10)
                 response.raise_for_status()
                 fetch_end_time = time.time()  # Record the end time of this fetch
         
@@ -292,17 +271,10 @@ def fetch_binance_klines(symbol, interval, limit=100, end_time=None, retries=1,
         'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
     ])
     klines['timestamp'] = pd.to_datetime(klines['timestamp'], unit='ms')
-    klines[['open', 'high', 'low', 'close', 'volume']] = klines[['open', 'high', 'low', 'close', 'volume']].apply(pd.to_numeric)
-    klines = klines[['timestamp', 'open', 'high', 'low', 'close', 'volume']]
-    
-    klines = add_technical_indicators(klines)
-    
-    klines.set_index('timestamp', inplace=True)
-    
-    logging.info(f"Fetched {len(klines)} klines for {symbol} with interval {interval} and limit {limit}")
-    return pd.DataFrame(klines), klines.index[0], klines.index[-1]
+    klines[['open', 'high', 'low', 'close', 'volume']] = klines[['open', 'high', 'low', 'close', 'volume']].apply(pd.to_numeric).astype(np.float64)
+    return klines[['timestamp', 'open', 'high', 'low', 'close', 'volume']]
 
-def preprocess_data(target_num_symbols=10, symbols=['BTC', 'ETH'], interval='1d', limit=365, end_time=None):
+def preprocess_data(target_num_symbols=10, symbols=['BTC', 'ETH'], interval='1d', limit=365, end_time=None, fetcher=None):
     """
     Fetches and processes cryptocurrency data into a matrix of shape 
     (num_candles x num_symbols x num_features) using a common period.
@@ -311,6 +283,7 @@ def preprocess_data(target_num_symbols=10, symbols=['BTC', 'ETH'], interval='1d'
     :param interval: Time interval for each kline.
     :param limit: Maximum number of klines to fetch.
     :param end_time: End time for fetching klines.
+    :param fetcher: KlineFetcher fetching the symbols concurrently, a default one when None.
     :return: A 3D numpy array of shape (num_candles x num_symbols x num_features).
     """
     dataframes = {}
@@ -322,10 +295,22 @@ def preprocess_data(target_num_symbols=10, symbols=['BTC', 'ETH'], interval='1d'
     # Fetch extra data to create a buffer
     buffer_limit = limit + 10  # Fetch 10 extra candles as a buffer
 
+    # Fetch the symbols concurrently, then process them in order
+    own_fetcher = fetcher is None
+    if own_fetcher:
+        fetcher = KlineFetcher()
+    try:
+        results = fetcher.map(lambda symbol: fetch_binance_klines(symbol, interval, buffer_limit, end_time, fetcher=fetcher, indicators=False), symbols)
+    finally:
+        if own_fetcher:
+            fetcher.close()
+
     # Fetch data for each symbol
-    for symbol in symbols:
+    for symbol, result in zip(symbols, results):
         try:
-            df, start_datetime, end_datetime = fetch_binance_klines(symbol, interval, buffer_limit, end_time)
+            if isinstance(result, Exception):
+                raise result
+            df, start_datetime, end_datetime = result
             if not df.empty:
                 dataframes[symbol] = df
                 start_times.append(start_datetime)
@@ -341,6 +326,10 @@ def preprocess_data(target_num_symbols=10, symbols=['BTC', 'ETH'], interval='1d'
             logging.error(f"Error fetching data for {symbol}: {e}")
             continue
         
+    # Compute the indicators of all the symbols in one pass over (candles x symbols) blocks
+    for symbol, df in zip(valid_symbols, add_indicators([dataframes[symbol] for symbol in valid_symbols])):
+        dataframes[symbol] = df
+
     # # Update the number of symbols to only include valid ones
     # num_symbols = len(valid_symbols)
 
@@ -617,20 +606,112 @@ def handle_risk_management_1s_loop(symbol_index, position_type, low_prices, high
 
 #     return None, None, None, None
 
-# from risk_management import handle_risk_management_cython
+# Level order of the first hit kernels, also the precedence when one candle hits several levels
+RISK_LEVELS = ('max', 'liq', 'tp', 'sl')
+
+def first_hits_numpy(low_prices, high_prices, position_type, max_price, liq_price, tp_price, sl_price):
+    """
+    NumPy version of risk_management.first_hits, used when the extension is not built.
+
+    :param low_prices: 1s low prices.
+    :param high_prices: 1s high prices.
+    :param position_type: 1 for long, 0 for short.
+    :return: Array with the first index hitting the max, liq, tp and sl levels, -1 when not hit
+        or when an earlier candle already hit another level.
+    """
+    if position_type == 1:
+        crossed = np.stack((high_prices >= max_price, low_prices <= liq_price, high_prices >= tp_price, low_prices <= sl_price))
+    else:
+        crossed = np.stack((low_prices <= max_price, high_prices >= liq_price, low_prices <= tp_price, high_prices >= sl_price))
+    hit = crossed.any(axis=1)
+    if not np.any(hit):
+        return np.full(4, -1)
+    hits = np.where(hit, crossed.argmax(axis=1), -1)
+    hits[hits > hits[hit].min()] = -1
+    return hits
+
+def first_hits_ragged(low_prices, high_prices, offsets, position_types, max_prices, liq_prices, tp_prices, sl_prices):
+    """
+    first_hits_numpy for several positions at once, over their stacked 1s candles.
+
+    :param low_prices: Stacked 1s low prices of the positions.
+    :param high_prices: Stacked 1s high prices of the positions.
+    :param offsets: Start row of the candles of each position, followed by the number of rows.
+    :param position_types: Array of 1 for long and 0 for short, per position.
+    :param max_prices: Level arrays, per position, NaN when the position has no such level.
+    :return: Array of shape (positions, 4) with the first index hitting the max, liq, tp and sl
+        levels, relative to the start of each position, -1 when not hit or when an earlier
+        candle already hit another level.
+    """
+    starts, ends = offsets[:-1], offsets[1:]
+    lengths = ends - starts
+    is_long = np.repeat(np.asarray(position_types) == 1, lengths)
+
+    hits = np.full((len(starts), len(RISK_LEVELS)), -1)
+    for level, (prices, favorable) in enumerate(((max_prices, True), (liq_prices, False), (tp_prices, True), (sl_prices, False))):
+        prices = np.repeat(prices, lengths)
+        # Favorable levels are crossed upwards by longs, adverse levels downwards, the reverse for shorts
+        upward = is_long == favorable
+        crossed = np.flatnonzero(np.where(upward, high_prices >= prices, low_prices <= prices))
+        # First crossing at or after the start of each position, if it is before the end
+        first = np.searchsorted(crossed, starts)
+        candidate = crossed[np.minimum(first, len(crossed) - 1)] if len(crossed) else ends
+        hits[:, level] = np.where((first < len(crossed)) & (candidate < ends), candidate - starts, -1)
+
+    earliest = np.where(hits >= 0, hits, np.iinfo(hits.dtype).max).min(axis=1, keepdims=True)
+    hits[hits > earliest] = -1
+    return hits
+
+try:
+    from risk_management import first_hits as first_hits_compiled
+except ImportError:
+    first_hits_compiled = None
+
+def handle_risk_management_1s_kernel(symbol_index, position_type, low_prices, high_prices, sl_prices, tp_prices, liq_prices, max_prices, timestamps, first_hits=first_hits_numpy):
+    """Same result as handle_risk_management_1s_loop, with the 1s candles scanned by a first hit kernel."""
+    levels = (max_prices[symbol_index], liq_prices[symbol_index], tp_prices[symbol_index], sl_prices[symbol_index])
+    hits = first_hits(low_prices, high_prices, position_type, *levels)
+
+    for level, index in enumerate(hits):
+        if index >= 0:
+            logging.debug(f"{RISK_LEVELS[level]} hit at index {index} for symbol {symbol_index} with price {levels[level]} at {timestamps[index]}")
+            return symbol_index, levels[level], RISK_LEVELS[level], timestamps[index]
+
+    return None, None, None, None
+
+def get_risk_management_1s(kernel='auto'):
+    """
+    Select the function checking the 1s candles of a position.
+
+    :param kernel: 'cython' for the compiled kernel, 'numpy' for the NumPy fallback, 'loop' for
+        the pure Python loop, or 'auto' for the compiled kernel when it is built, NumPy otherwise.
+    :return: A function with the signature of handle_risk_management_1s_loop.
+    """
+    if kernel == 'auto':
+        kernel = 'cython' if first_hits_compiled is not None else 'numpy'
+    if kernel == 'loop':
+        return handle_risk_management_1s_loop
+    if kernel == 'numpy':
+        return handle_risk_management_1s_kernel
+    if kernel == 'cython':
+        if first_hits_compiled is None:
+            raise ValueError("The risk_management extension is not built, run: python setup.py build_ext --inplace")
+        return partial(handle_risk_management_1s_kernel, first_hits=first_hits_compiled)
+    raise ValueError(f"Unknown risk kernel: {kernel}")
 
 # Use the function as you would normally
-handle_risk_management_optimized = handle_risk_management_1s_loop
+handle_risk_management_optimized = get_risk_management_1s()
 
 # from parameters import selected_params, training_params
-from synthetic import create_synthetic_data
+from synthetic import create_regime_switching_data, create_synthetic_data, stream_regime_switching_data, stream_synthetic_data
+from market_store import temporary_market_data_provider
 from environment import TradingEnvironment
 from agent import TradingAgent
 from rewards import calculate_reward
 
 def initialize_environments(financial_params, training_params, plot_dir='.'):
-    selected_params = financial_params
-    selected_params.update(training_params)
+    # The parameters of the run, the ones of the caller are left untouched for the next run
+    selected_params = dict(financial_params, **training_params)
     full_data_matrix = None
     train_env = None
     eval_env = None
@@ -654,7 +735,20 @@ def initialize_environments(financial_params, training_params, plot_dir='.'):
         
     if financial_params['market_data'] == 'synthetic':
         # Generate synthetic data
-        data_matrix, full_data_matrix, timestamps, mapping, valid_symbols, market_conditions = create_synthetic_data(selected_params['limit'], selected_params['interval'], selected_params['synth_mode'])
+        if selected_params.get('synth_stream'):
+            # 1s candles written day by day to a store of the run, which the environments read them
+            # back from. The provider holds the store and is removed with the last environment
+            provider = temporary_market_data_provider(selected_params.get('market_data_memory_mb', 1024) * 2**20)
+            selected_params['market_store_path'] = provider.store.root
+            if selected_params['synth_mode'] == 'regimes':
+                data_matrix, timestamps, mapping, valid_symbols, market_conditions = stream_regime_switching_data(provider.store, selected_params['limit'], selected_params['interval'], n, seed=selected_params.get('seed'))
+            else:
+                data_matrix, timestamps, mapping, valid_symbols, market_conditions = stream_synthetic_data(provider.store, selected_params['limit'], selected_params['interval'], selected_params['synth_mode'], seed=selected_params.get('seed'))
+        elif selected_params['synth_mode'] == 'regimes':
+            # Correlated symbols switching between the market conditions of the training mode
+            data_matrix, full_data_matrix, timestamps, mapping, valid_symbols, market_conditions = create_regime_switching_data(selected_params['limit'], selected_params['interval'], n, seed=selected_params.get('seed'))
+        else:
+            data_matrix, full_data_matrix, timestamps, mapping, valid_symbols, market_conditions = create_synthetic_data(selected_params['limit'], selected_params['interval'], selected_params['synth_mode'], seed=selected_params.get('seed'))
         
         # Set up parameters
         selected_params['symbols'] = valid_symbols
@@ -691,11 +785,11 @@ def initialize_environments(financial_params, training_params, plot_dir='.'):
         test_env = TradingEnvironment(data_matrix=test_data_matrix, timestamps=test_timestamps, mapping=mapping, render_mode='human', params=selected_params, reward_function=calculate_reward, market_data=full_data_matrix)
 
         # Initialize the TradingAgent with the training and validation environments
-        agent = TradingAgent(train_env, eval_env, test_env, training_params, financial_params)
+        agent = TradingAgent(train_env, eval_env, test_env, training_params, selected_params)
 
     else:
         test_env = TradingEnvironment(data_matrix=data_matrix, timestamps=timestamps, mapping=mapping, render_mode='human', params=selected_params, reward_function=calculate_reward, market_data=full_data_matrix)
-        agent = TradingAgent(test_env, test_env, test_env, training_params, financial_params, plot_dir)
+        agent = TradingAgent(test_env, test_env, test_env, training_params, selected_params, plot_dir)
 
     return train_env, eval_env, test_env, agent, market_conditions
 
@@ -0,0 +1,434 @@
+import logging
+import os
+import shutil
+import tempfile
+import weakref
+import numpy as np
+import pandas as pd
+from gymnasium import spaces
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.vec_env import SubprocVecEnv
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+from environment import TradingEnvironment
+from market_index import FractalIndex, RollingStats
+from positions import PositionBook, epoch_ns
+from utilities import ACTIONS_AVAILABLE, get_liquidation_threshold
+
+# Fraction of the data in which the episodes of subprocess workers start when random_start is 0
+DEFAULT_RANDOM_START = 0.5
+
+class BatchedTradingEnv(VecEnv):
+    """
+    Vectorized environment simulating several independent trading episodes as arrays.
+
+    Balances, positions and cooldowns of the K episodes are stored as (K, num_symbols) arrays
+    and advanced together in a single step call, so stable-baselines3 gets batched
+    observations, rewards and dones without one TradingEnvironment per episode. The trading
+    rules are those of TradingEnvironment with basic risk management; opens walk the symbols
+    in order since each of them sizes its collateral from the balance left by the previous ones.
+    """
+    def __init__(self, data_matrix, timestamps, mapping, params, num_envs=1, reward_function=None):
+        self.params = params
+        self.data_matrix = data_matrix
+        self.timestamps = epoch_ns(timestamps)
+        self.mapping = mapping
+        self.reward_function = reward_function
+        self.render_mode = None
+        self.actions_available = ACTIONS_AVAILABLE
+
+        self.num_symbols = data_matrix.shape[1]
+        self.num_features = data_matrix.shape[2]
+        self.cooldown_period = self.params['cooldown_period']
+        self.kelly_window = self.params.get('kelly_window', 100)  # Number of recent trades used for the Kelly statistics
+
+        # Indexes shared by all episodes, used to size the positions and place SL and TP
+        self.rolling_stats = RollingStats(mapping)
+        self.rolling_stats.update(data_matrix)
+        self.fractal_index = FractalIndex(mapping)
+        self.fractal_index.update(data_matrix)
+
+        observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(self.num_symbols * self.num_features + 2 + self.num_symbols, ), dtype=np.float32)
+        action_space = spaces.MultiDiscrete([len(self.actions_available)] * self.num_symbols)
+        super().__init__(num_envs, observation_space, action_space)
+
+        # State of every episode
+        self.current_step = np.zeros(num_envs, dtype=int)
+        self.balance = np.full(num_envs, float(self.params['initial_balance']))
+        self.net_worth = self.balance.copy()
+        self.book = PositionBook((num_envs, self.num_symbols))
+        self.cooldowns = np.zeros((num_envs, self.num_symbols), dtype=int)
+        self.previous_returns = np.zeros((num_envs, self.num_symbols))
+        self.holding_duration = np.zeros((num_envs, self.num_symbols))
+
+        # Rounded PnL of the last trades of each episode, used for the Kelly fraction
+        self.trade_pnls = np.zeros((num_envs, self.kelly_window))
+        self.trade_count = np.zeros(num_envs, dtype=int)
+        self.trade_cursor = np.zeros(num_envs, dtype=int)
+
+        self.actions = None
+
+    @classmethod
+    def from_env(cls, env, num_envs):
+        """
+        Create a batched environment replaying the data and parameters of a TradingEnvironment.
+
+        :param env: The TradingEnvironment to copy.
+        :param num_envs: The number of episodes simulated together.
+        :return: A BatchedTradingEnv.
+        """
+        if not env.params['basic_risk_mgmt']:
+            logging.warning("The batched environment only supports basic risk management, 1s market data is ignored.")
+        return cls(env.data_matrix, env.timestamps, env.mapping, env.params, num_envs, env.reward_function)
+
+    def next_observation(self):
+        observation = self.data_matrix[self.current_step].reshape(self.num_envs, -1)
+        return np.concatenate((observation, self.balance[:, None], self.net_worth[:, None], self.book.position_size), axis=1).astype(np.float32)
+
+    def reset_envs(self, env_indices):
+        self.current_step[env_indices] = 0
+        self.balance[env_indices] = self.params['initial_balance']
+        self.net_worth[env_indices] = self.params['initial_balance']
+        self.book.clear(env_indices)
+
+    def reset(self):
+        self.reset_envs(slice(None))
+        self._reset_seeds()
+        self._reset_options()
+        return self.next_observation()
+
+    def calculate_risk_per_trade(self, env_indices):
+        """
+        Compute the Kelly-adjusted risk per trade of several episodes from their recent trades.
+
+        :param env_indices: Array of episode indices.
+        :return: Array of risk per trade values.
+        """
+        pnls = self.trade_pnls[env_indices]
+        recorded = np.arange(self.kelly_window) < self.trade_count[env_indices, None]
+        wins = recorded & (pnls > 0)
+        losses = recorded & (pnls < 0)
+        num_wins = wins.sum(axis=1)
+        num_losses = losses.sum(axis=1)
+
+        win_probability = np.divide(num_wins, num_wins + num_losses, out=np.zeros(len(pnls)), where=num_wins + num_losses > 0)
+        average_win = np.divide(np.sum(pnls, axis=1, where=wins), num_wins, out=np.zeros(len(pnls)), where=num_wins > 0)
+        average_loss = np.divide(np.sum(pnls, axis=1, where=losses), num_losses, out=np.zeros(len(pnls)), where=num_losses > 0)
+        win_loss_ratio = np.divide(average_win, np.abs(average_loss), out=np.zeros(len(pnls)), where=average_loss != 0)
+
+        kelly_fraction = np.divide(win_probability * (win_loss_ratio + 1) - 1, win_loss_ratio, out=np.zeros(len(pnls)), where=win_loss_ratio != 0)
+        kelly_fraction = np.clip(self.params['kelly_fraction'] * kelly_fraction, 0, 1)
+        return np.clip(kelly_fraction, self.params['risk_per_trade_min'], self.params['risk_per_trade_max'])
+
+    def calculate_leverage(self, steps, symbol_index, collateral):
+        """
+        Compute the leverage of new positions on one symbol, as TradingEnvironment.calculate_leverage does.
+
+        :param steps: Array of current steps of the episodes.
+        :param symbol_index: The index of the symbol.
+        :param collateral: Array of collaterals aligned with steps.
+        :return: Array of integer leverages.
+        """
+        candle = self.data_matrix[steps, symbol_index]
+        close = candle[:, self.mapping['close']]
+        window = self.params.get('leverage_window')
+        close_std = self.rolling_stats.std('close', steps, symbol_index, window)
+
+        confidence_score = (
+            (candle[:, self.mapping['vwap']] > close) * 0.15 +
+            (candle[:, self.mapping['rsi']] < 30) * 0.15 +
+            (candle[:, self.mapping['macd_hist']] > 0) * 0.15 +
+            (close < candle[:, self.mapping['boll_lband']]) * 0.15 +
+            (candle[:, self.mapping['atr']] < self.rolling_stats.mean('atr', steps, symbol_index, window)) * 0.15 +
+            (candle[:, self.mapping['volume']] > self.rolling_stats.mean('volume', steps, symbol_index, window)) * 0.25
+        )
+
+        min_leverage = self.params.get('leverage_min', 1)
+        max_leverage = self.params.get('leverage_max', 150)
+        leverage = np.divide(collateral, close_std, out=np.zeros(len(steps)), where=close_std > 0) * (1 + confidence_score)
+        # Without enough history to measure volatility, stay at the minimum leverage
+        leverage = np.where(close_std > 0, leverage, min_leverage)
+        return np.round(np.clip(leverage, min_leverage, max_leverage)).astype(int)
+
+    def close_positions(self, env_indices, symbol_indices, exit_prices):
+        """
+        Close positions of several episodes and record their PnL.
+
+        :param env_indices: Array of episode indices, in increasing order.
+        :param symbol_indices: Array of symbol indices aligned with env_indices.
+        :param exit_prices: Array of exit prices aligned with env_indices.
+        """
+        if len(env_indices) == 0:
+            return
+
+        index = (env_indices, symbol_indices)
+        side = self.book.side[index]
+        position_size = self.book.position_size[index]
+
+        # Adjust exit price for slippage and bid-ask spread, then compute PnL, fees and borrowing costs
+        costs = self.params['slippage'] + self.params['bid_ask_spread']
+        adjusted_exit_price = np.where(side == 1, exit_prices * (1 - costs), exit_prices * (1 + costs))
+        pnl = (adjusted_exit_price - self.book.entry_price[index]) * position_size * self.book.leverage[index] * side
+        fee = adjusted_exit_price * self.params['trading_fee'] * position_size
+        close_time = self.timestamps[self.current_step[env_indices]] // 10**9
+        open_time = self.book.open_time[index] // 10**9
+        borrowing_fee = self.book.borrowing_fee[index] * (close_time - open_time) / 3600
+
+        np.add.at(self.balance, env_indices, position_size * adjusted_exit_price + pnl - fee - borrowing_fee)
+
+        # Append the PnL to the trade ring of each episode, in symbol order
+        rank = np.arange(len(env_indices)) - np.searchsorted(env_indices, env_indices)
+        self.trade_pnls[env_indices, (self.trade_cursor[env_indices] + rank) % self.kelly_window] = np.round(pnl, 2)
+        num_trades = np.bincount(env_indices, minlength=self.num_envs)
+        self.trade_cursor = (self.trade_cursor + num_trades) % self.kelly_window
+        self.trade_count = np.minimum(self.trade_count + num_trades, self.kelly_window)
+
+        self.book.clear(index)
+        self.cooldowns[index] = self.cooldown_period
+
+    def open_positions(self, env_indices, symbol_index, side, current_prices):
+        """
+        Open a position on one symbol for several episodes.
+
+        :param env_indices: Array of episode indices.
+        :param symbol_index: The index of the symbol.
+        :param side: Array of sides (1 for long, -1 for short) aligned with env_indices.
+        :param current_prices: Array of current prices aligned with env_indices.
+        """
+        risk_per_trade = self.calculate_risk_per_trade(env_indices)
+        collateral = np.clip(risk_per_trade * self.balance[env_indices], self.params['collateral_min'], self.params['collateral_max'])
+
+        leverage = self.calculate_leverage(self.current_step[env_indices], symbol_index, collateral)
+
+        # Positions are only opened with enough leverage
+        valid = leverage >= 35
+        env_indices, side, current_prices = env_indices[valid], side[valid], current_prices[valid]
+        collateral, risk_per_trade = collateral[valid], risk_per_trade[valid]
+        leverage = leverage[valid] * self.params['boost_factor']
+        position_size = collateral / current_prices
+        long = side == 1
+
+        # Compute SL and TP from the fractals when both are known, from percentages otherwise
+        sl_percentage = self.params['sl_mult_perc'] / leverage
+        tp_percentage = self.params['tp_mult_perc'] / leverage
+        sl_price = current_prices * (1 - sl_percentage * side)
+        tp_price = current_prices * (1 + tp_percentage * side)
+        if self.params['risk_mgmt'] == 'fractals':
+            fractal_high, fractal_low = self.fractal_index.levels_at(self.current_step[env_indices], symbol_index)
+            found = ~np.isnan(fractal_high) & ~np.isnan(fractal_low)
+            sl_price = np.where(found, np.where(long, fractal_low * 1.05, fractal_high * 0.95), sl_price)
+            tp_price = np.where(found, np.where(long, fractal_high * 0.95, fractal_low * 1.05), tp_price)
+
+        liq_percentage = np.vectorize(get_liquidation_threshold, otypes=[float])(leverage) / 100 / leverage
+        liq_price = current_prices * (1 - liq_percentage * side)
+        max_price = current_prices * (1 + 9 / leverage * side)
+
+        # Fall back to percentages when SL or TP are on the wrong side of the price
+        sl_price = np.where((sl_price - current_prices) * side >= 0, current_prices * (1 - sl_percentage * side), sl_price)
+        tp_price = np.where((tp_price - current_prices) * side <= 0, current_prices * (1 + tp_percentage * side), tp_price)
+
+        # Adjust current price for slippage and bid-ask spread, then pay fees
+        adjusted_price = current_prices * (1 + (self.params['slippage'] + self.params['bid_ask_spread']) * side)
+        fee = adjusted_price * self.params['trading_fee'] * position_size
+        borrowing_fee = collateral * self.params['borrowing_fee_per_hour']
+        self.balance[env_indices] -= fee + borrowing_fee
+
+        self.book.open(
+            (env_indices, symbol_index),
+            side,
+            open_step=self.current_step[env_indices],
+            open_time=self.timestamps[self.current_step[env_indices]],
+            entry_price=adjusted_price,
+            leverage=np.round(leverage),
+            collateral=np.round(collateral),
+            position_size=np.round(position_size, 3),
+            sl_price=sl_price,
+            tp_price=tp_price,
+            liq_price=liq_price,
+            max_price=max_price,
+            borrowing_fee=borrowing_fee,
+            balance=self.balance[env_indices],
+            risk_per_trade=risk_per_trade,
+        )
+        self.balance[env_indices] -= collateral
+        self.cooldowns[env_indices, symbol_index] = self.cooldown_period
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        action = np.array(self.actions).reshape(self.num_envs, self.num_symbols)
+        available = self.actions_available
+        prices = self.data_matrix[self.current_step]
+        current_prices = prices[:, :, self.mapping['close']]
+
+        # Handle SL and TP for each position before processing actions
+        hit, exit_prices, _ = self.book.level_hits(slice(None), prices[:, :, self.mapping['low']], prices[:, :, self.mapping['high']])
+        env_indices, symbol_indices = np.nonzero(hit)
+        self.close_positions(env_indices, symbol_indices, exit_prices[hit])
+
+        # Symbols in cooldown hold for this step
+        cooling = self.cooldowns > 0
+        self.cooldowns[cooling] -= 1
+        action[cooling] = available['hold']
+
+        # Execute the action of each symbol for all episodes at once
+        for i in range(self.num_symbols):
+            symbol_action = action[:, i]
+            is_open = self.book.side[:, i] != 0
+            closing = np.flatnonzero((symbol_action == available['close']) & is_open)
+            self.close_positions(closing, np.full(len(closing), i), current_prices[closing, i])
+
+            opening = (symbol_action == available['long']) | (symbol_action == available['short']) | ((symbol_action == available['hedge']) & is_open)
+            opening &= self.balance >= self.params['collateral_min']
+            # Long and short open their own side, hedge flips the side of the open position
+            side = np.where(symbol_action == available['long'], 1, np.where(symbol_action == available['short'], -1, -self.book.side[:, i]))
+
+            exiting = np.flatnonzero(opening & is_open)
+            self.close_positions(exiting, np.full(len(exiting), i), current_prices[exiting, i])
+            opening = np.flatnonzero(opening)
+            self.open_positions(opening, i, side[opening], current_prices[opening, i])
+
+        # Update net worth and move to the next step
+        self.net_worth = self.balance + np.sum(self.book.position_size * current_prices, axis=1)
+        self.current_step += 1
+
+        max_steps_reached = self.current_step >= len(self.timestamps) - 1
+        net_worth_below_min = self.net_worth < self.params['collateral_min']
+        dones = max_steps_reached | net_worth_below_min
+
+        # Calculate reward
+        if self.reward_function:
+            rewards = np.asarray(self.reward_function(self, action), dtype=np.float32)
+            # A scalar reward would be broadcast to every episode
+            if rewards.shape != (self.num_envs,):
+                raise ValueError(f"The reward function {getattr(self.reward_function, '__name__', self.reward_function)} returned a reward of shape {rewards.shape}, "
+                                 f"the batched environment needs one reward per episode, of shape ({self.num_envs},)")
+        else:
+            rewards = (self.net_worth - self.params['initial_balance']).astype(np.float32)
+
+        observations = self.next_observation()
+        infos = [{'TimeLimit.truncated': bool(max_steps_reached[k] and not net_worth_below_min[k])} for k in range(self.num_envs)]
+
+        # Finished episodes restart right away, their last observation goes in the infos
+        for k in np.flatnonzero(dones):
+            infos[k]['terminal_observation'] = observations[k].copy()
+        if np.any(dones):
+            self.reset_envs(dones)
+            observations[dones] = self.next_observation()[dones]
+
+        return observations, rewards, dones, infos
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        # Attributes are shared by the episodes, they can only be set for all of them
+        if indices is not None and sorted(set(self._get_indices(indices))) != list(range(self.num_envs)):
+            raise ValueError("The batched environment can only set an attribute for all its episodes")
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self, method_name)(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+class SharedDataMatrix:
+    """
+    Data matrix, and optionally the 1s market data, written once to memory-mapped .npy files.
+
+    Only the file paths are pickled, so subprocess workers map the same pages read-only instead
+    of each receiving a copy of the (candles, symbols, features) array or of the 1s DataFrames.
+    The files are removed by close, or when the object is garbage collected in the process
+    that created them.
+    """
+    MARKET_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+    def __init__(self, data_matrix, directory=None, market_data=None):
+        self.directory = tempfile.mkdtemp(prefix='shared_data_', dir=directory)
+        self.path = os.path.join(self.directory, 'data_matrix.npy')
+        np.save(self.path, data_matrix)
+
+        # 1s candles of every symbol as (columns, seconds) prices and int64 times, None kept as is
+        self.market_paths = None
+        if market_data is not None and len(market_data) > 0:
+            self.market_paths = []
+            for symbol_index, df in enumerate(market_data):
+                if df is None:
+                    self.market_paths.append(None)
+                    continue
+                times_path = os.path.join(self.directory, f'market_times_{symbol_index}.npy')
+                values_path = os.path.join(self.directory, f'market_values_{symbol_index}.npy')
+                np.save(times_path, epoch_ns(df.index))
+                np.save(values_path, np.stack([df[column].to_numpy(dtype=np.float64) for column in self.MARKET_COLUMNS if column in df.columns]))
+                self.market_paths.append((times_path, values_path, [column for column in self.MARKET_COLUMNS if column in df.columns]))
+        self.finalizer = weakref.finalize(self, shutil.rmtree, self.directory, ignore_errors=True)
+
+    def __getstate__(self):
+        # Workers only map the files, the process that wrote them removes them
+        state = self.__dict__.copy()
+        state['finalizer'] = None
+        return state
+
+    def load(self):
+        return np.load(self.path, mmap_mode='r')
+
+    def load_market_data(self):
+        """DataFrames of the 1s candles over the memory maps, None when no market data was shared."""
+        if self.market_paths is None:
+            return None
+        market_data = []
+        for paths in self.market_paths:
+            if paths is None:
+                market_data.append(None)
+                continue
+            times_path, values_path, columns = paths
+            values = np.load(values_path, mmap_mode='r')
+            index = pd.DatetimeIndex(np.load(times_path).view('datetime64[ns]'), name='timestamp')
+            market_data.append(pd.DataFrame(dict(zip(columns, values)), index=index, copy=False))
+        return market_data
+
+    def close(self):
+        # Only the process that wrote the files removes them, the other workers still map them
+        if self.finalizer is not None:
+            self.finalizer()
+
+class TradingEnvFactory:
+    """Picklable callable creating a monitored TradingEnvironment over shared data inside a worker."""
+    def __init__(self, shared_data, timestamps, mapping, params, reward_function=None):
+        self.shared_data = shared_data
+        self.timestamps = timestamps
+        self.mapping = mapping
+        self.params = params
+        self.reward_function = reward_function
+
+    def __call__(self):
+        env = TradingEnvironment(self.shared_data.load(), self.timestamps, self.mapping, params=self.params, reward_function=self.reward_function, market_data=self.shared_data.load_market_data())
+        return Monitor(env)
+
+def make_subproc_env(env, num_workers, seed=None, start_method=None):
+    """
+    Run copies of a TradingEnvironment in subprocesses sharing one memory-mapped data matrix.
+
+    Worker k is seeded with seed + k, which together with params['random_start'] makes the
+    workers replay different episodes. With a random_start of 0 every worker would replay the
+    same episode, so the workers then start in the first DEFAULT_RANDOM_START of the data.
+
+    :param env: The TradingEnvironment to copy.
+    :param num_workers: The number of subprocesses.
+    :param seed: Optional base seed of the workers.
+    :param start_method: Multiprocessing start method, the platform default if None.
+    :return: Tuple of (SubprocVecEnv, SharedDataMatrix); close the latter once training is over.
+    """
+    params = env.params
+    if num_workers > 1 and not params.get('random_start', 0):
+        logging.warning(f"random_start is 0, the subprocess workers would all replay the same episode. Using {DEFAULT_RANDOM_START} instead.")
+        params = dict(params, random_start=DEFAULT_RANDOM_START)
+    shared_data = SharedDataMatrix(env.data_matrix, market_data=getattr(env, 'market_data', None))
+    env_fns = [TradingEnvFactory(shared_data, env.timestamps, env.mapping, params, env.reward_function) for _ in range(num_workers)]
+    vec_env = SubprocVecEnv(env_fns, start_method=start_method)
+    vec_env.seed(seed)
+    return vec_env, shared_data
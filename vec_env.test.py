@@ -0,0 +1,124 @@
+import gc
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from utilities import ACTIONS_AVAILABLE
+from parameters import selected_params, training_params
+from environment import TradingEnvironment
+from rewards import calculate_reward
+from market_fixtures import make_market
+import os
+from vec_env import BatchedTradingEnv, SharedDataMatrix, make_subproc_env
+from agent import TradingAgent
+from stable_baselines3 import PPO
+from stable_baselines3.common.vec_env import DummyVecEnv
+
+class TestBatchedTradingEnv(unittest.TestCase):
+    def setUp(self):
+        self.data_matrix, self.timestamps, self.mapping = make_market()
+        self.params = dict(selected_params)
+        self.params.update({'symbols': [f'SYM{i}' for i in range(self.data_matrix.shape[1])], 'basic_risk_mgmt': True, 'boost_factor': 1})
+
+    def make_env(self):
+        return TradingEnvironment(self.data_matrix, self.timestamps, self.mapping, params=self.params, reward_function=calculate_reward)
+
+    def test_matches_single_environments(self):
+        for risk_mgmt in ['fractals', 'percentage']:
+            self.params['risk_mgmt'] = risk_mgmt
+            envs = [self.make_env() for _ in range(3)]
+            batched_env = BatchedTradingEnv.from_env(envs[0], len(envs))
+            observations = batched_env.reset()
+            for k, env in enumerate(envs):
+                np.testing.assert_allclose(observations[k], env.reset()[0].astype(np.float32))
+
+            rng = np.random.default_rng(1)
+            for _ in range(250):
+                actions = rng.integers(0, len(ACTIONS_AVAILABLE), (len(envs), envs[0].num_symbols))
+                observations, rewards, dones, infos = batched_env.step(actions.copy())
+                for k, env in enumerate(envs):
+                    observation, reward, done, _, _ = env.step(actions[k].copy())
+                    self.assertEqual(done, dones[k])
+                    self.assertAlmostEqual(reward, rewards[k], delta=1e-5 * max(1, abs(reward)))
+                    if done:
+                        np.testing.assert_allclose(infos[k]['terminal_observation'], observation.astype(np.float32), rtol=1e-6)
+                        env.reset()
+                    else:
+                        np.testing.assert_allclose(batched_env.balance[k], env.balance, rtol=1e-9)
+                        np.testing.assert_allclose(batched_env.book.position_size[k], env.book.position_size)
+
+    def test_scalar_rewards_are_rejected(self):
+        env = BatchedTradingEnv(self.data_matrix, self.timestamps, self.mapping, self.params, num_envs=3, reward_function=lambda env, action: 0.0)
+        env.reset()
+        with self.assertRaises(ValueError):
+            env.step(np.zeros((3, env.num_symbols), dtype=int))
+
+        env.set_attr('cooldown_period', 2, indices=[0, 1, 2])
+        self.assertEqual(env.cooldown_period, 2)
+        with self.assertRaises(ValueError):
+            env.set_attr('cooldown_period', 3, indices=[1])
+
+    def test_shared_data_matrix(self):
+        shared_data = SharedDataMatrix(self.data_matrix)
+        data_matrix = shared_data.load()
+        np.testing.assert_array_equal(data_matrix, self.data_matrix)
+        self.assertFalse(data_matrix.flags.writeable)
+        shared_data.close()
+        self.assertFalse(os.path.exists(shared_data.path))
+
+        # 1s market data goes through memory-mapped files too
+        seconds = pd.date_range('2024-01-01', periods=120, freq='1s', name='timestamp')
+        market_data = [pd.DataFrame({'open': np.arange(120.0), 'high': np.arange(120.0) + 1, 'low': np.arange(120.0) - 1, 'close': np.arange(120.0), 'volume': 1.0}, index=seconds), None]
+        shared_data = SharedDataMatrix(self.data_matrix, market_data=market_data)
+        copy = pickle.loads(pickle.dumps(shared_data))
+        loaded = copy.load_market_data()
+        # Closing the copy of a worker leaves the files to the process that wrote them
+        copy.close()
+        self.assertTrue(os.path.exists(shared_data.path))
+        pd.testing.assert_frame_equal(loaded[0], market_data[0], check_freq=False)
+        self.assertIsNone(loaded[1])
+        self.assertIsInstance(loaded[0]['low'].to_numpy().base, np.memmap)
+
+        # The files are removed with the object when close is never called
+        directory = shared_data.directory
+        del shared_data, copy, loaded
+        gc.collect()
+        self.assertFalse(os.path.exists(directory))
+
+    def test_subproc_workers_start_differently(self):
+        self.params['random_start'] = 0.5
+        vec_env, shared_data = make_subproc_env(self.make_env(), 3, seed=7, start_method='fork')
+        try:
+            vec_env.reset()
+            start_steps = vec_env.get_attr('current_step')
+            self.assertEqual(len(set(start_steps)), 3)
+            self.assertTrue(all(step < len(self.timestamps) // 2 for step in start_steps))
+        finally:
+            vec_env.close()
+            shared_data.close()
+
+    def test_subproc_workers_never_replay_the_same_episode(self):
+        self.params['random_start'] = 0
+        with self.assertLogs(level='WARNING'):
+            vec_env, shared_data = make_subproc_env(self.make_env(), 3, seed=7, start_method='fork')
+        try:
+            vec_env.reset()
+            self.assertEqual(len(set(vec_env.get_attr('current_step'))), 3)
+        finally:
+            vec_env.close()
+            shared_data.close()
+
+    def test_evaluation_runs_start_no_workers(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        env = self.make_env()
+        PPO('MlpPolicy', env, seed=0).save(os.path.join(directory, self.params['model_name']))
+        training = dict(training_params, train_model=False, vec_env='subproc', num_workers=3)
+        agent = TradingAgent(env, env, env, training, self.params, directory)
+        self.assertIsNone(agent.shared_data)
+        self.assertIsInstance(agent.train_env.venv, DummyVecEnv)
+
+if __name__ == '__main__':
+    unittest.main()